@@ -9,9 +9,17 @@ from __future__ import annotations
 __author__ = "Dima Zavin"
 __copyright__ = "Copyright 2016, Dima Zavin"
 
+import collections
+import concurrent.futures
 from datetime import timedelta
+import functools
 from enum import Enum
+import hashlib
+import heapq
+import json
 import logging
+import os
+import random
 import re
 import socket
 import threading
@@ -19,8 +27,12 @@ import time
 from xml.etree import ElementTree as ET
 
 import asyncio
+import bisect
 import telnetlib3
-from typing import Any, Callable, Dict, Type, List, Optional, Tuple, Union, TYPE_CHECKING, cast
+from typing import Any, AsyncGenerator, BinaryIO, Callable, Deque, Dict, Iterable, Iterator, Type, TypeVar, List, Mapping, Optional, Sequence, Set, Tuple, Union, TYPE_CHECKING, cast
+
+if TYPE_CHECKING:
+  from .state import StateStore
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -66,58 +78,506 @@ class InvalidSubscription(LutronException):
   pass
 
 
-class LutronConnection(threading.Thread):
-  """Encapsulates the connection to the Lutron controller."""
+class QueryTimeoutError(LutronException):
+  """Raised when the controller did not answer a query in time."""
+  pass
+
+
+class SendPriority(Enum):
+  """Order in which a connection writes queued commands.
+
+  USER: Commands that change something (#), written first.
+  BACKGROUND: Queries (?), e.g. from async_refresh_all(), written once no USER
+      command is waiting.
+  """
+  USER = 0
+  BACKGROUND = 1
+
+
+class WriterStats(object):
+  """Counters describing how outgoing commands were queued and coalesced
+  into socket writes by a connection's writer task."""
+
+  def __init__(self) -> None:
+    self.commands = 0
+    self.batches = 0
+    self.bytes = 0
+    self.max_batch = 0
+    # Number of writes performed, keyed by how many commands each carried.
+    self.batch_sizes: Dict[int, int] = {}
+    # Queued commands replaced by a newer one before they were written.
+    self.superseded = 0
+    # Times the writer had to wait for the rate limit.
+    self.throttled = 0
+    self.max_depth = 0
+    # Seconds commands spent queued, per priority.
+    self.total_wait: Dict[SendPriority, float] = {p: 0.0 for p in SendPriority}
+    self.max_wait: Dict[SendPriority, float] = {p: 0.0 for p in SendPriority}
+    self.written: Dict[SendPriority, int] = {p: 0 for p in SendPriority}
+    # Commands kept while disconnected, see offline_buffer, and what became
+    # of them: replaced by a newer one for the same target, dropped because
+    # the buffer was full, too old to replay, or replayed after login.
+    self.buffered = 0
+    self.collapsed = 0
+    self.overflowed = 0
+    self.expired = 0
+    self.replayed = 0
+
+  @property
+  def average_batch(self) -> float:
+    """Average number of commands per socket write."""
+    return self.commands / self.batches if self.batches else 0.0
+
+  def average_wait(self, priority: SendPriority) -> float:
+    """Average time commands of the given priority spent queued."""
+    written = self.written[priority]
+    return self.total_wait[priority] / written if written else 0.0
+
+  def _record(self, commands: int, nbytes: int) -> None:
+    self.commands += commands
+    self.batches += 1
+    self.bytes += nbytes
+    self.max_batch = max(self.max_batch, commands)
+    self.batch_sizes[commands] = self.batch_sizes.get(commands, 0) + 1
+
+  def _record_wait(self, priority: SendPriority, wait: float) -> None:
+    self.written[priority] += 1
+    self.total_wait[priority] += wait
+    if wait > self.max_wait[priority]:
+      self.max_wait[priority] = wait
+
+
+class RttHistogram(object):
+  """Round-trip times of the last size samples, bucketed by BOUNDS."""
+  # Upper bounds of the buckets in seconds; the last bucket is unbounded.
+  BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+  def __init__(self, size: int = 256) -> None:
+    self._samples: Deque[float] = collections.deque(maxlen=size)
+    self._counts = [0] * (len(self.BOUNDS) + 1)
+
+  def __len__(self) -> int:
+    return len(self._samples)
+
+  def add(self, rtt: float) -> None:
+    """Records a sample, evicting the oldest one once size are held."""
+    samples = self._samples
+    if len(samples) == samples.maxlen:
+      self._counts[bisect.bisect_left(self.BOUNDS, samples[0])] -= 1
+    samples.append(rtt)
+    self._counts[bisect.bisect_left(self.BOUNDS, rtt)] += 1
+
+  @property
+  def last(self) -> Optional[float]:
+    return self._samples[-1] if self._samples else None
+
+  @property
+  def buckets(self) -> List[Tuple[Optional[float], int]]:
+    """Returns (upper bound, count) for every bucket, None being the
+    unbounded one."""
+    bounds: List[Optional[float]] = list(self.BOUNDS)
+    return list(zip(bounds + [None], self._counts))
+
+  def percentile(self, p: float) -> Optional[float]:
+    """Returns the p-th (0-100) percentile of the held samples."""
+    if not self._samples:
+      return None
+    ordered = sorted(self._samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class HeartbeatStats(object):
+  """Counters of a connection's heartbeat, see _LutronConnectionBase."""
+
+  def __init__(self) -> None:
+    self.probes = 0
+    self.replies = 0
+    # Probes that went unanswered, each of which dropped the session.
+    self.failures = 0
+    self.rtt = RttHistogram()
+
+
+class _TokenBucket(object):
+  """Allows rate commands per second on average and bursts of up to burst
+  commands."""
+  __slots__ = ('rate', 'burst', '_tokens', '_stamp')
+
+  def __init__(self, rate: float, burst: int) -> None:
+    self.rate = rate
+    self.burst = max(1, burst)
+    self._tokens = float(self.burst)
+    self._stamp = time.monotonic()
+
+  def available(self) -> int:
+    """Returns how many commands may be written right now."""
+    now = time.monotonic()
+    self._tokens = min(float(self.burst), self._tokens + (now - self._stamp) * self.rate)
+    self._stamp = now
+    return int(self._tokens)
+
+  def consume(self, commands: int) -> None:
+    self._tokens -= commands
+
+  def delay(self) -> float:
+    """Returns the seconds until the next command may be written."""
+    return max(0.0, (1.0 - self._tokens) / self.rate)
+
+
+class _QueuedCommand(object):
+  """A command waiting for the writer task. data is None once a newer
+  command superseded it."""
+  __slots__ = ('data', 'callbacks', 'key', 'priority', 'queued_at')
+
+  def __init__(self, data: bytes, callbacks: Optional[List[Callable[[], None]]], key: Optional[bytes],
+               priority: SendPriority) -> None:
+    self.data: Optional[bytes] = data
+    self.callbacks = callbacks
+    self.key = key
+    self.priority = priority
+    self.queued_at = time.monotonic()
+
+
+def _call_all(callbacks: List[Callable[[], None]]) -> None:
+  for callback in callbacks:
+    callback()
+
+
+class _LutronConnectionBase(object):
+  """Protocol logic shared by LutronConnection and AsyncLutronConnection.
+
+  Subclasses decide which event loop the coroutines below run on and how
+  connection state changes are signalled to whoever is waiting in connect().
+
+  Outgoing commands are not written one at a time. They are appended to a
+  queue that a single writer task drains: everything queued since its last
+  write (up to max_batch_commands commands / max_batch_bytes bytes) goes out
+  as one write followed by one drain. A command may carry an on_written
+  callback, invoked on the connection's loop once the write containing it
+  has been drained; the query correlator uses it to timestamp queries.
+
+  The queue is ordered by SendPriority, so queries never hold up commands
+  that change something. A command that only sets state (an output level or
+  an LED) replaces a queued one for the same output or LED, see
+  _supersede_key(). If rate_limit is set, at most that many commands per
+  second (with bursts of rate_burst) are written.
+
+  If heartbeat_interval is set, a session that received nothing for that
+  many seconds is probed with HEARTBEAT. Should nothing at all arrive within
+  heartbeat_timeout seconds after that, the session is considered dead and
+  reconnected, rather than waiting for TCP keepalive to notice. The probe's
+  round-trip times are kept in heartbeat_stats. Replies to the probe are
+  handed on like any other line.
+
+  If offline_buffer is set, up to that many commands sent while the session
+  is down (or still queued when it dropped) are kept and replayed in order
+  once the next login and monitoring setup completed. Commands older than
+  offline_ttl seconds by then are dropped, and a state-setting command
+  replaces a kept one for the same target like in the writer queue.
+  Queries are never kept.
+  """
   USER_PROMPT = b'login: '
   PW_PROMPT = b'password: '
   PROMPT = re.compile(rb'([GQ]NET>|login: )')
-
-  def __init__(self, host: str, user: str, password: str, recv_callback: Callable[[str], None], connection_factory: Any = telnetlib3.open_connection) -> None:
-    """Initializes the lutron connection, doesn't actually connect."""
-    threading.Thread.__init__(self)
-
+  # Executes that only set state, as {command: (action field, action)}.
+  # Everything up to the action field identifies what they set.
+  SUPERSEDABLE = {b'#OUTPUT': (2, b'1'), b'#DEVICE': (3, b'9')}
+  # #MONITORING types enabled by default: button presses, LEDs, zone levels,
+  # occupancy and scenes.
+  MONITORING_TYPES = (3, 4, 5, 6, 8)
+  # Cheap query used as heartbeat (the controller's time) and its reply.
+  HEARTBEAT = b'?SYSTEM,1\r\n'
+  HEARTBEAT_REPLY = b'~SYSTEM,1,'
+
+  def __init__(self, host: str, user: str, password: str, recv_callback: Callable[[str], None], connection_factory: Any,
+               max_batch_commands: int, max_batch_bytes: int,
+               recv_bytes_callback: Optional[Callable[[bytes], None]],
+               rate_limit: Optional[float], rate_burst: int, monitoring: bool,
+               reconnect_delay: float, max_reconnect_delay: float,
+               reconnect_callback: Optional[Callable[[], None]],
+               heartbeat_interval: Optional[float], heartbeat_timeout: float,
+               offline_buffer: int, offline_ttl: float) -> None:
+    """Initializes the lutron connection, doesn't actually connect.
+
+    If recv_bytes_callback is given it is invoked with each raw received line
+    (including the line terminator) instead of recv_callback, skipping the
+    decode to str. Unless monitoring is set the session only receives the
+    replies to its own queries, not status updates.
+
+    After a dropped session the first reconnect is immediate; further
+    attempts back off exponentially from reconnect_delay up to
+    max_reconnect_delay seconds, with jitter. reconnect_callback is invoked on
+    the connection's loop whenever a session was re-established."""
     self._host = host
     self._user = user.encode('ascii')
     self._password = password.encode('ascii')
     self._reader: Optional[telnetlib3.TelnetReader] = None
     self._writer: Optional[telnetlib3.TelnetWriter] = None
     self._connected = False
-    self._lock = threading.Lock()
-    self._connect_cond = threading.Condition(lock=self._lock)
     self._recv_cb = recv_callback
+    self._recv_bytes_cb = recv_bytes_callback
     self._connection_factory = connection_factory
     self._done = False
-    self._loop = asyncio.new_event_loop()
     self._exception: Optional[LutronException] = None
+    self.max_batch_commands = max_batch_commands
+    self.max_batch_bytes = max_batch_bytes
+    self.writer_stats = WriterStats()
+    self.rate_limit = rate_limit
+    self.rate_burst = rate_burst
+    self.monitoring = monitoring
+    # #MONITORING types enabled after login, see _monitoring_changes().
+    self.monitoring_types: Tuple[int, ...] = self.MONITORING_TYPES
+    self.reconnect_delay = reconnect_delay
+    self.max_reconnect_delay = max_reconnect_delay
+    self.reconnects = 0
+    self._reconnect_cb = reconnect_callback
+    self._last_fast_reconnect: Optional[float] = None
+    self.lines_received = 0
+    # time.monotonic() of the last received line, None before the first.
+    self.last_received: Optional[float] = None
+    self.heartbeat_interval = heartbeat_interval
+    self.heartbeat_timeout = heartbeat_timeout
+    self.heartbeat_stats = HeartbeatStats()
+    # Whether a probe went out since the last received line.
+    self._probe_pending = False
+    # time.monotonic() the unanswered probes were written, oldest first,
+    # for their RTT.
+    self._probes_written: Deque[float] = collections.deque(maxlen=8)
+    self.offline_buffer = offline_buffer
+    self.offline_ttl = offline_ttl
+    # Commands kept while disconnected, oldest first, keyed by
+    # _supersede_key() or by the command itself.
+    self._offline: collections.OrderedDict[Any, _QueuedCommand] = collections.OrderedDict()
+    self._send_queues: Tuple[Deque[_QueuedCommand], ...] = tuple(collections.deque() for _ in SendPriority)
+    # Queued commands that a newer one may replace, by _supersede_key().
+    self._supersedable: Dict[bytes, _QueuedCommand] = {}
+    self._queued = 0
+    # Commands a thread handed to the connection's loop that it has not
+    # queued yet.
+    self._handoffs = 0
+    self._send_ready: Optional[asyncio.Event] = None
+    self._flushed: Optional[asyncio.Event] = None
+    self._writer_task: Optional[asyncio.Task[None]] = None
 
-    self.daemon = True
+  @property
+  def connected(self) -> bool:
+    """Returns True while a logged-in session to the controller is up."""
+    return self._connected
 
-  def connect(self) -> None:
-    """Connects to the lutron controller."""
-    if self._connected or self.is_alive():
-      raise ConnectionExistsError("Already connected")
-    # After starting the thread we wait for it to post us
-    # an event signifying that connection is established. This
-    # ensures that the caller only resumes when we are fully connected.
-    self.start()
-    with self._lock:
-      self._connect_cond.wait_for(lambda: self._connected or self._done)
-      if not self._connected and self._done:
-        if self._exception:
-          raise self._exception
-        raise LutronConnectionError("Failed to connect to Lutron controller")
+  @property
+  def queue_depth(self) -> int:
+    """Number of commands waiting to be written."""
+    return self._queued + self._handoffs
 
-  def send(self, cmd: str) -> None:
-    """Sends the specified command to the lutron controller.
+  def _set_connected(self) -> None:
+    """Marks the session as established and wakes up connect()."""
+    raise NotImplementedError
 
-    Must not hold self._lock.
-    """
-    _LOGGER.debug("Sending: %s" % cmd)
-    with self._lock:
-      if not self._connected:
-        _LOGGER.debug("Ignoring send of '%s' because we are disconnected." % cmd)
-        return
-      asyncio.run_coroutine_threadsafe(self._send_coro(cmd), self._loop)
+  def _disconnect(self) -> None:
+    """Closes the current session and wakes up connect()."""
+    raise NotImplementedError
+
+  def _close_writer(self) -> None:
+    """Drops the reader/writer pair. Callers handle any locking."""
+    was_connected = self._connected
+    self._connected = False
+    if self._writer_task is not None:
+      self._writer_task.cancel()
+    self._writer_task = None
+    for queue in self._send_queues:
+      if self.offline_buffer and not self._done:
+        for command in queue:
+          if command.data is not None and command.data[:1] != b'?':
+            self._keep(command)
+      queue.clear()
+    self._supersedable.clear()
+    self._queued = 0
+    self._send_ready = None
+    if self._flushed is not None:
+      self._flushed.set()
+    self._flushed = None
+    if self._writer:
+      self._writer.close()
+    self._writer = None
+    self._reader = None
+    self._probe_pending = False
+    self._probes_written.clear()
+    if was_connected:
+      _LOGGER.warning("Disconnected")
+
+  def _start_writer(self) -> None:
+    """Starts the task that coalesces queued commands into socket writes.
+    Runs on the connection's loop once login has completed."""
+    self._send_ready = asyncio.Event()
+    self._flushed = asyncio.Event()
+    self._flushed.set()
+    self._writer_task = asyncio.get_running_loop().create_task(
+        self._writer_loop(self._send_ready, self._flushed))
+
+  def _supersede_key(self, data: bytes) -> Optional[bytes]:
+    """Returns what a state-setting execute sets, e.g. b'#OUTPUT,5,1' for
+    #OUTPUT,5,1,50.00, or None for any other command."""
+    fields = data.split(b',', 4)
+    spec = self.SUPERSEDABLE.get(fields[0])
+    if spec is None or len(fields) <= spec[0] + 1 or fields[spec[0]] != spec[1]:
+      return None
+    return b','.join(fields[:spec[0] + 1])
+
+  def _hold(self, data: bytes, on_written: Optional[Callable[[], None]],
+            priority: Optional[SendPriority]) -> bool:
+    """Keeps a command sent while disconnected for replay, if an offline
+    buffer is configured. Returns whether it was kept. Callers handle any
+    locking."""
+    if not self.offline_buffer or self._done or data[:1] == b'?':
+      return False
+    key = self._supersede_key(data) if data[:1] == b'#' else None
+    self._keep(_QueuedCommand(data, [on_written] if on_written is not None else None, key,
+                              priority or SendPriority.USER))
+    return True
+
+  def _keep(self, command: _QueuedCommand) -> None:
+    """Adds a command to the offline buffer, collapsing it with a kept one
+    for the same target and evicting the oldest one if full."""
+    stats = self.writer_stats
+    offline = self._offline
+    horizon = time.monotonic() - self.offline_ttl
+    while offline and next(iter(offline.values())).queued_at < horizon:
+      offline.popitem(last=False)
+      stats.expired += 1
+    key: Any = command.key if command.key is not None else command
+    old = offline.pop(key, None)
+    if old is not None:
+      stats.collapsed += 1
+      if old.callbacks:
+        command.callbacks = old.callbacks + (command.callbacks or [])
+    elif len(offline) >= self.offline_buffer:
+      offline.popitem(last=False)
+      stats.overflowed += 1
+    offline[key] = command
+    stats.buffered += 1
+
+  def _replay_offline(self) -> None:
+    """Queues the commands kept while disconnected, oldest first. Runs on
+    the connection's loop right after login; callers handle any locking."""
+    if not self._offline:
+      return
+    kept, self._offline = self._offline, collections.OrderedDict()
+    stats = self.writer_stats
+    horizon = time.monotonic() - self.offline_ttl
+    replayed = 0
+    for command in kept.values():
+      if command.queued_at < horizon:
+        stats.expired += 1
+        continue
+      assert command.data is not None
+      callbacks = command.callbacks
+      on_written: Optional[Callable[[], None]] = None
+      if callbacks:
+        on_written = callbacks[0] if len(callbacks) == 1 else functools.partial(_call_all, callbacks)
+      self._enqueue(command.data, on_written, command.priority)
+      replayed += 1
+    stats.replayed += replayed
+    _LOGGER.info("Replayed %d commands sent while disconnected" % replayed)
+
+  async def _wait_flushed(self) -> None:
+    """Waits until the writer has flushed everything queued so far. Returns
+    at once if there is no writer, and when the session drops."""
+    flushed = self._flushed
+    if flushed is not None:
+      await flushed.wait()
+
+  def _enqueue(self, data: bytes, on_written: Optional[Callable[[], None]] = None,
+               priority: Optional[SendPriority] = None) -> None:
+    """Queues an encoded, CRLF-terminated command for the writer task.
+    Queries default to BACKGROUND, everything else to USER priority.
+    Must be called on the connection's loop; callers handle any locking."""
+    if self._send_ready is None or self._flushed is None:
+      # The session dropped after the command was handed over.
+      if not self._hold(data, on_written, priority):
+        _LOGGER.debug("Ignoring send of %r because we are disconnected." % data)
+      return
+    if priority is None:
+      priority = SendPriority.BACKGROUND if data[:1] == b'?' else SendPriority.USER
+    callbacks = [on_written] if on_written is not None else None
+    key = self._supersede_key(data) if data[:1] == b'#' else None
+    if key is not None:
+      old = self._supersedable.get(key)
+      if old is not None:
+        old.data = None
+        self._queued -= 1
+        self.writer_stats.superseded += 1
+        if old.callbacks:
+          callbacks = old.callbacks + (callbacks or [])
+    command = _QueuedCommand(data, callbacks, key, priority)
+    if key is not None:
+      self._supersedable[key] = command
+    self._send_queues[priority.value].append(command)
+    self._queued += 1
+    if self._queued > self.writer_stats.max_depth:
+      self.writer_stats.max_depth = self._queued
+    self._flushed.clear()
+    self._send_ready.set()
+
+  def _next_batch(self, limit: int) -> Tuple[List[bytes], List[Callable[[], None]], int]:
+    """Takes up to limit commands (and max_batch_bytes bytes) off the queue,
+    highest priority first. Returns them with their on_written callbacks and
+    their total size."""
+    batch: List[bytes] = []
+    callbacks: List[Callable[[], None]] = []
+    nbytes = 0
+    now = time.monotonic()
+    for queue in self._send_queues:
+      while queue and len(batch) < limit:
+        command = queue[0]
+        data = command.data
+        if data is None:
+          queue.popleft()
+          continue
+        if batch and nbytes + len(data) > self.max_batch_bytes:
+          return batch, callbacks, nbytes
+        queue.popleft()
+        self._queued -= 1
+        if command.key is not None:
+          del self._supersedable[command.key]
+        batch.append(data)
+        nbytes += len(data)
+        if command.callbacks:
+          callbacks.extend(command.callbacks)
+        self.writer_stats._record_wait(command.priority, now - command.queued_at)
+    return batch, callbacks, nbytes
+
+  async def _writer_loop(self, ready: asyncio.Event, flushed: asyncio.Event) -> None:
+    """Body of the writer task: waits for queued commands and writes
+    everything pending as one buffer per iteration, as far as the rate
+    limit allows."""
+    bucket = _TokenBucket(self.rate_limit, self.rate_burst) if self.rate_limit else None
+    while True:
+      await ready.wait()
+      ready.clear()
+      while self._queued:
+        limit = self.max_batch_commands
+        if bucket is not None:
+          limit = min(limit, bucket.available())
+          if limit == 0:
+            self.writer_stats.throttled += 1
+            await asyncio.sleep(bucket.delay())
+            continue
+        batch, callbacks, nbytes = self._next_batch(limit)
+        if bucket is not None:
+          bucket.consume(len(batch))
+        writer = self._writer
+        if writer is None:
+          return
+        try:
+          writer.write(b''.join(batch))
+          await writer.drain()
+        except _EXPECTED_NETWORK_EXCEPTIONS:
+          _LOGGER.exception("Error sending {!r}".format(batch))
+          self._disconnect()
+          return
+        self.writer_stats._record(len(batch), nbytes)
+        for callback in callbacks:
+          callback()
+      flushed.set()
 
   async def _send_coro(self, cmd: Union[str, bytes]) -> None:
     """Coroutine to send data and drain."""
@@ -129,8 +589,7 @@ class LutronConnection(threading.Thread):
         await self._writer.drain()
       except _EXPECTED_NETWORK_EXCEPTIONS:
         _LOGGER.exception("Error sending {!r}".format(cmd))
-        with self._lock:
-          self._disconnect_locked()
+        self._disconnect()
 
   async def _do_login(self) -> None:
     """Executes the login procedure (telnet) as well as setting up some
@@ -158,7 +617,7 @@ class LutronConnection(threading.Thread):
     assert self._writer is not None
 
     try:
-      await asyncio.wait_for(self._reader.readuntil(LutronConnection.USER_PROMPT), timeout=5.0)
+      await asyncio.wait_for(self._reader.readuntil(self.USER_PROMPT), timeout=5.0)
     except asyncio.TimeoutError:
       raise LutronLoginError("Timed out waiting for login prompt ('login: ')")
 
@@ -166,7 +625,7 @@ class LutronConnection(threading.Thread):
     await self._writer.drain()
 
     try:
-      await asyncio.wait_for(self._reader.readuntil(LutronConnection.PW_PROMPT), timeout=5.0)
+      await asyncio.wait_for(self._reader.readuntil(self.PW_PROMPT), timeout=5.0)
     except asyncio.TimeoutError:
       raise LutronLoginError("Timed out waiting for password prompt ('password: ')")
 
@@ -176,8 +635,8 @@ class LutronConnection(threading.Thread):
     # If we get USER_PROMPT again, it means login failed
     try:
       # Wait for either the GNET/QNET prompt or the login prompt again
-      res = await asyncio.wait_for(self._reader.readuntil_pattern(LutronConnection.PROMPT), timeout=10.0)
-      if LutronConnection.USER_PROMPT in res:
+      res = await asyncio.wait_for(self._reader.readuntil_pattern(self.PROMPT), timeout=10.0)
+      if self.USER_PROMPT in res:
         raise LutronLoginError("Incorrect username or password")
     except asyncio.TimeoutError:
       _LOGGER.error("Timeout waiting for GNET or QNET prompt, checking if we are back at login")
@@ -185,68 +644,224 @@ class LutronConnection(threading.Thread):
 
     await self._send_coro("#MONITORING,12,2")
     await self._send_coro("#MONITORING,255,2")
-    await self._send_coro("#MONITORING,3,1")
-    await self._send_coro("#MONITORING,4,1")
-    await self._send_coro("#MONITORING,5,1")
-    await self._send_coro("#MONITORING,6,1")
-    await self._send_coro("#MONITORING,8,1")
-
-  def _disconnect_locked(self) -> None:
-    """Closes the current connection. Assume self._lock is held."""
-    was_connected = self._connected
-    self._connected = False
-    self._connect_cond.notify_all()
-    if self._writer:
-      self._writer.close()
-    self._writer = None
-    self._reader = None
-    if was_connected:
-      _LOGGER.warning("Disconnected")
+    if not self.monitoring:
+      return
+    for monitoring_type in self.monitoring_types:
+      await self._send_coro("#MONITORING,%d,1" % monitoring_type)
+
+  def _monitoring_changes(self, types: Iterable[int]) -> List[str]:
+    """Makes types the monitoring types enabled after login and returns the
+    commands that switch a live session over to them."""
+    new = tuple(sorted(set(types)))
+    old = set(self.monitoring_types)
+    self.monitoring_types = new
+    if not self.monitoring or not self._connected:
+      return []
+    return (["#MONITORING,%d,1" % t for t in new if t not in old] +
+            ["#MONITORING,%d,2" % t for t in sorted(old.difference(new))])
+
+  def _reconnect_backoff(self, failures: int) -> float:
+    """Returns how long to wait before the next login attempt, given how
+    many attempts failed since the last working session."""
+    if failures == 0:
+      now = time.monotonic()
+      last = self._last_fast_reconnect
+      # Reconnect at once, unless the previous fast reconnect was so recent
+      # that the controller keeps dropping us right after login.
+      if last is None or now - last >= self.max_reconnect_delay:
+        self._last_fast_reconnect = now
+        return 0.0
+    delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** failures)
+    return random.uniform(delay / 2, delay)
+
+  async def _readline(self) -> Optional[bytes]:
+    """Reads the next line, probing an idle session if a heartbeat is
+    configured. Returns None if the session did not answer the probe."""
+    assert self._reader is not None
+    if self.heartbeat_interval is None:
+      return await self._reader.readline()
+    while True:
+      timeout = self.heartbeat_timeout if self._probe_pending else self.heartbeat_interval
+      try:
+        return await asyncio.wait_for(self._reader.readline(), timeout)
+      except asyncio.TimeoutError:
+        if self._probe_pending:
+          self.heartbeat_stats.failures += 1
+          return None
+        self._send_heartbeat()
+
+  def _send_heartbeat(self) -> None:
+    # Written directly instead of queued: behind the rate limiter or a
+    # backlog of commands, the probe could miss heartbeat_timeout on a busy
+    # but healthy session. The writer task writes whole batches of lines,
+    # so this cannot split one of them.
+    assert self._writer is not None
+    self._probe_pending = True
+    self.heartbeat_stats.probes += 1
+    self._writer.write(self.HEARTBEAT)
+    self._probes_written.append(time.monotonic())
 
   async def _main_loop(self) -> None:
-    """Main body of the the thread function.
+    """Main body of the connection.
 
     This will maintain connection and receive remote status updates.
     """
+    failures = 0
+    logged_in = False
     while not self._done:
       try:
         await self._do_login()
-        with self._lock:
-          self._connected = True
-          self._connect_cond.notify_all()
+        self._start_writer()
+        self._set_connected()
         _LOGGER.info("Connected")
+        if logged_in:
+          self.reconnects += 1
+          if self._reconnect_cb is not None:
+            self._reconnect_cb()
+        logged_in = True
+        failures = 0
 
         while not self._done:
-          assert self._reader is not None
-          line = await self._reader.readline()
+          line = await self._readline()
+          if line is None:
+            _LOGGER.warning("No reply to heartbeat within %.1fs, reconnecting" % self.heartbeat_timeout)
+            break
           if not line:
             _LOGGER.warning("Connection closed by remote")
             break
-          self._recv_cb(line.decode('ascii').rstrip())
+          self.lines_received += 1
+          self.last_received = time.monotonic()
+          self._probe_pending = False
+          # Replies arrive in the order the probes went out. The line is
+          # still handed on, as it may answer a query of the caller too.
+          if self._probes_written and line.startswith(self.HEARTBEAT_REPLY):
+            self.heartbeat_stats.replies += 1
+            self.heartbeat_stats.rtt.add(self.last_received - self._probes_written.popleft())
+          if self._recv_bytes_cb is not None:
+            self._recv_bytes_cb(line)
+          else:
+            self._recv_cb(line.decode('ascii').rstrip())
       except LutronException as e:
-        _LOGGER.exception("Fatal error during login")
-        # For fatal errors like auth failure, we might want to stop or notify
-        # For now, let's stop the loop to avoid infinite spamming
-        self._exception = e
-        self._done = True
+        _LOGGER.exception("Error during login")
+        # Only the first login is fatal (e.g. bad credentials); once a session
+        # worked, keep retrying with backoff.
+        if not logged_in:
+          self._exception = e
+          self._done = True
       except _EXPECTED_NETWORK_EXCEPTIONS as e:
         _LOGGER.exception("Network exception in main loop")
         # If we have not yet connected, don't try to reconnect
-        if not self._connected:
+        if not logged_in:
           self._exception = LutronConnectionError(str(e))
           self._done = True
       except Exception as e:
         _LOGGER.exception("Uncaught exception in main loop")
-        if not self._connected:
+        if not logged_in:
           self._exception = LutronException(str(e))
           self._done = True
       
-      with self._lock:
-        self._disconnect_locked()
-      
+      self._disconnect()
+
       if not self._done:
-        # don't spam reconnect
-        await asyncio.sleep(5)
+        delay = self._reconnect_backoff(failures)
+        failures += 1
+        if delay:
+          await asyncio.sleep(delay)
+
+
+class LutronConnection(_LutronConnectionBase, threading.Thread):
+  """Encapsulates the connection to the Lutron controller.
+
+  The session runs on a private event loop in a background thread, so every
+  method here may be called from synchronous code. See AsyncLutronConnection
+  for a variant that runs on the caller's event loop.
+  """
+
+  def __init__(self, host: str, user: str, password: str, recv_callback: Callable[[str], None], connection_factory: Any = telnetlib3.open_connection,
+               max_batch_commands: int = 64, max_batch_bytes: int = 4096,
+               recv_bytes_callback: Optional[Callable[[bytes], None]] = None,
+               rate_limit: Optional[float] = None, rate_burst: int = 8, monitoring: bool = True,
+               reconnect_delay: float = 0.25, max_reconnect_delay: float = 30.0,
+               reconnect_callback: Optional[Callable[[], None]] = None,
+               heartbeat_interval: Optional[float] = None, heartbeat_timeout: float = 5.0,
+               offline_buffer: int = 0, offline_ttl: float = 30.0) -> None:
+    """Initializes the lutron connection, doesn't actually connect."""
+    _LutronConnectionBase.__init__(self, host, user, password, recv_callback, connection_factory,
+                                   max_batch_commands, max_batch_bytes, recv_bytes_callback,
+                                   rate_limit, rate_burst, monitoring,
+                                   reconnect_delay, max_reconnect_delay, reconnect_callback,
+                                   heartbeat_interval, heartbeat_timeout,
+                                   offline_buffer, offline_ttl)
+    threading.Thread.__init__(self)
+
+    self._lock = threading.Lock()
+    self._connect_cond = threading.Condition(lock=self._lock)
+    self._loop = asyncio.new_event_loop()
+    self._task: Optional[asyncio.Task[None]] = None
+
+    self.daemon = True
+
+  def connect(self) -> None:
+    """Connects to the lutron controller."""
+    if self._connected or self.is_alive():
+      raise ConnectionExistsError("Already connected")
+    # After starting the thread we wait for it to post us
+    # an event signifying that connection is established. This
+    # ensures that the caller only resumes when we are fully connected.
+    self.start()
+    with self._lock:
+      self._connect_cond.wait_for(lambda: self._connected or self._done)
+      if not self._connected and self._done:
+        if self._exception:
+          raise self._exception
+        raise LutronConnectionError("Failed to connect to Lutron controller")
+
+  def send(self, cmd: str, on_written: Optional[Callable[[], None]] = None,
+           priority: Optional[SendPriority] = None) -> None:
+    """Sends the specified command to the lutron controller. on_written is
+    called on the connection thread once the command has been written.
+
+    Must not hold self._lock.
+    """
+    _LOGGER.debug("Sending: %s" % cmd)
+    data = cmd.encode('ascii') + b'\r\n'
+    with self._lock:
+      if not self._connected:
+        if not self._hold(data, on_written, priority):
+          _LOGGER.debug("Ignoring send of '%s' because we are disconnected." % cmd)
+        return
+      self._handoffs += 1
+      self._loop.call_soon_threadsafe(self._enqueue_handoff, data, on_written, priority)
+
+  def _enqueue_handoff(self, data: bytes, on_written: Optional[Callable[[], None]],
+                       priority: Optional[SendPriority]) -> None:
+    """Queues a command handed over by send(), on the connection's loop."""
+    with self._lock:
+      self._enqueue(data, on_written, priority)
+      self._handoffs -= 1
+
+  def close(self) -> None:
+    """Closes the session and stops the connection thread."""
+    self._done = True
+    if self._task is not None:
+      self._loop.call_soon_threadsafe(self._task.cancel)
+    if self.is_alive():
+      self.join()
+
+  def _set_connected(self) -> None:
+    with self._lock:
+      self._connected = True
+      self._replay_offline()
+      self._connect_cond.notify_all()
+
+  def _disconnect(self) -> None:
+    with self._lock:
+      self._disconnect_locked()
+
+  def _disconnect_locked(self) -> None:
+    """Closes the current connection. Assume self._lock is held."""
+    self._close_writer()
+    self._connect_cond.notify_all()
 
   def run(self) -> None:
     """Main entry point into our receive thread.
@@ -255,11 +870,121 @@ class LutronConnection(threading.Thread):
     """
     _LOGGER.info("Started")
     asyncio.set_event_loop(self._loop)
+    self._task = self._loop.create_task(self._main_loop())
     try:
-      self._loop.run_until_complete(self._main_loop())
+      self._loop.run_until_complete(self._task)
+    except asyncio.CancelledError:
+      self._disconnect()
+      # Give the cancelled writer task a chance to unwind.
+      self._loop.run_until_complete(asyncio.sleep(0))
     except Exception:
       _LOGGER.exception("Uncaught exception in run")
       raise
+    finally:
+      self._task = None
+
+
+class AsyncLutronConnection(_LutronConnectionBase):
+  """Connection to the Lutron controller that lives on the caller's event loop.
+
+  No thread is created: connect() starts a task on the running loop that
+  maintains the session and invokes recv_callback for every received line.
+  Commands go through the same coalescing writer queue as LutronConnection,
+  which a writer task on that loop flushes to the socket.
+  """
+
+  def __init__(self, host: str, user: str, password: str, recv_callback: Callable[[str], None], connection_factory: Any = telnetlib3.open_connection,
+               max_batch_commands: int = 64, max_batch_bytes: int = 4096,
+               recv_bytes_callback: Optional[Callable[[bytes], None]] = None,
+               rate_limit: Optional[float] = None, rate_burst: int = 8, monitoring: bool = True,
+               reconnect_delay: float = 0.25, max_reconnect_delay: float = 30.0,
+               reconnect_callback: Optional[Callable[[], None]] = None,
+               heartbeat_interval: Optional[float] = None, heartbeat_timeout: float = 5.0,
+               offline_buffer: int = 0, offline_ttl: float = 30.0) -> None:
+    """Initializes the lutron connection, doesn't actually connect."""
+    super(AsyncLutronConnection, self).__init__(host, user, password, recv_callback, connection_factory,
+                                                max_batch_commands, max_batch_bytes, recv_bytes_callback,
+                                                rate_limit, rate_burst, monitoring,
+                                                reconnect_delay, max_reconnect_delay, reconnect_callback,
+                                                heartbeat_interval, heartbeat_timeout,
+                                                offline_buffer, offline_ttl)
+    self._task: Optional[asyncio.Task[None]] = None
+    self._state_changed: Optional[asyncio.Event] = None
+
+  async def connect(self) -> None:
+    """Connects to the lutron controller.
+
+    Returns once the session is logged in and monitoring is enabled. The
+    session is then maintained (and re-established after network errors) by a
+    task on the running loop until close() is called.
+    """
+    if self._connected or (self._task is not None and not self._task.done()):
+      raise ConnectionExistsError("Already connected")
+    self._done = False
+    self._exception = None
+    state_changed = self._state_changed = asyncio.Event()
+    self._task = asyncio.get_running_loop().create_task(self._main_loop())
+    while not (self._connected or self._done):
+      state_changed.clear()
+      await state_changed.wait()
+    if not self._connected:
+      if self._exception:
+        raise self._exception
+      raise LutronConnectionError("Failed to connect to Lutron controller")
+
+  async def send(self, cmd: str) -> None:
+    """Sends the specified command and waits until the writer task has
+    flushed it (together with anything queued alongside it)."""
+    self.write(cmd)
+    await self._wait_flushed()
+
+  def write(self, cmd: str, on_written: Optional[Callable[[], None]] = None,
+            priority: Optional[SendPriority] = None) -> None:
+    """Queues the specified command for the writer task without waiting for
+    it to be flushed. Must be called from the loop the connection runs on.
+    on_written is called once the command has been written."""
+    _LOGGER.debug("Sending: %s" % cmd)
+    data = cmd.encode('ascii') + b'\r\n'
+    if not self._connected:
+      if not self._hold(data, on_written, priority):
+        _LOGGER.debug("Ignoring send of '%s' because we are disconnected." % cmd)
+      return
+    self._enqueue(data, on_written, priority)
+
+  async def close(self) -> None:
+    """Closes the session and stops the task maintaining it."""
+    self._done = True
+    task, self._task = self._task, None
+    self._disconnect()
+    if task is not None and not task.done():
+      task.cancel()
+      try:
+        await task
+      except asyncio.CancelledError:
+        pass
+
+  def _set_connected(self) -> None:
+    self._connected = True
+    self._replay_offline()
+    if self._state_changed is not None:
+      self._state_changed.set()
+
+  def _disconnect(self) -> None:
+    self._close_writer()
+    if self._state_changed is not None:
+      self._state_changed.set()
+
+
+class _StreamedArea(object):
+  """An Area seen by the streaming parser. The Area itself can only be built
+  once the OccupancyGroups section (which follows Areas) has been read, so its
+  attributes and already parsed children are held here until then."""
+  def __init__(self, attrib: Mapping[str, str], parent: Optional[_StreamedArea]) -> None:
+    self.attrib = dict(attrib)
+    self.parent = parent
+    self.outputs: List[Output] = []
+    self.keypads: List[Keypad] = []
+    self.sensors: List[MotionSensor] = []
 
 
 class LutronXmlDbParser(object):
@@ -267,15 +992,44 @@ class LutronXmlDbParser(object):
 
   The database describes all the rooms (Area), keypads (Device), and switches
   (Output). We handle the most relevant features, but some things like LEDs,
-  etc. are not implemented."""
-
-  def __init__(self, lutron: Lutron, xml_db_str: Union[str, bytes]) -> None:
+  etc. are not implemented.
+
+  parse() builds the whole DOM of xml_db_str first. Alternatively the XML can
+  be streamed in with feed() and close() (or parse_stream() for a file): the
+  entities are then created as their end tags arrive and the processed
+  elements are discarded, so the DOM is never held in memory. Both produce
+  the same objects."""
+
+  _KEYPAD_TYPES = (
+      'HWI_SEETOUCH_KEYPAD',
+      'SEETOUCH_KEYPAD',
+      'INTERNATIONAL_SEETOUCH_KEYPAD',
+      'SEETOUCH_TABLETOP_KEYPAD',
+      'PICO_KEYPAD',
+      'HYBRID_SEETOUCH_KEYPAD',
+      'MAIN_REPEATER',
+      'HOMEOWNER_KEYPAD',
+      'PALLADIOM_KEYPAD',
+      'HWI_SLIM',
+      'GRAFIK_T_HYBRID_KEYPAD')
+
+  def __init__(self, lutron: AsyncLutron, xml_db_str: Union[str, bytes] = b"") -> None:
     """Initializes the XML parser, takes the raw XML data as string input."""
     self._lutron = lutron
     self._xml_db_str = xml_db_str
     self.areas: List[Area] = []
     self._occupancy_groups: Dict[str, OccupancyGroup] = {}
     self.project_name: Optional[str] = None
+    # Streaming state, see feed().
+    self._pull: Optional["ET.XMLPullParser[ET.Element]"] = None
+    self._stack: List[ET.Element] = []
+    self._devices_open = 0
+    self._root_areas: Optional[ET.Element] = None
+    self._top_area: Optional[ET.Element] = None
+    self._areas_xml: Optional[ET.Element] = None
+    self._groups_xml: Optional[ET.Element] = None
+    self._streamed_areas: Dict[ET.Element, _StreamedArea] = {}
+    self._streamed_area_list: List[_StreamedArea] = []
 
   def parse(self) -> bool:
     """Main entrypoint into the parser. It interprets and creates all the
@@ -305,11 +1059,7 @@ class LutronXmlDbParser(object):
     groups = root.find('OccupancyGroups')
     if groups is not None:
       for group_xml in groups.iter('OccupancyGroup'):
-        group = self._parse_occupancy_group(group_xml)
-        if group.group_number:
-          self._occupancy_groups[group.group_number] = group
-        else:
-          _LOGGER.warning("Occupancy Group has no number.  XML: %s", group_xml)
+        self._add_occupancy_group(group_xml)
 
     # First area is useless, it's the top-level project area that defines the
     # "house". It contains the real nested Areas tree, which is the one we want.
@@ -320,23 +1070,163 @@ class LutronXmlDbParser(object):
         self.project_name = top_area.get('Name')
         areas = top_area.find('Areas')
         if areas is not None:
+          parsed: Dict[ET.Element, Area] = {}
           for area_xml in areas.iter('Area'):
             area = self._parse_area(area_xml)
+            parsed[area_xml] = area
             self.areas.append(area)
+          # Nested areas come after their parent, so it has been parsed.
+          for area_xml, area in parsed.items():
+            for child_xml in area_xml.findall('Areas/Area'):
+              area.add_child(parsed[child_xml])
     return True
 
-  def _parse_area(self, area_xml: ET.Element) -> Area:
-    """Parses an Area tag, which is effectively a room, depending on how the
-    Lutron controller programming was done."""
-    occupancy_group_id = area_xml.get('OccupancyGroupAssignedToID')
+  def parse_stream(self, source: BinaryIO, chunk_size: int = 64 * 1024) -> bool:
+    """Streams the XML database from a binary file object (see feed())."""
+    while True:
+      chunk = source.read(chunk_size)
+      if not chunk:
+        break
+      self.feed(chunk)
+    return self.close()
+
+  def feed(self, data: bytes) -> None:
+    """Feeds the next chunk of the XML database to the streaming parser."""
+    if self._pull is None:
+      self._pull = ET.XMLPullParser(events=('start', 'end'))
+    self._pull.feed(data)
+    self._handle_events(self._pull)
+
+  def close(self) -> bool:
+    """Finishes a streaming parse and builds the areas. Returns True like
+    parse() does."""
+    if self._pull is None:
+      self._pull = ET.XMLPullParser(events=('start', 'end'))
+    self._pull.close()
+    self._handle_events(self._pull)
+    built: Dict[_StreamedArea, Area] = {}
+    for streamed in self._streamed_area_list:
+      area = self._new_area(streamed.attrib)
+      for output in streamed.outputs:
+        area.add_output(output)
+      for keypad in streamed.keypads:
+        area.add_keypad(keypad)
+      for sensor in streamed.sensors:
+        area.add_sensor(sensor)
+      if streamed.parent is not None:
+        built[streamed.parent].add_child(area)
+      built[streamed] = area
+      self.areas.append(area)
+    self._pull = None
+    self._streamed_area_list = []
+    return True
+
+  def _handle_events(self, pull: "ET.XMLPullParser[ET.Element]") -> None:
+    """Walks the same parts of the document as parse(), but on the fly.
+
+    Areas are noted on their start tag, so they keep the document (pre-)order
+    parse() uses. Outputs, devices and occupancy groups are parsed on their
+    end tag. Once an element has been handled it is removed from its parent,
+    except inside a Device, whose Components are needed when the Device ends.
+    """
+    stack = self._stack
+    # Only start/end events were requested, so every item is (event, element).
+    for event, elem in cast(Iterable[Tuple[str, ET.Element]], pull.read_events()):
+      if event == 'start':
+        parent = stack[-1] if stack else None
+        tag = elem.tag
+        if tag == 'Device':
+          self._devices_open += 1
+        elif tag == 'Area':
+          if self._areas_xml is not None and self._areas_xml in stack:
+            enclosing = None
+            if parent is not None and parent.tag == 'Areas':
+              enclosing = self._streamed_areas.get(stack[-2])
+            streamed = _StreamedArea(elem.attrib, enclosing)
+            self._streamed_areas[elem] = streamed
+            self._streamed_area_list.append(streamed)
+          elif self._top_area is None and parent is not None and parent is self._root_areas:
+            self._top_area = elem
+            self.project_name = elem.get('Name')
+        elif tag == 'Areas':
+          if self._root_areas is None and len(stack) == 1:
+            self._root_areas = elem
+          elif self._areas_xml is None and parent is not None and parent is self._top_area:
+            self._areas_xml = elem
+        elif tag == 'OccupancyGroups' and self._groups_xml is None and len(stack) == 1:
+          self._groups_xml = elem
+        stack.append(elem)
+        continue
+
+      stack.pop()
+      if not stack:
+        continue
+      parent = stack[-1]
+      tag = elem.tag
+      if tag == 'Output':
+        area = self._streamed_areas.get(stack[-2]) if len(stack) > 1 and parent.tag == 'Outputs' else None
+        if area is not None:
+          area.outputs.append(self._parse_output(elem))
+      elif tag == 'Device':
+        self._devices_open -= 1
+        self._stream_device(elem)
+      elif tag == 'Area':
+        self._streamed_areas.pop(elem, None)
+      elif tag == 'OccupancyGroup':
+        if self._groups_xml is not None and self._groups_xml in stack:
+          self._add_occupancy_group(elem)
+      elif tag == 'GUID' and len(stack) == 1:
+        if elem.text:
+          self._lutron.set_guid(elem.text)
+      elif parent.tag == 'DeviceGroups' and tag != 'DeviceGroup':
+        if len(stack) > 1 and stack[-2] in self._streamed_areas:
+          _LOGGER.info("Unknown tag in DeviceGroups child %s" % tag)
+      if not self._devices_open:
+        del parent[:]
+
+  def _stream_device(self, device_xml: ET.Element) -> None:
+    """Handles the end of a Device that belongs to a streamed Area, i.e. that
+    sits at Area/DeviceGroups/Device or Area/DeviceGroups/DeviceGroup/Devices/Device."""
+    stack = self._stack
+    if len(stack) >= 2 and stack[-1].tag == 'DeviceGroups':
+      area_xml, device_group = stack[-2], device_xml
+    elif (len(stack) >= 4 and stack[-1].tag == 'Devices' and stack[-2].tag == 'DeviceGroup' and
+          stack[-3].tag == 'DeviceGroups'):
+      area_xml, device_group = stack[-4], stack[-2]
+    else:
+      return
+    area = self._streamed_areas.get(area_xml)
+    if area is None:
+      return
+    device_type = device_xml.get('DeviceType')
+    if device_type in LutronXmlDbParser._KEYPAD_TYPES:
+      area.keypads.append(self._parse_keypad(device_xml, device_group))
+    elif device_type == 'MOTION_SENSOR':
+      area.sensors.append(self._parse_motion_sensor(device_xml))
+
+  def _add_occupancy_group(self, group_xml: ET.Element) -> None:
+    group = self._parse_occupancy_group(group_xml)
+    if group.group_number:
+      self._occupancy_groups[group.group_number] = group
+    else:
+      _LOGGER.warning("Occupancy Group has no number.  XML: %s", group_xml)
+
+  def _new_area(self, attrib: Mapping[str, str]) -> Area:
+    """Creates the Area described by the attributes of an Area tag."""
+    occupancy_group_id = attrib.get('OccupancyGroupAssignedToID')
     occupancy_group = self._occupancy_groups.get(occupancy_group_id) if occupancy_group_id else None
-    area_name = area_xml.get('Name') or "Unknown Area"
+    area_name = attrib.get('Name') or "Unknown Area"
     if not occupancy_group and occupancy_group_id:
       _LOGGER.warning("Occupancy Group not found for Area: %s; ID: %s", area_name, occupancy_group_id)
-    area = Area(self._lutron,
+    return Area(self._lutron,
                 name=area_name,
-                integration_id=int(area_xml.get('IntegrationID') or 0),
+                integration_id=int(attrib.get('IntegrationID') or 0),
                 occupancy_group=occupancy_group)
+
+  def _parse_area(self, area_xml: ET.Element) -> Area:
+    """Parses an Area tag, which is effectively a room, depending on how the
+    Lutron controller programming was done."""
+    area = self._new_area(area_xml.attrib)
     outputs = area_xml.find('Outputs')
     if outputs is not None:
       for output_xml in outputs:
@@ -361,18 +1251,7 @@ class LutronXmlDbParser(object):
           if device_xml.tag != 'Device':
             continue
           device_type = device_xml.get('DeviceType')
-          if device_type in (
-              'HWI_SEETOUCH_KEYPAD',
-              'SEETOUCH_KEYPAD',
-              'INTERNATIONAL_SEETOUCH_KEYPAD',
-              'SEETOUCH_TABLETOP_KEYPAD',
-              'PICO_KEYPAD',
-              'HYBRID_SEETOUCH_KEYPAD',
-              'MAIN_REPEATER',
-              'HOMEOWNER_KEYPAD',
-              'PALLADIOM_KEYPAD',
-              'HWI_SLIM',
-              'GRAFIK_T_HYBRID_KEYPAD'):
+          if device_type in LutronXmlDbParser._KEYPAD_TYPES:
             keypad = self._parse_keypad(device_xml, device_group)
             area.add_keypad(keypad)
           elif device_type == 'MOTION_SENSOR':
@@ -388,12 +1267,17 @@ class LutronXmlDbParser(object):
     watts = int(output_xml.get('Wattage') or 0)
     integration_id = int(output_xml.get('IntegrationID') or 0)
     uuid = output_xml.get('UUID') or ""
+    output_class = LutronXmlDbParser._output_class(output_type)
+    return output_class(self._lutron, name, watts, output_type, integration_id, uuid)
 
+  @staticmethod
+  def _output_class(output_type: str) -> Type[Output]:
+    """Returns the Output subclass used for the given OutputType."""
     if output_type == 'SYSTEM_SHADE':
-      return Shade(self._lutron, name, watts, output_type, integration_id, uuid)
+      return Shade
     if output_type == 'MOTOR':
-      return Motor(self._lutron, name, watts, output_type, integration_id, uuid)
-    return Output(self._lutron, name, watts, output_type, integration_id, uuid)
+      return Motor
+    return Output
 
   def _parse_keypad(self, keypad_xml: ET.Element, device_group: ET.Element) -> Keypad:
     """Parses a keypad device (the Visor receiver is technically a keypad too)."""
@@ -435,9 +1319,38 @@ class LutronXmlDbParser(object):
                     num=int(component_xml.get('ComponentNumber') or 0),
                     button_type=button_type,
                     direction=direction,
-                    uuid=button_xml.get('UUID') or "")
+                    uuid=button_xml.get('UUID') or "",
+                    preset=self._parse_press_preset(button_xml))
     return button
 
+  @staticmethod
+  def _parse_press_preset(button_xml: ET.Element) -> Optional[Tuple[Tuple[int, float, float], ...]]:
+    """Returns the (output id, level, fade seconds) a press of the button
+    always produces, or None unless the button has just a Press action with
+    a single preset made only of GOTO_LEVEL assignments (toggles have two
+    presets, for instance)."""
+    actions = button_xml.find('Actions')
+    if actions is None or len(actions) != 1 or actions[0].get('ActionType') != '3':
+      return None
+    presets = actions[0].find('Presets')
+    if presets is None or len(presets) != 1:
+      return None
+    assignments = presets[0].find('PresetAssignments')
+    if assignments is None or not len(assignments):
+      return None
+    preset = []
+    for assignment in assignments:
+      if assignment.get('AssignmentType') != '2':
+        return None
+      try:
+        h, m, sec = (assignment.findtext('Fade') or '0:0:0').split(':')
+        preset.append((int(assignment.findtext('IntegrationID') or ''),
+                       float(assignment.findtext('Level') or ''),
+                       int(h) * 3600 + int(m) * 60 + float(sec)))
+      except ValueError:
+        return None
+    return tuple(preset)
+
   def _parse_led(self, keypad: Keypad, component_xml: ET.Element) -> Led:
     """Parses an LED device that part of a keypad."""
     component_num = int(component_xml.get('ComponentNumber') or 0)
@@ -477,11 +1390,490 @@ class LutronXmlDbParser(object):
                           group_number=group_xml.get('OccupancyGroupNumber') or "",
                           uuid=group_xml.get('UUID') or "")
 
-class Lutron(object):
-  """Main Lutron Controller class.
+_EntityT = TypeVar('_EntityT', bound='LutronEntity')
+
+# The (entity, event, params) tuples yielded by AsyncLutron.events().
+LutronEventTuple = Tuple['LutronEntity', 'LutronEvent', Dict[str, Any]]
+
+# A receive fast-path handler. It is given the full comma-split response line
+# (e.g. ['~OUTPUT', '12', '1', '45.00']) and returns whether it was handled.
+# The fields are bytes rather than str on the bytes pipeline; handlers only
+# pass them to int()/float(), which accept either.
+_LineHandler = Callable[[Sequence[Union[str, bytes]]], bool]
+
+
+class _ParsedDbCache(object):
+  """Second cache tier for the XML database: the already-parsed entity graph.
+
+  The areas, outputs, keypads (with their buttons and LEDs), motion sensors
+  and occupancy groups are stored as compact JSON arrays together with the
+  GUID and project name. The file records a format version and the SHA-256
+  of the XML it was built from; load() refuses anything that doesn't match,
+  so a stale or foreign cache simply causes the XML to be parsed again.
+  """
+  VERSION = 3
+
+  @staticmethod
+  def dump(path: str, xml_hash: str, guid: str, project_name: str, areas: List[Area]) -> None:
+    """Writes the parsed database to path (atomically, via a temp file)."""
+    def group_number(area: Area) -> Optional[str]:
+      return area.occupancy_group.group_number or None
+
+    index = {area: i for i, area in enumerate(areas)}
+    groups = {}
+    for area in areas:
+      if area.occupancy_group.group_number:
+        groups[area.occupancy_group.group_number] = area.occupancy_group.uuid
+    data = {
+        'version': _ParsedDbCache.VERSION,
+        'xml_sha256': xml_hash,
+        'guid': guid,
+        'project_name': project_name,
+        'occupancy_groups': sorted(groups.items()),
+        'areas': [
+            [area.name, area.id, group_number(area),
+             [[o.name, o.watts, o.type, o.id, o.uuid] for o in area._outputs],
+             [[k.name, k.type, k.location, k.id, k.uuid,
+               [[b.name, b.number, b.button_type, b._direction, b.uuid, b.preset] for b in k._buttons],
+               [[l.name, l.number, l.component_number, l.uuid] for l in k._leds]]
+              for k in area._keypads],
+             [[m.name, m.id, m.uuid] for m in area._sensors],
+             index[area._parent] if area._parent is not None else None]
+            for area in areas],
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+  @staticmethod
+  def load(lutron: AsyncLutron, path: str, xml_hash: str) -> Optional[Tuple[List[Area], str]]:
+    """Recreates the entity graph stored at path, registering every entity
+    with lutron. Returns (areas, project name), or None if the file is
+    missing, of another version or was built from different XML."""
+    try:
+      with open(path, 'rb') as f:
+        data = json.loads(f.read())
+    except (OSError, ValueError):
+      return None
+    if (not isinstance(data, dict) or data.get('version') != _ParsedDbCache.VERSION or
+        data.get('xml_sha256') != xml_hash):
+      return None
+
+    try:
+      lutron.set_guid(data['guid'])
+      groups = {number: OccupancyGroup(lutron, group_number=number, uuid=uuid)
+                for number, uuid in data['occupancy_groups']}
+      areas: List[Area] = []
+      for name, area_id, group, outputs, keypads, sensors, parent in data['areas']:
+        area = Area(lutron, name=name, integration_id=area_id,
+                    occupancy_group=groups.get(group) if group else None)
+        if parent is not None:
+          areas[parent].add_child(area)
+        for out_name, watts, output_type, output_id, uuid in outputs:
+          output_class = LutronXmlDbParser._output_class(output_type)
+          area.add_output(output_class(lutron, out_name, watts, output_type, output_id, uuid))
+        for kp_name, kp_type, location, kp_id, kp_uuid, buttons, leds in keypads:
+          keypad = Keypad(lutron, name=kp_name, keypad_type=kp_type, location=location,
+                          integration_id=kp_id, uuid=kp_uuid)
+          for b_name, num, button_type, direction, uuid, preset in buttons:
+            keypad.add_button(Button(lutron, keypad, name=b_name, num=num,
+                                     button_type=button_type, direction=direction, uuid=uuid,
+                                     preset=tuple(map(tuple, preset)) if preset else None))
+          for l_name, led_num, component_num, uuid in leds:
+            keypad.add_led(Led(lutron, keypad, name=l_name, led_num=led_num,
+                               component_num=component_num, uuid=uuid))
+          area.add_keypad(keypad)
+        for s_name, sensor_id, uuid in sensors:
+          area.add_sensor(MotionSensor(lutron, name=s_name, integration_id=sensor_id, uuid=uuid))
+        areas.append(area)
+    except (IndexError, KeyError, TypeError, ValueError):
+      _LOGGER.warning("Ignoring malformed parsed database cache %s" % path)
+      lutron._forget_entities()
+      return None
+    return areas, data['project_name']
+
+
+class LutronRegistry(object):
+  """Constant-time lookups of entities by integration id, uuid, legacy uuid,
+  name and type.
+
+  Covers every entity reachable from the areas (outputs, keypads with their
+  buttons and LEDs, motion sensors and bound occupancy groups) plus any other
+  entity registered with the controller object, in that order. Obtain it
+  through AsyncLutron.registry rather than constructing it directly."""
+
+  def __init__(self, lutron: AsyncLutron) -> None:
+    self._by_id: Dict[Tuple[str, int], LutronEntity] = {}
+    self._components: Dict[Tuple[int, int], KeypadComponent] = {}
+    self._by_uuid: Dict[str, LutronEntity] = {}
+    self._by_legacy_uuid: Dict[str, LutronEntity] = {}
+    self._by_name: Dict[str, List[LutronEntity]] = {}
+    self._by_type: Dict[type, List[LutronEntity]] = {}
+    self._entities: Dict[LutronEntity, None] = {}
+    # The area tree in pre-order, with the outputs, keypads and sensors of
+    # the areas in the same order. Every area's subtree is a contiguous
+    # slice of each of them, delimited by its _spans entry.
+    self._tree: List[Area] = []
+    self._tree_outputs: List[Output] = []
+    self._tree_keypads: List[Keypad] = []
+    self._tree_sensors: List[MotionSensor] = []
+    self._spans: Dict[Area, Tuple[Tuple[int, int, int, int], Tuple[int, int, int, int]]] = {}
+    self._area_of: Dict[LutronEntity, Area] = {}
+    self._build_tree(lutron.areas)
+
+    for area in lutron.areas:
+      if area.occupancy_group.id:
+        self._add(area.occupancy_group)
+      for output in area._outputs:
+        self._add(output)
+      for keypad in area._keypads:
+        self._add(keypad)
+      for sensor in area._sensors:
+        self._add(sensor)
+    for ids in lutron._ids.values():
+      for entity in ids.values():
+        self._add(entity)
+    self._names = sorted(self._by_name)
+
+  def _build_tree(self, areas: List[Area]) -> None:
+    """Lays out the Euler tour of the area tree, without recursion."""
+    known = set(areas)
+    roots = [area for area in areas if area._parent not in known]
+    enter: Dict[Area, Tuple[int, int, int, int]] = {}
+    stack: List[Tuple[Area, bool]] = [(area, False) for area in reversed(roots)]
+    while stack:
+      area, done = stack.pop()
+      position = (len(self._tree), len(self._tree_outputs), len(self._tree_keypads), len(self._tree_sensors))
+      if done:
+        self._spans[area] = (enter[area], position)
+        continue
+      if area in enter:
+        continue
+      enter[area] = position
+      self._tree.append(area)
+      self._tree_outputs.extend(area._outputs)
+      self._tree_keypads.extend(area._keypads)
+      self._tree_sensors.extend(area._sensors)
+      for entity in cast(List[LutronEntity], area._outputs + area._sensors) + [area._summary, area._occupancy_group]:
+        self._area_of[entity] = area
+      for keypad in area._keypads:
+        self._area_of[keypad] = area
+        for component in cast(List[KeypadComponent], keypad._buttons + keypad._leds):
+          self._area_of[component] = area
+      stack.append((area, True))
+      stack.extend((child, False) for child in reversed(area._children))
+    self._roots = tuple(roots)
+
+  def _add(self, entity: LutronEntity) -> None:
+    if entity in self._entities:
+      return
+    self._entities[entity] = None
+    cmd_type = getattr(entity, '_CMD_TYPE', None)
+    if cmd_type is not None:
+      self._by_id.setdefault((cmd_type, entity.id), entity)
+    if isinstance(entity, KeypadComponent):
+      self._components.setdefault((entity._keypad.id, entity.component_number), entity)
+    if entity.uuid:
+      self._by_uuid.setdefault(entity.uuid, entity)
+    if entity.legacy_uuid:
+      self._by_legacy_uuid.setdefault(entity.legacy_uuid, entity)
+    self._by_name.setdefault(entity.name, []).append(entity)
+    for cls in type(entity).__mro__:
+      if cls is LutronEntity:
+        break
+      self._by_type.setdefault(cls, []).append(entity)
+    if isinstance(entity, Keypad):
+      for component in entity._buttons:
+        self._add(component)
+      for led in entity._leds:
+        self._add(led)
+
+  def __len__(self) -> int:
+    return len(self._entities)
+
+  def __iter__(self) -> Iterator[LutronEntity]:
+    return iter(self._entities)
+
+  def by_id(self, cmd_type: str, integration_id: int) -> Optional[LutronEntity]:
+    """Returns the entity with the integration id for cmd_type ('OUTPUT',
+    'DEVICE' or 'GROUP'), e.g. by_id('OUTPUT', 12)."""
+    return self._by_id.get((cmd_type, integration_id))
+
+  def component(self, keypad_id: int, component_number: int) -> Optional[KeypadComponent]:
+    """Returns the button or LED with component_number on the keypad."""
+    return self._components.get((keypad_id, component_number))
+
+  def by_uuid(self, uuid: str) -> Optional[LutronEntity]:
+    return self._by_uuid.get(uuid)
+
+  def by_legacy_uuid(self, legacy_uuid: str) -> Optional[LutronEntity]:
+    return self._by_legacy_uuid.get(legacy_uuid)
+
+  def by_name(self, name: str) -> Tuple[LutronEntity, ...]:
+    """Returns all the entities called name; names need not be unique."""
+    return tuple(self._by_name.get(name, ()))
+
+  def by_name_prefix(self, prefix: str) -> List[LutronEntity]:
+    """Returns all the entities whose name starts with prefix, ordered by
+    name. This is a binary search over the sorted names."""
+    names = self._names
+    result: List[LutronEntity] = []
+    i = bisect.bisect_left(names, prefix)
+    while i < len(names) and names[i].startswith(prefix):
+      result.extend(self._by_name[names[i]])
+      i += 1
+    return result
+
+  def by_type(self, entity_type: Type[_EntityT]) -> Tuple[_EntityT, ...]:
+    """Returns all the entities of entity_type, subclasses included (e.g.
+    Output also returns Shades and Motors)."""
+    return tuple(cast(List[_EntityT], self._by_type.get(entity_type, ())))
+
+  @property
+  def roots(self) -> Tuple[Area, ...]:
+    """The areas without a parent, e.g. the floors."""
+    return self._roots
+
+  def area_of(self, entity: LutronEntity) -> Optional[Area]:
+    """Returns the area an entity (or a keypad's component) sits in."""
+    return self._area_of.get(entity)
+
+  def subtree(self, area: Area) -> List[Area]:
+    """Returns area and every area below it, in pre-order."""
+    enter, leave = self._spans[area]
+    return self._tree[enter[0]:leave[0]]
+
+  def subtree_outputs(self, area: Area) -> List[Output]:
+    """Returns the outputs of area and every area below it."""
+    enter, leave = self._spans[area]
+    return self._tree_outputs[enter[1]:leave[1]]
+
+  def subtree_keypads(self, area: Area) -> List[Keypad]:
+    """Returns the keypads of area and every area below it."""
+    enter, leave = self._spans[area]
+    return self._tree_keypads[enter[2]:leave[2]]
+
+  def subtree_sensors(self, area: Area) -> List[MotionSensor]:
+    """Returns the motion sensors of area and every area below it."""
+    enter, leave = self._spans[area]
+    return self._tree_sensors[enter[3]:leave[3]]
+
+  def in_subtree(self, area: Area, entity: LutronEntity) -> bool:
+    """Returns whether entity sits in area or any area below it."""
+    where = self._area_of.get(entity)
+    if where is None or area not in self._spans:
+      return False
+    enter, leave = self._spans[area]
+    return enter[0] <= self._spans[where][0][0] < leave[0]
+
+
+class RefreshResult(object):
+  """Outcome of an async_refresh_all() call: which entities replied to their state
+  query and which timed out."""
+
+  def __init__(self) -> None:
+    self.completed: List[LutronEntity] = []
+    self.timed_out: List[LutronEntity] = []
+
+  @property
+  def ok(self) -> bool:
+    """True if every queried entity replied in time."""
+    return not self.timed_out
+
+  def __repr__(self) -> str:
+    return str({'completed': len(self.completed), 'timed_out': len(self.timed_out)})
+
+
+class QueryReply(object):
+  """The controller's answer to a query, see AsyncLutron.async_query().
+
+  fields: the reply's fields after the integration id, e.g. ['1', '42.00']
+          for ~OUTPUT,5,1,42.00
+  rtt: seconds from the query being written to the socket until the reply
+       was received
+  attempts: how many times the query was sent
+  """
+  __slots__ = ('fields', 'rtt', 'attempts')
+
+  def __init__(self, fields: List[str], rtt: float, attempts: int) -> None:
+    self.fields = fields
+    self.rtt = rtt
+    self.attempts = attempts
+
+  def __repr__(self) -> str:
+    return str({'fields': self.fields, 'rtt': self.rtt, 'attempts': self.attempts})
+
+
+class ApplyHandle(object):
+  """Tracks an AsyncLutron.apply() until the controller confirmed every
+  level it changed. Await it (or call wait() from synchronous code).
+
+  The handle is also done, but not confirmed, once a newer apply() or
+  set_level() changed each of its unconfirmed outputs, or after cancel().
+  """
+
+  def __init__(self, levels: Mapping[Output, float], lutron: Optional[AsyncLutron] = None) -> None:
+    self.levels = dict(levels)
+    # The button pressed instead of setting levels, if any.
+    self.button: Optional[Button] = None
+    # Number of commands sent.
+    self.commands = 0
+    # Outputs a newer level was sent to before this one was confirmed.
+    self.superseded: List[Output] = []
+    self._lutron = lutron
+    self._pending = dict(levels)
+    self._done = threading.Event()
+    self._futures: List[asyncio.Future[None]] = []
+    if not levels:
+      self._done.set()
+
+  @property
+  def done(self) -> bool:
+    return self._done.is_set()
+
+  @property
+  def confirmed(self) -> bool:
+    """Whether the controller confirmed every level."""
+    return self.done and not self._pending and not self.superseded
+
+  @property
+  def pending(self) -> List[Output]:
+    """The outputs whose new level has not been confirmed yet."""
+    return list(self._pending)
+
+  def cancel(self) -> None:
+    """Stops waiting for the levels not confirmed yet, e.g. of a relay that
+    reports 100 for a requested 50. Wakes up every waiter."""
+    if self._lutron is not None:
+      self._lutron._cancel_apply(self)
+
+  def _confirm(self, output: Output, level: float) -> bool:
+    """Called with the AsyncLutron's apply lock held. Returns whether output
+    reached its level."""
+    target = self._pending.get(output)
+    if target is None or abs(target - level) >= 0.005:
+      return False
+    del self._pending[output]
+    if not self._pending:
+      self._finish()
+    return True
+
+  def _supersede(self, output: Output) -> None:
+    """Called with the apply lock held when a newer level is sent to output."""
+    if self._pending.pop(output, None) is None:
+      return
+    self.superseded.append(output)
+    if not self._pending:
+      self._finish()
+
+  def _finish(self) -> None:
+    """Marks the handle done and wakes up its waiters."""
+    self._done.set()
+    for fut in self._futures:
+      fut.get_loop().call_soon_threadsafe(_resolve_future, fut)
+    self._futures = []
+
+  def wait(self, timeout: Optional[float] = None) -> bool:
+    """Blocks until the handle is done. Returns whether every level was
+    confirmed; False on timeout."""
+    return self._done.wait(timeout) and self.confirmed
+
+  async def async_wait(self, timeout: Optional[float] = None) -> bool:
+    """Waits until the handle is done. Returns whether every level was
+    confirmed; False on timeout."""
+    if self.done:
+      return self.confirmed
+    fut = asyncio.get_running_loop().create_future()
+    self._futures.append(fut)
+    if self.done:
+      return self.confirmed
+    try:
+      await asyncio.wait_for(fut, timeout)
+    except asyncio.TimeoutError:
+      return False
+    return self.confirmed
+
+  def __await__(self) -> Any:
+    return self.async_wait().__await__()
+
+
+class QueryStats(object):
+  """Counters kept by the query correlator of an AsyncLutron."""
+
+  def __init__(self) -> None:
+    self.queries = 0
+    # Queries that joined an identical one that was already outstanding.
+    self.shared = 0
+    # Query commands written, including retries.
+    self.sent = 0
+    self.retries = 0
+    self.replies = 0
+    self.timeouts = 0
+    # Queries whose waiter gave up before a reply or timeout, e.g. because
+    # the awaiting task was cancelled.
+    self.cancelled = 0
+    # Matching updates that arrived before the query had been written, so
+    # they cannot be its reply.
+    self.unsolicited = 0
+    self.total_rtt = 0.0
+    self.max_rtt = 0.0
+
+  @property
+  def average_rtt(self) -> float:
+    """Average round-trip time of answered queries, in seconds."""
+    return self.total_rtt / self.replies if self.replies else 0.0
+
+  def __repr__(self) -> str:
+    return str({'queries': self.queries, 'replies': self.replies, 'timeouts': self.timeouts,
+                'cancelled': self.cancelled, 'average_rtt': self.average_rtt, 'max_rtt': self.max_rtt})
+
+
+class RecvStats(object):
+  """Counts of received lines per command type as it appears on the wire
+  (e.g. '~OUTPUT'): all of them, those routed to an entity, and those no
+  entity wanted."""
+
+  def __init__(self) -> None:
+    self.received: Dict[str, int] = {}
+    self.dispatched: Dict[str, int] = {}
+    self.ignored: Dict[str, int] = {}
+
+  def _record(self, cmd: str, dispatched: bool) -> None:
+    self.received[cmd] = self.received.get(cmd, 0) + 1
+    counts = self.dispatched if dispatched else self.ignored
+    counts[cmd] = counts.get(cmd, 0) + 1
+
+  def __repr__(self) -> str:
+    return str({'received': self.received, 'dispatched': self.dispatched, 'ignored': self.ignored})
+
+
+# (command type, integration id, component or None, action) of a query,
+# matched against the fields of received ~ lines.
+_QueryKey = Tuple[str, str, Optional[str], str]
+_QueryWaiter = Union[threading.Event, 'asyncio.Future[None]']
+
+
+class _PendingQuery(object):
+  """An outstanding query and everybody waiting for its reply."""
+  __slots__ = ('key', 'command', 'written_at', 'attempts', 'waiters', 'reply')
+
+  def __init__(self, key: _QueryKey, command: str) -> None:
+    self.key = key
+    self.command = command
+    # When the query was last written to the socket; None until then.
+    self.written_at: Optional[float] = None
+    self.attempts = 0
+    self.waiters: List[_QueryWaiter] = []
+    self.reply: Optional[QueryReply] = None
+
+
+class AsyncLutron(object):
+  """Main Lutron Controller class for asyncio applications.
 
   This object owns the connection to the controller, the rooms that exist in the
-  network, handles dispatch of incoming status updates, etc.
+  network, handles dispatch of incoming status updates, etc. The connection
+  runs on the caller's event loop, so no threads are involved.
   """
 
   # All Lutron commands start with one of these characters
@@ -490,24 +1882,195 @@ class Lutron(object):
   OP_QUERY = '?'
   OP_RESPONSE = '~'
 
-  def __init__(self, host: str, user: str, password: str) -> None:
+  _conn: _LutronConnectionBase
+  _command_conns: Tuple[_LutronConnectionBase, ...]
+
+  def __init__(self, host: str, user: str, password: str, connection_factory: Any = telnetlib3.open_connection,
+               bytes_pipeline: bool = False, dispatcher: Optional[EventDispatcher] = None,
+               query_timeout: float = 1.0, query_retries: int = 0, sessions: int = 1,
+               resync_window: float = 600.0, **connection_options: Any) -> None:
     """Initializes the Lutron object. No connection is made to the remote
-    device."""
+    device.
+
+    bytes_pipeline: parse received lines as bytes (see _recv_bytes()) rather
+    than decoding every line to a str first.
+    dispatcher: how entity events reach their subscribers. Defaults to an
+    InlineDispatcher; see ThreadPoolDispatcher and LoopDispatcher.
+    query_timeout, query_retries: defaults for how long to wait for the reply
+    to a state query and how often to resend it, see async_query().
+    sessions: how many integration sessions to open. The first one receives
+    status updates; with more than one, commands are spread over the others
+    (see _session()). Processors that accept several logins can then work on
+    more commands at once.
+    resync_window: after a reconnect, the state of entities that have
+    subscribers or were queried within this many seconds is queried again,
+    see _resync().
+    connection_options are passed on to the connection objects (e.g.
+    max_batch_commands)."""
     self._host = host
     self._user = user
     self._password = password
     self._name = ""
-    self._conn = LutronConnection(host, user, password, self._recv)
+    if bytes_pipeline:
+      connection_options['recv_bytes_callback'] = self._recv_bytes
+    self._conn = self._create_connection(
+        connection_factory, dict(connection_options, reconnect_callback=self._on_reconnect))
+    self._command_conns = tuple(
+        self._create_connection(connection_factory, dict(connection_options, monitoring=False))
+        for _ in range(sessions - 1))
+    # Command sessions whose commands go to the monitoring session, see
+    # _session().
+    self._diverted: Set[_LutronConnectionBase] = set()
+    self._diverted_lock = threading.Lock()
+    self._dispatcher = dispatcher or InlineDispatcher()
     self._ids: Dict[str, Dict[int, LutronEntity]] = {}
+    # Receive dispatch indexes built from _ids, see _build_dispatch().
+    self._dispatch: Optional[Dict[Tuple[str, ...], _LineHandler]] = None
+    self._bytes_dispatch: Optional[Dict[Tuple[bytes, ...], _LineHandler]] = None
+    self._registry: Optional[LutronRegistry] = None
     self._legacy_subscribers: Dict[LutronEntity, Callable[[LutronEntity], None]] = {}
     self._areas: List[Area] = []
+    self._summary = AreaSummary(self, "House", 0)
     self._guid = ""
+    self._event_queues: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue[LutronEventTuple]]] = []
+    self._bus = _SubscriptionBus(self)
+    self._state_store: Optional[StateStore] = None
+    self.query_timeout = query_timeout
+    self.query_retries = query_retries
+    # Outstanding queries, completed by _complete_queries().
+    self._queries: Dict[_QueryKey, _PendingQuery] = {}
+    self._queries_lock = threading.Lock()
+    self._query_stats = QueryStats()
+    self._recv_stats = RecvStats()
+    # apply() handles waiting for confirmations, by output.
+    self._apply_handles: Dict[Output, ApplyHandle] = {}
+    self._apply_lock = threading.Lock()
+    # Buttons with a preset, by the ids of the outputs the preset sets.
+    self._presets: Optional[Dict[int, List[Button]]] = None
+    self.resync_window = resync_window
+    # When entities last had their state queried, see _resync_entities().
+    self._recently_read: Dict[LutronEntity, float] = {}
+    # State of the entities being resynced, to suppress unchanged events.
+    self._resyncing: Dict[LutronEntity, Any] = {}
+    self._resync_task: Optional[asyncio.Task[RefreshResult]] = None
+    # Outcome of the resync after the most recent reconnect.
+    self.last_resync: Optional[RefreshResult] = None
+
+  def _create_connection(self, connection_factory: Any, options: Dict[str, Any]) -> _LutronConnectionBase:
+    """Creates the connection object used to talk to the controller."""
+    return AsyncLutronConnection(self._host, self._user, self._password,
+                                 self._recv, connection_factory, **options)
+
+  @property
+  def _async_conn(self) -> AsyncLutronConnection:
+    assert isinstance(self._conn, AsyncLutronConnection)
+    return self._conn
+
+  @property
+  def sessions(self) -> Tuple[_LutronConnectionBase, ...]:
+    """The connections to the controller, the monitoring one first."""
+    return (self._conn,) + self._command_conns
+
+  def required_monitoring(self, subscribed_only: bool = False) -> Tuple[int, ...]:
+    """Returns the #MONITORING types that carry updates for the known
+    entities: zone levels for outputs, button presses, LED states and
+    occupancy.
+
+    With subscribed_only, only types of entities that have subscribers
+    count (unless an events() stream is open); cached state of the others
+    then is only as fresh as their last query.
+    """
+    needed: List[int] = []
+    registry = self.registry
+    everything = not subscribed_only or bool(self._event_queues)
+    for cls, monitoring_type in ((Button, 3), (Led, 4), (Output, 5), (OccupancyGroup, 6)):
+      entities = registry.by_type(cls)
+      if everything:
+        wanted = len(entities) > 0
+      else:
+        wanted = any(e._subscribers or e in self._legacy_subscribers or self._bus.covers(e)
+                     for e in entities)
+      if wanted:
+        needed.append(monitoring_type)
+    return tuple(needed)
+
+  def set_monitoring(self, types: Iterable[int]) -> None:
+    """Sets which #MONITORING types the monitoring session has enabled.
+    A live session is switched over right away, and later logins use the
+    new set."""
+    for cmd in self._conn._monitoring_changes(types):
+      self._write(cmd)
+
+  def update_monitoring(self, subscribed_only: bool = False) -> Tuple[int, ...]:
+    """Enables just the monitoring types required_monitoring() returns and
+    returns them."""
+    types = self.required_monitoring(subscribed_only)
+    self.set_monitoring(types)
+    return types
+
+  def _session(self, cmd: str) -> _LutronConnectionBase:
+    """Picks the session a formatted command is written on.
+
+    Commands for the same integration id always use the same command
+    session, so they stay in order and a query's reply arrives where it was
+    sent. While that session is down its commands are held in its offline
+    buffer and replayed in order once it is back; without an offline buffer
+    they go to the monitoring session instead, and keep going there until it
+    has written everything queued or handed over by other threads, so the
+    session coming back can't overtake them. #MONITORING always goes to the monitoring session.
+    """
+    sessions = self._command_conns
+    if not sessions or cmd.startswith('#MONITORING'):
+      return self._conn
+    fields = cmd.split(',', 2)
+    conn = sessions[hash(fields[1] if len(fields) > 1 else cmd) % len(sessions)]
+    diverted = self._diverted
+    if conn.connected and not diverted:
+      return conn
+    with self._diverted_lock:
+      if conn in diverted:
+        if not conn.connected or self._conn.queue_depth:
+          return self._conn
+        diverted.discard(conn)
+      if conn.connected or (conn.offline_buffer and not conn._done):
+        return conn
+      diverted.add(conn)
+      return self._conn
 
   @property
   def areas(self) -> List[Area]:
     """Return the areas that were discovered for this Lutron controller."""
     return self._areas
 
+  @property
+  def summary(self) -> AreaSummary:
+    """House-wide rollup of the summaries of all areas, see Area.summary."""
+    return self._summary
+
+  @property
+  def state_store(self) -> Optional[StateStore]:
+    """The columnar state store, None unless enable_state_store() was
+    called."""
+    return self._state_store
+
+  def enable_state_store(self, use_numpy: Optional[bool] = None) -> StateStore:
+    """Starts mirroring the cached state of every output, LED and occupancy
+    group into a pylutron.state.StateStore and returns it. The store uses
+    NumPy if it is installed, unless use_numpy is False. Call it after the
+    database was loaded; calling it again returns the same store."""
+    if self._state_store is None:
+      from .state import StateStore
+      self._state_store = StateStore(self, use_numpy)
+    return self._state_store
+
+  @property
+  def registry(self) -> LutronRegistry:
+    """Returns the lookup index over all known entities. It is built on first
+    use and rebuilt after entities are added (e.g. by load_xml_db())."""
+    if self._registry is None:
+      self._registry = LutronRegistry(self)
+    return self._registry
+
   def set_guid(self, guid: str) -> None:
     self._guid = guid
 
@@ -519,6 +2082,28 @@ class Lutron(object):
   def name(self) -> str:
     return self._name
 
+  @property
+  def dispatcher(self) -> EventDispatcher:
+    """Returns the dispatcher delivering entity events to subscribers."""
+    return self._dispatcher
+
+  @property
+  def query_stats(self) -> QueryStats:
+    """Counters and round-trip times of the queries sent so far."""
+    return self._query_stats
+
+  @property
+  def recv_stats(self) -> RecvStats:
+    """Counts of received lines per command type, see RecvStats."""
+    return self._recv_stats
+
+  @property
+  def writer_stats(self) -> WriterStats:
+    """Returns the counters of the connection's coalescing command writer.
+    With several sessions these are the monitoring session's; see sessions
+    for the others."""
+    return self._conn.writer_stats
+
   def subscribe(self, obj: LutronEntity, handler: Callable[[LutronEntity], None]) -> None:
     """Subscribes to status updates of the requested object.
 
@@ -543,6 +2128,52 @@ class Lutron(object):
     if obj.id in ids:
       raise IntegrationIdExistsError
     self._ids[cmd_type][obj.id] = obj
+    self._invalidate_indexes()
+
+  def _invalidate_indexes(self) -> None:
+    """Forces the receive dispatch index and the registry to be rebuilt, e.g.
+    because a keypad gained a component after it was registered."""
+    self._dispatch = None
+    self._bytes_dispatch = None
+    self._registry = None
+    self._presets = None
+
+  def _forget_entities(self) -> None:
+    """Unregisters every entity again, after building the entity graph failed
+    half way."""
+    self._ids = {}
+    self._invalidate_indexes()
+    # The areas built so far already added their outputs to it.
+    self._summary._reset()
+
+  def _build_dispatch(self) -> Dict[Tuple[str, ...], _LineHandler]:
+    """Builds the receive dispatch index.
+
+    Every registered entity contributes handlers for the exact lines it
+    understands, keyed on the split line fields: (~CMD, id, action) for
+    OUTPUT and GROUP, (~DEVICE, id, component, action) for keypads. _recv()
+    can then route a line with one split and one or two dict lookups instead
+    of re-parsing it in the generic handle_update() path.
+    """
+    dispatch: Dict[Tuple[str, ...], _LineHandler] = {}
+    for cmd_type, ids in self._ids.items():
+      prefix = AsyncLutron.OP_RESPONSE + cmd_type
+      for integration_id, obj in ids.items():
+        head = (prefix, str(integration_id))
+        for tail, handler in obj._dispatch_handlers():
+          dispatch[head + tail] = handler
+    self._dispatch = dispatch
+    return dispatch
+
+  def _build_bytes_dispatch(self) -> Dict[Tuple[bytes, ...], _LineHandler]:
+    """Builds the bytes-keyed twin of the dispatch index for _recv_bytes()."""
+    dispatch = self._dispatch
+    if dispatch is None:
+      dispatch = self._build_dispatch()
+    bytes_dispatch = {tuple(field.encode('ascii') for field in key): handler
+                      for key, handler in dispatch.items()}
+    self._bytes_dispatch = bytes_dispatch
+    return bytes_dispatch
 
   def _dispatch_legacy_subscriber(self, obj: LutronEntity, *args: Any, **kwargs: Any) -> None:
     """This dispatches the registered callback for 'obj'. This is only used
@@ -551,14 +2182,116 @@ class Lutron(object):
     if obj in self._legacy_subscribers:
       self._legacy_subscribers[obj](obj)
 
+  def _on_entity_event(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any]) -> None:
+    """Invoked by every entity after its own subscribers ran. Feeds the
+    event streams handed out by events()."""
+    if not self._event_queues:
+      return
+    try:
+      running: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+    except RuntimeError:
+      running = None
+    item = (entity, event, params)
+    for loop, queue in self._event_queues:
+      if loop is running:
+        queue.put_nowait(item)
+      else:
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+  def subscribe_events(self, handler: LutronEventHandler, context: Any = None,
+                       entity_type: Optional[type] = None, event: Optional[LutronEvent] = None,
+                       area: Optional[Area] = None,
+                       predicate: Optional[LutronEventPredicate] = None) -> Callable[[], None]:
+    """Subscribes to the events of every entity matching all of the given
+    filters, including entities added later.
+
+    entity_type: Only entities of this class (subclasses included, e.g.
+        Output also matches Shades).
+    event: Only this event, e.g. Output.Event.LEVEL_CHANGED.
+    area: Only entities in this area or any area below it.
+    predicate: Called as predicate(entity, event, params) for events passing
+        the other filters; the handler is only called if it returns True.
+
+    handler is called like one passed to LutronEntity.subscribe(), through
+    the same dispatcher. Subscriptions are indexed, so an event only costs
+    time for the subscriptions that can match it. Returns a callable that
+    unsubscribes in constant time.
+    """
+    return self._bus.add(_Subscription(handler, context, (area, entity_type, event), predicate))
+
+  async def events(self) -> AsyncGenerator[LutronEventTuple, None]:
+    """Asynchronously iterates over every event generated by any entity.
+
+    Yields (entity, event, params) tuples, the same values a handler passed to
+    LutronEntity.subscribe would receive. The stream is registered when the
+    iteration starts and removed again when the iterator is closed.
+    """
+    queue: asyncio.Queue[LutronEventTuple] = asyncio.Queue()
+    entry = (asyncio.get_running_loop(), queue)
+    self._event_queues.append(entry)
+    try:
+      while True:
+        yield await queue.get()
+    finally:
+      self._event_queues.remove(entry)
+
   def _recv(self, line: str) -> None:
     """Invoked by the connection manager to process incoming data."""
+    parts = line.split(',')
+    if len(parts) >= 4:
+      dispatch = self._dispatch
+      if dispatch is None:
+        dispatch = self._build_dispatch()
+      handler = dispatch.get((parts[0], parts[1], parts[2]))
+      if handler is None:
+        handler = dispatch.get((parts[0], parts[1], parts[2], parts[3]))
+      if handler is None or not handler(parts):
+        self._recv_generic(line)
+      else:
+        self._recv_stats._record(parts[0], True)
+      if self._queries:
+        self._complete_queries(parts)
+      return
+    self._recv_generic(line)
+
+  def _recv_bytes(self, line: bytes) -> None:
+    """Bytes-native counterpart of _recv(), fed the raw line read from the
+    socket.
+
+    The line is split once; only the last field is copied to drop the line
+    terminator. Handlers convert just the fields they consume, so no str is
+    created for lines the dispatch index knows about. Anything else is
+    decoded and handed to _recv_generic().
+    """
+    parts = line.split(b',')
+    if len(parts) >= 4:
+      parts[-1] = parts[-1].rstrip()
+      dispatch = self._bytes_dispatch
+      if dispatch is None:
+        dispatch = self._build_bytes_dispatch()
+      handler = dispatch.get((parts[0], parts[1], parts[2]))
+      if handler is None:
+        handler = dispatch.get((parts[0], parts[1], parts[2], parts[3]))
+      if handler is None or not handler(parts):
+        self._recv_generic(line.decode('ascii').rstrip())
+      else:
+        self._recv_stats._record(parts[0].decode('ascii'), True)
+      if self._queries:
+        self._complete_queries([part.decode('ascii') for part in parts])
+      return
+    self._recv_generic(line.decode('ascii').rstrip())
+
+  def _recv_generic(self, line: str) -> None:
+    """Processes a line the dispatch index has no (successful) handler for by
+    looking up the entity and letting it parse the arguments itself."""
     if line == '':
       return
+    stats = self._recv_stats
     # Only handle query response messages, which are also sent on remote status
     # updates (e.g. user manually pressed a keypad button)
     if line[0] != Lutron.OP_RESPONSE:
       _LOGGER.debug("ignoring %s" % line)
+      stats._record(line.split(',', 1)[0], False)
       return
     parts = line[1:].split(',')
     cmd_type = parts[0]
@@ -566,29 +2299,340 @@ class Lutron(object):
     args = parts[2:]
     if cmd_type not in self._ids:
       _LOGGER.info("Unknown cmd %s (%s)" % (cmd_type, line))
+      stats._record(Lutron.OP_RESPONSE + cmd_type, False)
       return
     ids = self._ids[cmd_type]
     if integration_id not in ids:
       _LOGGER.warning("Unknown id %d (%s)" % (integration_id, line))
+      stats._record(Lutron.OP_RESPONSE + cmd_type, False)
       return
     obj = ids[integration_id]
     obj.handle_update(args)
+    stats._record(Lutron.OP_RESPONSE + cmd_type, True)
 
-  def connect(self) -> None:
+  async def async_connect(self) -> None:
     """Connects to the Lutron controller to send and receive commands and status"""
-    self._conn.connect()
+    await self._async_conn.connect()
+    if self._command_conns:
+      results = await asyncio.gather(
+          *(cast(AsyncLutronConnection, conn).connect() for conn in self._command_conns),
+          return_exceptions=True)
+      self._log_session_failures(results)
+
+  def _log_session_failures(self, results: Iterable[Optional[BaseException]]) -> None:
+    """Command sessions that fail to connect are not fatal; their commands
+    go to the monitoring session instead."""
+    for result in results:
+      if isinstance(result, LutronException):
+        _LOGGER.warning("Failed to open command session: %s" % result)
+      elif isinstance(result, BaseException):
+        raise result
+
+  async def async_close(self) -> None:
+    """Closes the connection to the Lutron controller."""
+    if self._resync_task is not None:
+      self._resync_task.cancel()
+    for conn in self._command_conns:
+      await cast(AsyncLutronConnection, conn).close()
+    await self._async_conn.close()
+    self._dispatcher.close()
 
-  def send(self, op: str, cmd: str, integration_id: int, *args: Any) -> None:
-    """Formats and sends the requested command to the Lutron controller."""
-    out_cmd = ",".join(
+  @staticmethod
+  def _format(op: str, cmd: str, integration_id: int, args: Tuple[Any, ...]) -> str:
+    """Formats a command line, leaving out any None arguments."""
+    return op + ",".join(
         (cmd, str(integration_id)) + tuple((str(x) for x in args if x is not None)))
-    self._conn.send(op + out_cmd)
 
-  def load_xml_db(self, cache_path: Optional[str] = None) -> bool:
+  def send(self, op: str, cmd: str, integration_id: int, *args: Any) -> None:
+    """Formats and sends the requested command to the Lutron controller.
+
+    This never blocks; the command is queued on the socket. Use async_send()
+    to wait until it has been flushed."""
+    self._write(self._format(op, cmd, integration_id, args))
+
+  def apply(self, levels: Mapping[Output, float], fade: Optional[float] = None) -> ApplyHandle:
+    """Sets several outputs at once with as few commands as possible.
+
+    Outputs whose cached level already matches are skipped. If pressing a
+    button with a preset (see Button.preset) yields exactly the requested
+    state, only that press is sent; otherwise the level commands are queued
+    together, so they go out in one write. fade applies to the level
+    commands; a preset is only used without fade or if its fades match.
+
+    Returns an ApplyHandle that is done once the controller confirmed every
+    changed level. Older handles still waiting for one of these outputs are
+    superseded.
+    """
+    changes = {output: level for output, level in levels.items() if output._level != level}
+    for output in changes:
+      if isinstance(output, Motor):
+        raise AttributeError("Motor does not support set_level; use start_raise, start_lower, or stop instead.")
+    handle = ApplyHandle(changes, self)
+    if not changes:
+      return handle
+    with self._apply_lock:
+      handles = self._apply_handles
+      for output in changes:
+        older = handles.get(output)
+        if older is not None:
+          older._supersede(output)
+        handles[output] = handle
+    button = self._find_preset(levels, changes, fade)
+    if button is not None:
+      handle.button = button
+      handle.commands = 1
+      button.press()
+    else:
+      fade_time = Output._fade_time(fade)
+      for output, level in changes.items():
+        self.send(Lutron.OP_EXECUTE, Output._CMD_TYPE, output.id,
+                  Output._ACTION_ZONE_LEVEL, "%.2f" % level, fade_time)
+      handle.commands = len(changes)
+    for output, level in changes.items():
+      output._cache_level(level)
+    return handle
+
+  def _find_preset(self, levels: Mapping[Output, float], changes: Mapping[Output, float],
+                   fade: Optional[float]) -> Optional[Button]:
+    """Returns the button whose press sets every changed output to its level
+    and leaves every other output it touches at its (requested or cached)
+    level, preferring the one touching the fewest outputs."""
+    presets = self._presets
+    if presets is None:
+      presets = {}
+      for button in self.registry.by_type(Button):
+        for output_id, _, _ in button._preset or ():
+          presets.setdefault(output_id, []).append(button)
+      self._presets = presets
+    wanted = {output.id: level for output, level in levels.items()}
+    changed = {output.id for output in changes}
+    registry = self.registry
+    best: Optional[Button] = None
+    for button in presets.get(next(iter(changed)), ()):
+      preset = button._preset
+      assert preset is not None
+      if best is not None and len(preset) >= len(cast(Tuple[Any, ...], best._preset)):
+        continue
+      if not changed.issubset(output_id for output_id, _, _ in preset):
+        continue
+      for output_id, level, preset_fade in preset:
+        target = wanted.get(output_id)
+        if target is None:
+          output = registry.by_id(Output._CMD_TYPE, output_id)
+          target = cast(Output, output)._level if output is not None else None
+        if target != level or (fade is not None and output_id in changed and preset_fade != fade):
+          break
+      else:
+        best = button
+    return best
+
+  def _confirm_level(self, output: Output, level: float) -> None:
+    """Hands a level reported by the controller to the apply() handles
+    waiting for it."""
+    with self._apply_lock:
+      handle = self._apply_handles.get(output)
+      if handle is not None and handle._confirm(output, level):
+        del self._apply_handles[output]
+
+  def _supersede_apply(self, output: Output) -> None:
+    """Ends the wait of the apply() handle for output, as a newer level is
+    being sent to it."""
+    with self._apply_lock:
+      handle = self._apply_handles.pop(output, None)
+      if handle is not None:
+        handle._supersede(output)
+
+  def _cancel_apply(self, handle: ApplyHandle) -> None:
+    """Stops tracking handle, see ApplyHandle.cancel()."""
+    with self._apply_lock:
+      if handle.done:
+        return
+      handles = self._apply_handles
+      for output in handle._pending:
+        if handles.get(output) is handle:
+          del handles[output]
+      handle._finish()
+
+  async def async_send(self, op: str, cmd: str, integration_id: int, *args: Any) -> None:
+    """Formats and sends the requested command, waiting until it is flushed."""
+    line = self._format(op, cmd, integration_id, args)
+    await cast(AsyncLutronConnection, self._session(line)).send(line)
+
+  def _write(self, cmd: str) -> None:
+    """Hands a formatted command to the connection."""
+    cast(AsyncLutronConnection, self._session(cmd)).write(cmd)
+
+  def _write_query(self, cmd: str, on_written: Callable[[], None]) -> None:
+    """Hands a formatted query to the connection; on_written is called once
+    it has been written to the socket."""
+    cast(AsyncLutronConnection, self._session(cmd)).write(cmd, on_written)
+
+  @staticmethod
+  def _query_key(cmd: str, integration_id: int, args: Tuple[Any, ...]) -> _QueryKey:
+    """Returns the key under which the reply to a query is expected."""
+    fields = tuple(str(x) for x in args if x is not None)
+    if len(fields) == 1:
+      return (cmd, str(integration_id), None, fields[0])
+    if len(fields) == 2:
+      return (cmd, str(integration_id), fields[0], fields[1])
+    raise ValueError("Cannot correlate the reply to a query with arguments %r" % (args,))
+
+  def _attach_query(self, cmd: str, integration_id: int, args: Tuple[Any, ...],
+                    waiter: _QueryWaiter) -> _PendingQuery:
+    """Adds waiter to the outstanding query for the given arguments, sending
+    the query unless an identical one is already outstanding."""
+    key = self._query_key(cmd, integration_id, args)
+    with self._queries_lock:
+      self._query_stats.queries += 1
+      pending = self._queries.get(key)
+      first = pending is None
+      if pending is None:
+        pending = self._queries[key] = _PendingQuery(
+            key, self._format(Lutron.OP_QUERY, cmd, integration_id, args))
+      else:
+        self._query_stats.shared += 1
+      pending.waiters.append(waiter)
+    if first:
+      self._send_query(pending, 0)
+    return pending
+
+  def _send_query(self, pending: _PendingQuery, attempts: int) -> None:
+    """(Re)sends a query unless it has been sent more than attempts times
+    already, i.e. another waiter got to the retry first."""
+    with self._queries_lock:
+      if pending.attempts != attempts or pending.reply is not None:
+        return
+      pending.attempts += 1
+      self._query_stats.sent += 1
+      if attempts:
+        self._query_stats.retries += 1
+    self._write_query(pending.command, functools.partial(self._query_written, pending))
+
+  def _query_written(self, pending: _PendingQuery) -> None:
+    pending.written_at = time.monotonic()
+
+  def _detach_query(self, pending: _PendingQuery, waiter: _QueryWaiter,
+                    cancelled: bool = False) -> Optional[QueryReply]:
+    """Removes a waiter that is done waiting, because it timed out or, with
+    cancelled, because it gave up early. The query is forgotten once nobody
+    waits for it anymore. Returns the reply, None if there is none."""
+    with self._queries_lock:
+      if pending.reply is None:
+        if cancelled:
+          self._query_stats.cancelled += 1
+        else:
+          self._query_stats.timeouts += 1
+        pending.waiters.remove(waiter)
+        if not pending.waiters and self._queries.get(pending.key) is pending:
+          del self._queries[pending.key]
+      return pending.reply
+
+  def _complete_queries(self, parts: Sequence[str]) -> None:
+    """Completes the outstanding query a received line answers, if any.
+
+    The controller sends the same ~ line in reply to a query and for a
+    monitoring update, so a line only counts as the reply once the query has
+    actually been written; anything matching before that is unsolicited.
+    """
+    if parts[0][:1] != Lutron.OP_RESPONSE:
+      return
+    cmd = parts[0][1:]
+    now = time.monotonic()
+    for key in ((cmd, parts[1], None, parts[2]), (cmd, parts[1], parts[2], parts[3])):
+      with self._queries_lock:
+        pending = self._queries.get(key)
+        if pending is None:
+          continue
+        if pending.written_at is None:
+          self._query_stats.unsolicited += 1
+          continue
+        del self._queries[key]
+        rtt = now - pending.written_at
+        pending.reply = QueryReply(list(parts[2:]), rtt, pending.attempts)
+        stats = self._query_stats
+        stats.replies += 1
+        stats.total_rtt += rtt
+        stats.max_rtt = max(stats.max_rtt, rtt)
+        waiters = pending.waiters
+      for waiter in waiters:
+        if isinstance(waiter, threading.Event):
+          waiter.set()
+        else:
+          # Replies are received on the connection's loop, which may not be
+          # the loop (or thread) the waiter is on.
+          waiter.get_loop().call_soon_threadsafe(_resolve_future, waiter)
+
+  async def _async_query(self, cmd: str, integration_id: int, args: Tuple[Any, ...],
+                         timeout: Optional[float] = None,
+                         retries: Optional[int] = None) -> Optional[QueryReply]:
+    """Sends a query and waits for its reply, resending it up to retries
+    times, each attempt waiting up to timeout seconds. Returns None if no
+    reply arrived."""
+    timeout = self.query_timeout if timeout is None else timeout
+    retries = self.query_retries if retries is None else retries
+    fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+    pending = self._attach_query(cmd, integration_id, args, fut)
+    cancelled = True
+    try:
+      for attempt in range(retries + 1):
+        if attempt:
+          self._send_query(pending, attempt)
+        done, _ = await asyncio.wait((fut,), timeout=timeout)
+        if done:
+          break
+      cancelled = False
+    finally:
+      reply = self._detach_query(pending, fut, cancelled)
+    return reply
+
+  def _query_blocking(self, cmd: str, integration_id: int, args: Tuple[Any, ...],
+                      timeout: Optional[float] = None,
+                      retries: Optional[int] = None) -> Optional[QueryReply]:
+    """Blocking version of _async_query() for synchronous callers."""
+    timeout = self.query_timeout if timeout is None else timeout
+    retries = self.query_retries if retries is None else retries
+    ev = threading.Event()
+    pending = self._attach_query(cmd, integration_id, args, ev)
+    for attempt in range(retries + 1):
+      if attempt:
+        self._send_query(pending, attempt)
+      if ev.wait(timeout):
+        break
+    return self._detach_query(pending, ev)
+
+  async def async_query(self, cmd: str, integration_id: int, *args: Any,
+                        timeout: Optional[float] = None, retries: Optional[int] = None) -> QueryReply:
+    """Queries the controller, e.g. async_query('OUTPUT', 5, 1) sends
+    ?OUTPUT,5,1, and returns the reply.
+
+    Identical queries that are outstanding at the same time share one
+    command and one reply. Each attempt waits up to timeout seconds (default
+    query_timeout) and the query is resent up to retries times (default
+    query_retries) before QueryTimeoutError is raised.
+    """
+    reply = await self._async_query(cmd, integration_id, args, timeout, retries)
+    if reply is None:
+      raise QueryTimeoutError("No reply to %s" % self._format(Lutron.OP_QUERY, cmd, integration_id, args))
+    return reply
+
+  def load_xml_db(self, cache_path: Optional[str] = None, parsed_cache_path: Optional[str] = None,
+                  revalidate: bool = False) -> bool:
     """Load the Lutron database from the server.
 
     If a locally cached copy is available, use that instead.
+
+    If parsed_cache_path is given, the parsed entity graph is also cached
+    there. When that file was built from identical XML, the entities are
+    recreated from it and the XML is not parsed at all.
+
+    With revalidate (and a cache_path), the cached copy is only used after a
+    conditional GET confirms it is current; see _revalidate_xml_db().
     """
+    if revalidate and cache_path:
+      self._areas, self._name = self._revalidate_xml_db(cache_path, parsed_cache_path)
+      _LOGGER.info('Found Lutron project: %s, %d areas' % (
+          self._name, len(self.areas)))
+      return True
 
     xml_db: Optional[bytes] = None
     loaded_from: Optional[str] = None
@@ -610,10 +2654,18 @@ class Lutron(object):
 
     assert xml_db is not None
 
-    parser = LutronXmlDbParser(lutron=self, xml_db_str=xml_db)
-    assert(parser.parse())     # throw our own exception
-    self._areas = parser.areas
-    self._name = parser.project_name or ""
+    xml_hash = hashlib.sha256(xml_db).hexdigest() if parsed_cache_path else ""
+    cached = _ParsedDbCache.load(self, parsed_cache_path, xml_hash) if parsed_cache_path else None
+    if cached is not None:
+      _LOGGER.info("Loaded parsed db from %s" % parsed_cache_path)
+      self._areas, self._name = cached
+    else:
+      parser = LutronXmlDbParser(lutron=self, xml_db_str=xml_db)
+      assert(parser.parse())     # throw our own exception
+      self._areas = parser.areas
+      self._name = parser.project_name or ""
+      if parsed_cache_path:
+        _ParsedDbCache.dump(parsed_cache_path, xml_hash, self._guid, self._name, self._areas)
 
     _LOGGER.info('Found Lutron project: %s, %d areas' % (
         self._name, len(self.areas)))
@@ -624,55 +2676,295 @@ class Lutron(object):
 
     return True
 
+  def _revalidate_xml_db(self, cache_path: str,
+                         parsed_cache_path: Optional[str]) -> Tuple[List[Area], str]:
+    """Loads the database with a conditional GET against the repeater.
 
-class _RequestHelper(object):
-  """A class to help with sending queries to the controller and waiting for
-  responses.
-
-  It is a wrapper used to help with executing a user action
-  and then waiting for an event when that action completes.
-
-  The user calls request() and gets back a threading.Event on which they then
-  wait.
-
-  If multiple clients of a lutron object (say an Output) want to get a status
-  update on the current brightness (output level), we don't want to spam the
-  controller with (near)identical requests. So, if a request is pending, we
-  just enqueue another waiter on the pending request and return a new Event
-  object. All waiters will be woken up when the reply is received and the
-  wait list is cleared.
+    The validators of the cached copy (ETag, Last-Modified, length and the
+    SHA-256 of the body) are kept in cache_path + '.meta'. If the repeater
+    answers 304 Not Modified the cached copy is used. Otherwise the new body
+    is written to disk and fed to the streaming parser as it arrives, so it
+    is never buffered whole; the cache and its validators are only replaced
+    once the complete body has been received and parsed.
+    """
+    import urllib.error
+    import urllib.request
+    meta_path = cache_path + '.meta'
+    meta: Dict[str, Any] = {}
+    try:
+      with open(meta_path) as f:
+        meta = json.load(f)
+      if os.path.getsize(cache_path) != meta.get('length'):
+        meta = {}
+    except (OSError, ValueError):
+      meta = {}
+
+    request = urllib.request.Request('http://' + self._host + '/DbXmlInfo.xml')
+    if meta.get('etag'):
+      request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+      request.add_header('If-Modified-Since', meta['last_modified'])
+    try:
+      response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+      if e.code != 304 or not meta:
+        raise
+      e.close()
+      _LOGGER.info("Loaded xml db from cache (not modified)")
+      if parsed_cache_path:
+        cached = _ParsedDbCache.load(self, parsed_cache_path, meta['sha256'])
+        if cached is not None:
+          _LOGGER.info("Loaded parsed db from %s" % parsed_cache_path)
+          return cached
+      parser = LutronXmlDbParser(lutron=self)
+      try:
+        with open(cache_path, 'rb') as f:
+          assert(parser.parse_stream(f))
+      except BaseException:
+        self._forget_entities()
+        raise
+      project_name = parser.project_name or ""
+      if parsed_cache_path:
+        _ParsedDbCache.dump(parsed_cache_path, meta['sha256'], self._guid, project_name, parser.areas)
+      return parser.areas, project_name
+
+    parser = LutronXmlDbParser(lutron=self)
+    digest = hashlib.sha256()
+    length = 0
+    tmp_path = cache_path + '.tmp'
+    with response:
+      try:
+        with open(tmp_path, 'wb') as f:
+          while True:
+            chunk = response.read(64 * 1024)
+            if not chunk:
+              break
+            f.write(chunk)
+            digest.update(chunk)
+            parser.feed(chunk)
+            length += len(chunk)
+        expected = response.headers.get('Content-Length')
+        if expected is not None and int(expected) != length:
+          raise LutronException("Truncated xml db: got %d of %s bytes" % (length, expected))
+        assert(parser.close())
+      except BaseException:
+        os.remove(tmp_path)
+        # Don't leave the entities parsed so far registered, so a retry
+        # starts from scratch.
+        self._forget_entities()
+        raise
+      os.replace(tmp_path, cache_path)
+      meta = {
+          'etag': response.headers.get('ETag'),
+          'last_modified': response.headers.get('Last-Modified'),
+          'length': length,
+          'sha256': digest.hexdigest(),
+      }
+    with open(meta_path, 'w') as f:
+      json.dump(meta, f)
+    _LOGGER.info("Loaded xml db from repeater (%d bytes)" % length)
+
+    project_name = parser.project_name or ""
+    if parsed_cache_path:
+      _ParsedDbCache.dump(parsed_cache_path, meta['sha256'], self._guid, project_name, parser.areas)
+    return parser.areas, project_name
+
+  def _refreshable_entities(self, kinds: Tuple[Type[LutronEntity], ...]) -> List[LutronEntity]:
+    """Returns the registered entities (and keypad LEDs) of the given kinds."""
+    entities: List[LutronEntity] = []
+    for ids in self._ids.values():
+      for obj in ids.values():
+        if isinstance(obj, kinds):
+          entities.append(obj)
+        if isinstance(obj, Keypad) and Led in kinds:
+          entities.extend(obj.leds)
+    return entities
+
+  async def async_refresh_all(self, kinds: Iterable[Type[LutronEntity]] = (),
+                              window: int = 32, timeout: float = 5.0, retries: int = 0) -> RefreshResult:
+    """Queries the current state of every entity of the given kinds.
+
+    By default Output levels, OccupancyGroup states and keypad LED states
+    are queried. Up to window queries are kept in flight at once, so the
+    commands are pipelined (and coalesced by the writer) instead of waiting
+    for each reply in turn. An entity whose reply does not arrive within
+    timeout seconds of its query (after up to retries resends) is reported
+    in RefreshResult.timed_out.
+    """
+    kinds = tuple(kinds) or (Output, OccupancyGroup, Led)
+    result = await self._refresh(self._refreshable_entities(kinds), window, timeout, retries)
+    _LOGGER.info("Refreshed %d entities, %d timed out" % (
+        len(result.completed), len(result.timed_out)))
+    return result
+
+  async def _refresh(self, entities: List[LutronEntity], window: int,
+                     timeout: Optional[float], retries: Optional[int]) -> RefreshResult:
+    """Queries the state of the given entities, keeping up to window queries
+    in flight."""
+    result = RefreshResult()
+    in_flight = asyncio.Semaphore(window)
+
+    async def refresh(entity: LutronEntity) -> None:
+      async with in_flight:
+        replied = await entity._async_refresh(timeout, retries)
+      (result.completed if replied else result.timed_out).append(entity)
+
+    await asyncio.gather(*(refresh(entity) for entity in entities))
+    return result
+
+  def _resync_entities(self) -> List[LutronEntity]:
+    """Returns the entities whose state is worth re-querying after a
+    reconnect: those with subscribers and those queried within the last
+    resync_window seconds."""
+    horizon = time.monotonic() - self.resync_window
+    recently_read = self._recently_read
+    for entity in [e for e, when in recently_read.items() if when < horizon]:
+      del recently_read[entity]
+    return [entity for entity in self._refreshable_entities((Output, OccupancyGroup, Led, MotionSensor))
+            if entity._subscribers or entity in self._legacy_subscribers or entity in recently_read
+            or self._bus.covers(entity)]
+
+  def _on_reconnect(self) -> None:
+    """Invoked on the connection's loop after the monitoring session was
+    re-established; starts a resync."""
+    if self._resync_task is not None:
+      self._resync_task.cancel()
+    self._resync_task = asyncio.get_running_loop().create_task(self._resync())
+
+  async def _resync(self) -> RefreshResult:
+    """Re-queries the state that may have changed while we were offline.
+
+    Events are only emitted for entities whose state actually differs from
+    what was cached before the reconnect."""
+    entities = self._resync_entities()
+    for entity in entities:
+      self._resyncing[entity] = entity._state_snapshot()
+    try:
+      result = await self._refresh(entities, 32, None, None)
+    finally:
+      for entity in entities:
+        self._resyncing.pop(entity, None)
+    _LOGGER.info("Resynced %d entities after reconnect, %d timed out" % (
+        len(result.completed), len(result.timed_out)))
+    self.last_resync = result
+    return result
+
+  async def async_load_xml_db(self, cache_path: Optional[str] = None, parsed_cache_path: Optional[str] = None,
+                              revalidate: bool = False) -> bool:
+    """Coroutine version of load_xml_db(). The download and parse run in the
+    loop's default executor so the event loop is not blocked."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, self.load_xml_db, cache_path, parsed_cache_path, revalidate)
+
+
+class Lutron(AsyncLutron):
+  """Main Lutron Controller class.
 
-  NOTE: Only the first enqueued action is executed as the assumption is that the
-  queries will be identical in nature.
+  This object owns the connection to the controller, the rooms that exist in the
+  network, handles dispatch of incoming status updates, etc. It is a thin
+  synchronous wrapper over AsyncLutron: the connection runs on its own event
+  loop in a background thread, so none of the methods need to be awaited.
   """
 
-  def __init__(self) -> None:
-    """Initialize the request helper class."""
-    self.__lock = threading.Lock()
-    self.__events: List[threading.Event] = []
+  _conn: LutronConnection
+  _command_conns: Tuple[LutronConnection, ...]
 
-  def request(self, action: Callable[[], Any]) -> threading.Event:
-    """Request an action to be performed, in case one."""
-    ev = threading.Event()
-    first = False
-    with self.__lock:
-      if len(self.__events) == 0:
-        first = True
-      self.__events.append(ev)
-    if first:
-      action()
-    return ev
+  def __init__(self, host: str, user: str, password: str, connection_factory: Any = telnetlib3.open_connection,
+               bytes_pipeline: bool = False, dispatcher: Optional[EventDispatcher] = None,
+               query_timeout: float = 1.0, query_retries: int = 0, sessions: int = 1,
+               resync_window: float = 600.0, **connection_options: Any) -> None:
+    """Initializes the Lutron object. No connection is made to the remote
+    device. Every session runs on its own thread."""
+    super(Lutron, self).__init__(host, user, password, connection_factory, bytes_pipeline,
+                                 dispatcher, query_timeout, query_retries, sessions,
+                                 resync_window, **connection_options)
+
+  def _create_connection(self, connection_factory: Any, options: Dict[str, Any]) -> LutronConnection:
+    return LutronConnection(self._host, self._user, self._password,
+                            self._recv, connection_factory, **options)
 
-  def notify(self) -> None:
-    with self.__lock:
-      events = self.__events
-      self.__events = []
-    for ev in events:
-      ev.set()
+  def connect(self) -> None:
+    """Connects to the Lutron controller to send and receive commands and status"""
+    self._conn.connect()
+    results: List[Optional[BaseException]] = []
+    for conn in self._command_conns:
+      try:
+        conn.connect()
+        results.append(None)
+      except LutronException as e:
+        results.append(e)
+    self._log_session_failures(results)
+
+  async def async_connect(self) -> None:
+    """Like connect(), without blocking the caller's event loop."""
+    await asyncio.get_running_loop().run_in_executor(None, self.connect)
+
+  def close(self) -> None:
+    """Closes the connection and stops the background threads."""
+    for conn in self._command_conns:
+      conn.close()
+    self._conn.close()
+    self._dispatcher.close()
+
+  async def async_close(self) -> None:
+    """Like close(), without blocking the caller's event loop."""
+    await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+  async def async_send(self, op: str, cmd: str, integration_id: int, *args: Any) -> None:
+    """Formats and sends the requested command, waiting (on the caller's
+    event loop) until the connection thread has flushed it."""
+    line = self._format(op, cmd, integration_id, args)
+    conn = cast(LutronConnection, self._session(line))
+    conn.send(line)
+    if conn.connected:
+      # Runs after the command was queued on the connection's loop.
+      await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(conn._wait_flushed(), conn._loop))
+
+  def refresh_all(self, kinds: Iterable[Type[LutronEntity]] = (),
+                  window: int = 32, timeout: float = 5.0, retries: int = 0) -> RefreshResult:
+    """Queries the current state of every entity of the given kinds and
+    blocks until all replies arrived or timed out. See
+    AsyncLutron.async_refresh_all()."""
+    return self._refresh_all_future(kinds, window, timeout, retries).result()
+
+  async def async_refresh_all(self, kinds: Iterable[Type[LutronEntity]] = (),
+                              window: int = 32, timeout: float = 5.0, retries: int = 0) -> RefreshResult:
+    """Like refresh_all(), without blocking the caller's event loop."""
+    return await asyncio.wrap_future(self._refresh_all_future(kinds, window, timeout, retries))
+
+  def _refresh_all_future(self, kinds: Iterable[Type[LutronEntity]], window: int, timeout: float,
+                          retries: int) -> concurrent.futures.Future[RefreshResult]:
+    """Runs the refresh on the connection's loop."""
+    if not self._conn.is_alive():
+      raise LutronConnectionError("Not connected")
+    return asyncio.run_coroutine_threadsafe(
+        super(Lutron, self).async_refresh_all(kinds, window, timeout, retries), self._conn._loop)
+
+  def query(self, cmd: str, integration_id: int, *args: Any,
+            timeout: Optional[float] = None, retries: Optional[int] = None) -> QueryReply:
+    """Queries the controller and blocks until the reply arrived. See
+    AsyncLutron.async_query()."""
+    reply = self._query_blocking(cmd, integration_id, args, timeout, retries)
+    if reply is None:
+      raise QueryTimeoutError("No reply to %s" % self._format(Lutron.OP_QUERY, cmd, integration_id, args))
+    return reply
+
+  def _write(self, cmd: str) -> None:
+    cast(LutronConnection, self._session(cmd)).send(cmd)
+
+  def _write_query(self, cmd: str, on_written: Callable[[], None]) -> None:
+    cast(LutronConnection, self._session(cmd)).send(cmd, on_written)
+
+
+def _resolve_future(fut: asyncio.Future[None]) -> None:
+  """Completes fut unless it was already cancelled (e.g. timed out)."""
+  if not fut.done():
+    fut.set_result(None)
 
 # This describes the type signature of the callback that LutronEntity
 # subscribers must provide.
 LutronEventHandler = Callable[['LutronEntity', Any, 'LutronEvent', Dict[str, Any]], None]
+LutronEventPredicate = Callable[['LutronEntity', 'LutronEvent', Dict[str, Any]], bool]
 
 
 class LutronEvent(Enum):
@@ -680,15 +2972,526 @@ class LutronEvent(Enum):
   pass
 
 
+class OverflowPolicy(Enum):
+  """What a queued EventDispatcher does when its queue is full.
+
+  DROP_OLDEST: The oldest queued event is discarded to make room.
+  COALESCE: A new event replaces the still queued event of the same entity
+      and type, keeping its place in the queue. When the queue is full of
+      distinct events the oldest one is dropped.
+  BLOCK: dispatch() waits until a worker makes room. This stalls the reader
+      the way a slow inline subscriber does, but only once the queue is full.
+      A dispatch() from the delivering thread itself drops the oldest event
+      instead of deadlocking.
+  """
+  DROP_OLDEST = 1
+  COALESCE = 2
+  BLOCK = 3
+
+
+class HandlerStats(object):
+  """How long one subscriber took to handle the events delivered to it."""
+  __slots__ = ('calls', 'errors', 'total_time', 'max_time')
+
+  def __init__(self) -> None:
+    self.calls = 0
+    self.errors = 0
+    self.total_time = 0.0
+    self.max_time = 0.0
+
+  @property
+  def average_time(self) -> float:
+    """Average time spent in the handler per call, in seconds."""
+    return self.total_time / self.calls if self.calls else 0.0
+
+  def __repr__(self) -> str:
+    return str({'calls': self.calls, 'errors': self.errors,
+                'average_time': self.average_time, 'max_time': self.max_time})
+
+
+class DispatchStats(object):
+  """Counters describing how an EventDispatcher delivered events."""
+
+  def __init__(self) -> None:
+    self.dispatched = 0
+    self.delivered = 0
+    self.dropped = 0
+    self.coalesced = 0
+    self.blocked = 0
+    self.max_depth = 0
+    # Time events spent queued between dispatch() and delivery, in seconds.
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+    # Latency of every subscriber called so far, keyed by its handler.
+    self.handlers: Dict[LutronEventHandler, HandlerStats] = {}
+    self._lock = threading.Lock()
+
+  @property
+  def average_wait(self) -> float:
+    """Average time an event waited in the queue, in seconds."""
+    return self.total_wait / self.delivered if self.delivered else 0.0
+
+  def _record_handler(self, handler: LutronEventHandler, elapsed: float, failed: bool) -> None:
+    with self._lock:
+      stats = self.handlers.get(handler)
+      if stats is None:
+        stats = self.handlers[handler] = HandlerStats()
+      stats.calls += 1
+      stats.errors += failed
+      stats.total_time += elapsed
+      if elapsed > stats.max_time:
+        stats.max_time = elapsed
+
+  def _record_delivery(self, wait: float) -> None:
+    with self._lock:
+      self.delivered += 1
+      self.total_wait += wait
+      if wait > self.max_wait:
+        self.max_wait = wait
+
+
+class EventDispatcher(object):
+  """Delivers entity events to the entity's subscribers.
+
+  LutronEntity hands every event that has subscribers to the dispatcher of
+  its controller object (see the dispatcher argument of AsyncLutron). The
+  dispatcher decides where and when the handlers run and records per-handler
+  latency in stats.
+  """
+
+  def __init__(self) -> None:
+    self.stats = DispatchStats()
+
+  def dispatch(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any]) -> None:
+    """Delivers, or arranges delivery of, event to entity's subscribers."""
+    raise NotImplementedError
+
+  def close(self) -> None:
+    """Discards queued events and releases any worker resources."""
+    pass
+
+  def _deliver(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any],
+               queued_at: float, reraise: bool) -> None:
+    """Calls every current subscriber of entity, timing each of them."""
+    stats = self.stats
+    start = time.perf_counter()
+    stats._record_delivery(start - queued_at)
+    # Copy, as handlers may unsubscribe while being called.
+    subscribers = list(entity._subscribers.values()) if entity._subscribers else []
+    bus = entity._lutron._bus
+    if bus:
+      subscribers.extend(bus.match(entity, event, params))
+    for handler, context in subscribers:
+      try:
+        handler(entity, context, event, params)
+      except Exception:
+        end = time.perf_counter()
+        stats._record_handler(handler, end - start, True)
+        if reraise:
+          raise
+        _LOGGER.exception("Event handler %r failed" % handler)
+      else:
+        end = time.perf_counter()
+        stats._record_handler(handler, end - start, False)
+      start = end
+
+
+class InlineDispatcher(EventDispatcher):
+  """Calls the subscribers synchronously, from the connection's reader. This
+  is the default; exceptions raised by a handler propagate to the caller."""
+
+  def dispatch(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any]) -> None:
+    self.stats.dispatched += 1
+    self._deliver(entity, event, params, time.perf_counter(), True)
+
+
+class _EventQueue(object):
+  """A bounded, thread-safe FIFO of (entity, event, params, queued_at) items
+  that applies an OverflowPolicy. Used by the queued dispatchers."""
+
+  def __init__(self, maxsize: int, policy: OverflowPolicy, stats: DispatchStats) -> None:
+    self._maxsize = maxsize
+    self._policy = policy
+    self._stats = stats
+    self._items: Deque[List[Any]] = collections.deque()
+    # The queued item of each (entity, event), for OverflowPolicy.COALESCE.
+    self._pending: Dict[Tuple[LutronEntity, LutronEvent], List[Any]] = {}
+    self._unfinished = 0
+    self._closed = False
+    self._cond = threading.Condition()
+
+  def put(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any], block_ok: bool) -> bool:
+    """Queues an event. Returns True if the queue was empty before."""
+    stats = self._stats
+    with self._cond:
+      stats.dispatched += 1
+      if self._policy is OverflowPolicy.COALESCE:
+        item = self._pending.get((entity, event))
+        if item is not None:
+          item[2] = params
+          stats.coalesced += 1
+          return False
+      if len(self._items) >= self._maxsize:
+        if self._policy is OverflowPolicy.BLOCK and block_ok:
+          stats.blocked += 1
+          while len(self._items) >= self._maxsize and not self._closed:
+            self._cond.wait()
+        while len(self._items) >= self._maxsize:
+          self._forget(self._items.popleft())
+          self._unfinished -= 1
+          stats.dropped += 1
+      item = [entity, event, params, time.perf_counter()]
+      self._items.append(item)
+      self._unfinished += 1
+      if self._policy is OverflowPolicy.COALESCE:
+        self._pending[(entity, event)] = item
+      if len(self._items) > stats.max_depth:
+        stats.max_depth = len(self._items)
+      self._cond.notify_all()
+      return len(self._items) == 1
+
+  def get(self, block: bool = True) -> Optional[List[Any]]:
+    """Removes and returns the oldest item. Returns None once closed, or if
+    empty and not block."""
+    with self._cond:
+      while block and not self._items and not self._closed:
+        self._cond.wait()
+      if not self._items:
+        return None
+      item = self._items.popleft()
+      self._forget(item)
+      self._cond.notify_all()
+      return item
+
+  def task_done(self) -> None:
+    with self._cond:
+      self._unfinished -= 1
+      self._cond.notify_all()
+
+  def wait_idle(self, timeout: Optional[float]) -> bool:
+    """Waits until every queued event has been delivered."""
+    with self._cond:
+      return self._cond.wait_for(lambda: self._unfinished <= 0, timeout)
+
+  def close(self) -> None:
+    with self._cond:
+      self._closed = True
+      self._unfinished -= len(self._items)
+      self._items.clear()
+      self._pending.clear()
+      self._cond.notify_all()
+
+  def _forget(self, item: List[Any]) -> None:
+    key = (item[0], item[1])
+    if self._pending.get(key) is item:
+      del self._pending[key]
+
+
+class ThreadPoolDispatcher(EventDispatcher):
+  """Delivers events from bounded queues drained by worker threads, so the
+  connection's reader never waits for a subscriber (except with
+  OverflowPolicy.BLOCK once a queue is full).
+
+  Events are sharded over the workers by entity: each entity's events are
+  still delivered in order, while different entities are handled in
+  parallel. maxsize bounds each worker's queue. The workers are started on
+  the first dispatch() and stopped by close(). Exceptions raised by handlers
+  are logged.
+  """
+
+  def __init__(self, workers: int = 4, maxsize: int = 1024,
+               overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST) -> None:
+    super(ThreadPoolDispatcher, self).__init__()
+    self._workers = workers
+    self._maxsize = maxsize
+    self._overflow = overflow
+    self._queues: List[_EventQueue] = []
+    self._threads: List[threading.Thread] = []
+    self._lock = threading.Lock()
+
+  def dispatch(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any]) -> None:
+    queues = self._queues or self._start()
+    queue = queues[hash(entity) % len(queues)]
+    queue.put(entity, event, params, threading.current_thread() not in self._threads)
+
+  def wait_idle(self, timeout: Optional[float] = None) -> bool:
+    """Waits until all queued events have been delivered. Returns False if
+    that didn't happen within timeout seconds."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for queue in self._queues:
+      remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+      if not queue.wait_idle(remaining):
+        return False
+    return True
+
+  def close(self) -> None:
+    with self._lock:
+      queues, self._queues = self._queues, []
+      threads, self._threads = self._threads, []
+    for queue in queues:
+      queue.close()
+    for thread in threads:
+      if thread is not threading.current_thread():
+        thread.join()
+
+  def _start(self) -> List[_EventQueue]:
+    with self._lock:
+      if not self._queues:
+        queues = [_EventQueue(self._maxsize, self._overflow, self.stats) for _ in range(self._workers)]
+        threads = [threading.Thread(target=self._work, args=(queue,), daemon=True,
+                                    name='lutron-dispatch-%d' % i)
+                   for i, queue in enumerate(queues)]
+        self._threads = threads
+        self._queues = queues
+        for thread in threads:
+          thread.start()
+      return self._queues
+
+  def _work(self, queue: _EventQueue) -> None:
+    while True:
+      item = queue.get()
+      if item is None:
+        return
+      try:
+        self._deliver(item[0], item[1], item[2], item[3], False)
+      finally:
+        queue.task_done()
+
+
+class LoopDispatcher(EventDispatcher):
+  """Delivers events on a user-supplied asyncio event loop.
+
+  Events are queued and a drain callback is scheduled on loop, so handlers
+  run on that loop's thread (and may use its asyncio objects) while the
+  connection's reader carries on. Exceptions raised by handlers are logged.
+  """
+
+  def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = 1024,
+               overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST) -> None:
+    super(LoopDispatcher, self).__init__()
+    self._loop = loop
+    self._queue = _EventQueue(maxsize, overflow, self.stats)
+
+  def dispatch(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any]) -> None:
+    try:
+      on_loop = asyncio.get_running_loop() is self._loop
+    except RuntimeError:
+      on_loop = False
+    if self._queue.put(entity, event, params, not on_loop):
+      self._loop.call_soon_threadsafe(self._drain)
+
+  def close(self) -> None:
+    self._queue.close()
+    self._queue = _EventQueue(self._queue._maxsize, self._queue._policy, self.stats)
+
+  def _drain(self) -> None:
+    queue = self._queue
+    # Deliver what is queued now and yield to the loop before the rest.
+    for _ in range(len(queue._items)):
+      item = queue.get(block=False)
+      if item is None:
+        return
+      try:
+        self._deliver(item[0], item[1], item[2], item[3], False)
+      finally:
+        queue.task_done()
+    if queue._items:
+      self._loop.call_soon(self._drain)
+
+
+class _Subscription(object):
+  """A subscription made with AsyncLutron.subscribe_events(). key is the
+  (area, entity type, event) it is indexed under, None matching anything."""
+  __slots__ = ('handler', 'context', 'key', 'predicate')
+
+  def __init__(self, handler: LutronEventHandler, context: Any,
+               key: Tuple[Optional[Area], Optional[type], Optional[LutronEvent]],
+               predicate: Optional[LutronEventPredicate]) -> None:
+    self.handler = handler
+    self.context = context
+    self.key = key
+    self.predicate = predicate
+
+
+class _SubscriptionBus(object):
+  """Index of the subscriptions of one controller object, used by
+  EventDispatcher._deliver().
+
+  Subscriptions are bucketed by their (area, entity type, event) key. An
+  event only looks up the buckets whose key it can match: the entity's area
+  and the areas above it, the classes of the entity and the event itself,
+  each also as None. Areas, types and events no subscription filters on are
+  skipped, so the cost per event follows the subscriptions that match.
+  """
+
+  def __init__(self, lutron: AsyncLutron) -> None:
+    self._lutron = lutron
+    self._buckets: Dict[Tuple[Optional[Area], Optional[type], Optional[LutronEvent]],
+                        Dict[_Subscription, None]] = {}
+    # How many buckets filter on each area, type and event.
+    self._areas: Dict[Area, int] = {}
+    self._types: Dict[type, int] = {}
+    self._events: Dict[LutronEvent, int] = {}
+    self._counts: Tuple[Dict[Any, int], ...] = (self._areas, self._types, self._events)
+
+  def __bool__(self) -> bool:
+    return bool(self._buckets)
+
+  def add(self, subscription: _Subscription) -> Callable[[], None]:
+    """Indexes subscription. Returns a callable removing it again."""
+    key = subscription.key
+    bucket = self._buckets.get(key)
+    if bucket is None:
+      bucket = self._buckets[key] = {}
+      for part, counts in zip(key, self._counts):
+        if part is not None:
+          counts[part] = counts.get(part, 0) + 1
+    bucket[subscription] = None
+    return lambda: self._remove(subscription)
+
+  def _remove(self, subscription: _Subscription) -> None:
+    key = subscription.key
+    bucket = self._buckets.get(key)
+    if bucket is None or subscription not in bucket:
+      return
+    del bucket[subscription]
+    if not bucket:
+      del self._buckets[key]
+      for part, counts in zip(key, self._counts):
+        if part is not None:
+          left = counts.pop(part) - 1
+          if left:
+            counts[part] = left
+
+  def _candidates(self, entity: LutronEntity) -> Tuple[List[Optional[Area]], List[Optional[type]]]:
+    """Returns the areas and types entity can match a bucket on."""
+    areas: List[Optional[Area]] = [None]
+    if self._areas:
+      area = self._lutron.registry.area_of(entity)
+      while area is not None:
+        if area in self._areas:
+          areas.append(area)
+        area = area._parent
+    types: List[Optional[type]] = [None]
+    types.extend(cls for cls in type(entity).__mro__ if cls in self._types)
+    return areas, types
+
+  def match(self, entity: LutronEntity, event: LutronEvent,
+            params: Dict[str, Any]) -> List[Tuple[LutronEventHandler, Any]]:
+    """Returns (handler, context) of every subscription the event matches."""
+    areas, types = self._candidates(entity)
+    events = (None, event) if event in self._events else (None,)
+    buckets = self._buckets
+    matched = []
+    for area in areas:
+      for cls in types:
+        for ev in events:
+          bucket = buckets.get((area, cls, ev))
+          if bucket:
+            for subscription in list(bucket):
+              predicate = subscription.predicate
+              if predicate is None or predicate(entity, event, params):
+                matched.append((subscription.handler, subscription.context))
+    return matched
+
+  def covers(self, entity: LutronEntity) -> bool:
+    """Returns whether some subscription may want events of entity."""
+    if not self._buckets:
+      return False
+    areas, types = self._candidates(entity)
+    return any(area in areas and cls in types for area, cls, _ in self._buckets)
+
+
+class CoalescingDispatcher(EventDispatcher):
+  """Collapses bursts of state events per entity before passing them on to
+  another dispatcher (an InlineDispatcher unless one is given).
+
+  The first coalescable event of an entity is held for window seconds. Later
+  events of the same entity and type arriving in that time replace it, and
+  only the newest is delivered when the window closes. During a fade this
+  turns the stream of intermediate levels into one event per window. Other
+  events (e.g. button presses) are passed on immediately, so they can
+  overtake a held event of the same entity.
+
+  By default LEVEL_CHANGED of outputs, STATE_CHANGED of LEDs and OCCUPANCY of
+  occupancy groups are coalesced. The windows are timed on the running event
+  loop (the connection's), or with a timer thread outside of one. The number
+  of dropped intermediate events is counted in stats.coalesced and, per
+  event type, in dropped.
+  """
+
+  def __init__(self, window: float = 0.1, inner: Optional[EventDispatcher] = None,
+               events: Optional[Iterable[LutronEvent]] = None) -> None:
+    super(CoalescingDispatcher, self).__init__()
+    self._window = window
+    self._inner = inner or InlineDispatcher()
+    self.stats = self._inner.stats
+    if events is None:
+      events = (Output.Event.LEVEL_CHANGED, Led.Event.STATE_CHANGED, OccupancyGroup.Event.OCCUPANCY)
+    self._events = frozenset(events)
+    self.dropped: Dict[LutronEvent, int] = {}
+    self._held: Dict[Tuple[LutronEntity, LutronEvent], Dict[str, Any]] = {}
+    self._timers: Dict[Tuple[LutronEntity, LutronEvent], Union[asyncio.TimerHandle, threading.Timer]] = {}
+    self._lock = threading.Lock()
+
+  @property
+  def inner(self) -> EventDispatcher:
+    """The dispatcher events are passed on to."""
+    return self._inner
+
+  def dispatch(self, entity: LutronEntity, event: LutronEvent, params: Dict[str, Any]) -> None:
+    if event not in self._events:
+      self._inner.dispatch(entity, event, params)
+      return
+    key = (entity, event)
+    with self._lock:
+      if key in self._held:
+        self._held[key] = params
+        self.dropped[event] = self.dropped.get(event, 0) + 1
+        with self.stats._lock:
+          self.stats.coalesced += 1
+        return
+      self._held[key] = params
+      try:
+        self._timers[key] = asyncio.get_running_loop().call_later(self._window, self._flush, key)
+      except RuntimeError:
+        timer = threading.Timer(self._window, self._flush, (key,))
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+  def close(self) -> None:
+    with self._lock:
+      timers, self._timers = self._timers, {}
+      self._held.clear()
+    for timer in timers.values():
+      timer.cancel()
+    self._inner.close()
+
+  def _flush(self, key: Tuple[LutronEntity, LutronEvent]) -> None:
+    with self._lock:
+      params = self._held.pop(key, None)
+      self._timers.pop(key, None)
+    if params is not None:
+      self._inner.dispatch(key[0], key[1], params)
+
+
 class LutronEntity(object):
   """Base class for all the Lutron objects we'd like to manage. Just holds basic
-  common info we'd rather not manage repeatedly."""
+  common info we'd rather not manage repeatedly.
+
+  Entities use __slots__ and only allocate their subscriber list when first
+  needed, since large installations have thousands of them and most are
+  never subscribed to. Outstanding queries are tracked by the Lutron object,
+  see AsyncLutron.async_query()."""
+  __slots__ = ('_lutron', '_name', '_uuid', '_subscribers')
 
-  def __init__(self, lutron: Lutron, name: str, uuid: str) -> None:
+  def __init__(self, lutron: AsyncLutron, name: str, uuid: str) -> None:
     """Initializes the base class with common, basic data."""
     self._lutron = lutron
     self._name = name
-    self._subscribers: List[Tuple[LutronEventHandler, Any]] = []
+    # Keyed by a token per subscribe() call, so unsubscribing is O(1).
+    self._subscribers: Optional[Dict[object, Tuple[LutronEventHandler, Any]]] = None
     self._uuid = uuid
 
   @property
@@ -712,8 +3515,12 @@ class LutronEntity(object):
 
   def _dispatch_event(self, event: LutronEvent, params: Dict[str, Any]) -> None:
     """Dispatches the specified event to all the subscribers."""
-    for handler, context in self._subscribers:
-      handler(self, context, event, params)
+    resyncing = self._lutron._resyncing
+    if resyncing and self in resyncing and resyncing.pop(self) == self._state_snapshot():
+      return
+    if self._subscribers or self._lutron._bus:
+      self._lutron._dispatcher.dispatch(self, event, params)
+    self._lutron._on_entity_event(self, event, params)
 
   def subscribe(self, handler: LutronEventHandler, context: Any) -> Callable[[], None]:
     """Subscribes to events from this entity.
@@ -727,8 +3534,15 @@ class LutronEntity(object):
     context: User-supplied, opaque object that will be passed to handler.
     Returns: A callable that can be used to unsubscribe from the event.
     """
-    self._subscribers.append((handler, context))
-    return lambda: self._subscribers.remove((handler, context))
+    if self._subscribers is None:
+      self._subscribers = {}
+    subscribers = self._subscribers
+    token = object()
+    subscribers[token] = (handler, context)
+
+    def unsubscribe() -> None:
+      subscribers.pop(token, None)
+    return unsubscribe
 
   def handle_update(self, args: List[str]) -> bool:
     """The handle_update callback is invoked when an event is received
@@ -740,10 +3554,42 @@ class LutronEntity(object):
     """
     return False
 
+  def _state_query(self) -> Tuple[str, int, Tuple[Any, ...]]:
+    """Returns the command type, integration id and arguments of the query
+    for the current state of this entity.
+
+    Only entities with queryable state implement this."""
+    raise NotImplementedError
+
+  def _state_snapshot(self) -> Any:
+    """Returns a value that compares equal for as long as the queryable
+    state of this entity is unchanged."""
+    raise NotImplementedError
+
+  def _query_state(self) -> bool:
+    """Queries the controller for the current state of this entity and blocks
+    until the reply arrived. Returns False if it timed out."""
+    self._lutron._recently_read[self] = time.monotonic()
+    return self._lutron._query_blocking(*self._state_query()) is not None
+
+  async def _async_refresh(self, timeout: Optional[float] = None, retries: Optional[int] = None) -> bool:
+    """Queries the controller for the current state of this entity and waits
+    for the reply, see AsyncLutron.async_query(). Returns False if it timed
+    out."""
+    self._lutron._recently_read[self] = time.monotonic()
+    return await self._lutron._async_query(*self._state_query(), timeout, retries) is not None
+
+  def _dispatch_handlers(self) -> Iterable[Tuple[Tuple[str, ...], _LineHandler]]:
+    """Returns the receive fast-path handlers of this entity as
+    (key fields after the integration id, handler) pairs. Lines without a
+    handler fall back to handle_update()."""
+    return ()
+
 
 class Output(LutronEntity):
   """This is the output entity in Lutron universe. This generally refers to a
   switched/dimmed load, e.g. light fixture, outlet, etc."""
+  __slots__ = ('_watts', '_output_type', '_level', '_integration_id', '_summaries')
   _CMD_TYPE = 'OUTPUT'
   _ACTION_ZONE_LEVEL = 1
   _ACTION_ZONE_FLASH = 5
@@ -757,14 +3603,15 @@ class Output(LutronEntity):
     """
     LEVEL_CHANGED = 1
 
-  def __init__(self, lutron: Lutron, name: str, watts: int, output_type: str, integration_id: int, uuid: str) -> None:
+  def __init__(self, lutron: AsyncLutron, name: str, watts: int, output_type: str, integration_id: int, uuid: str) -> None:
     """Initializes the Output."""
     super(Output, self).__init__(lutron, name, uuid)
     self._watts = watts
     self._output_type = output_type
     self._level = 0.0
-    self._query_waiters = _RequestHelper()
     self._integration_id = integration_id
+    # The AreaSummary objects this output counts towards, see Area.add_output().
+    self._summaries: Tuple[AreaSummary, ...] = ()
 
     self._lutron.register_id(Output._CMD_TYPE, self)
 
@@ -796,16 +3643,40 @@ class Output(LutronEntity):
     level = float(args[1])
     _LOGGER.debug("Updating %d(%s): s=%d l=%f" % (
         self._integration_id, self._name, state, level))
-    self._level = level
-    self._query_waiters.notify()
-    self._dispatch_event(Output.Event.LEVEL_CHANGED, {'level': self._level})
+    self._update_level(level)
+    return True
+
+  def _dispatch_handlers(self) -> Iterable[Tuple[Tuple[str, ...], _LineHandler]]:
+    return (((str(Output._ACTION_ZONE_LEVEL),), self._handle_level_line),)
+
+  def _handle_level_line(self, parts: Sequence[Union[str, bytes]]) -> bool:
+    """Fast path for ~OUTPUT,<id>,1,<level>."""
+    self._update_level(float(parts[3]))
     return True
 
-  def _do_query_level(self) -> None:
-    """Helper to perform the actual query the current dimmer level of the
-    output. For pure on/off loads the result is either 0.0 or 100.0."""
-    self._lutron.send(Lutron.OP_QUERY, Output._CMD_TYPE, self._integration_id,
-            Output._ACTION_ZONE_LEVEL)
+  def _update_level(self, level: float) -> None:
+    """Records a level reported by the controller and notifies everyone."""
+    self._cache_level(level)
+    if self._lutron._apply_handles:
+      self._lutron._confirm_level(self, level)
+    self._dispatch_event(Output.Event.LEVEL_CHANGED, {'level': level})
+
+  def _cache_level(self, level: float) -> None:
+    """Sets the cached level, keeping the area summaries up to date."""
+    old = self._level
+    self._level = level
+    store = self._lutron._state_store
+    if store is not None:
+      store._record_level(self, level)
+    if old != level:
+      for summary in self._summaries:
+        summary._level_changed(self, old, level)
+
+  def _state_query(self) -> Tuple[str, int, Tuple[Any, ...]]:
+    return Output._CMD_TYPE, self._integration_id, (Output._ACTION_ZONE_LEVEL,)
+
+  def _state_snapshot(self) -> Any:
+    return self._level
 
   def last_level(self) -> float:
     """Returns last cached value of the output level, no query is performed."""
@@ -814,8 +3685,7 @@ class Output(LutronEntity):
   @property
   def level(self) -> float:
     """Returns the current output level by querying the remote controller."""
-    ev = self._query_waiters.request(self._do_query_level)
-    ev.wait(1.0)
+    self._query_state()
     return self._level
 
   @level.setter
@@ -823,6 +3693,12 @@ class Output(LutronEntity):
     """Sets the new output level."""
     self.set_level(new_level)
 
+  async def async_level(self, timeout: Optional[float] = None, retries: Optional[int] = None) -> float:
+    """Returns the current output level by querying the remote controller,
+    without blocking the event loop. On timeout the cached level is returned."""
+    await self._async_refresh(timeout, retries)
+    return self._level
+
   @staticmethod
   def _fade_time(seconds: Optional[float]) -> Optional[str]:
     if seconds is None:
@@ -833,9 +3709,11 @@ class Output(LutronEntity):
     """Sets the new output level."""
     if self._level == new_level:
       return
+    if self._lutron._apply_handles:
+      self._lutron._supersede_apply(self)
     self._lutron.send(Lutron.OP_EXECUTE, Output._CMD_TYPE, self._integration_id,
         Output._ACTION_ZONE_LEVEL, "%.2f" % new_level, self._fade_time(fade_time_seconds))
-    self._level = new_level
+    self._cache_level(new_level)
 
   def flash(self, fade_time_seconds: Optional[float] = None) -> None:
     """Flashes the zone until a new level is set."""
@@ -872,6 +3750,7 @@ class _MotorizedOutput(Output):
   protocol OUTPUT command (actions 2, 3, 4). Concrete subclasses are `Shade`
   and `Motor`; user code should not instantiate this class directly.
   """
+  __slots__ = ()
   _ACTION_RAISE = 2
   _ACTION_LOWER = 3
   _ACTION_STOP = 4
@@ -899,6 +3778,7 @@ class Shade(_MotorizedOutput):
   `_MotorizedOutput` interface as well as direct level control via the
   standard `Output.set_level` / `level` API.
   """
+  __slots__ = ()
 
 
 class Motor(_MotorizedOutput):
@@ -917,6 +3797,7 @@ class Motor(_MotorizedOutput):
   the repeater reports position updates as the motor travels, and those
   are processed by the inherited `Output.handle_update`.
   """
+  __slots__ = ()
 
   def set_level(self, new_level: float, fade_time_seconds: Optional[float] = None) -> None:
     """Raises AttributeError: motors do not support direct level control.
@@ -930,8 +3811,9 @@ class Motor(_MotorizedOutput):
 
 class KeypadComponent(LutronEntity):
   """Base class for a keypad component such as a button, or an LED."""
+  __slots__ = ('_keypad', '_num', '_component_num')
 
-  def __init__(self, lutron: Lutron, keypad: Keypad, name: str, num: int, component_num: int, uuid: str) -> None:
+  def __init__(self, lutron: AsyncLutron, keypad: Keypad, name: str, num: int, component_num: int, uuid: str) -> None:
     """Initializes the base keypad component class."""
     super(KeypadComponent, self).__init__(lutron, name, uuid)
     self._keypad = keypad
@@ -966,10 +3848,15 @@ class KeypadComponent(LutronEntity):
                   self._keypad.name, self.name, action, params))
     return False
 
+  def _dispatch_handlers(self) -> Iterable[Tuple[Tuple[str, ...], _LineHandler]]:
+    """Returns (action,) keyed handlers; the keypad prepends the component."""
+    return ()
+
 
 class Button(KeypadComponent):
   """This object represents a keypad button that we can trigger and handle
   events for (button presses)."""
+  __slots__ = ('_button_type', '_direction', '_preset')
   _ACTION_PRESS = 3
   _ACTION_RELEASE = 4
   _ACTION_DOUBLE_CLICK = 6
@@ -992,11 +3879,19 @@ class Button(KeypadComponent):
     RELEASED = 2
     DOUBLE_CLICKED = 3
 
-  def __init__(self, lutron: Lutron, keypad: Keypad, name: str, num: int, button_type: str, direction: Optional[str], uuid: str) -> None:
+  _ACTION_EVENTS = {
+      _ACTION_PRESS: Event.PRESSED,
+      _ACTION_RELEASE: Event.RELEASED,
+      _ACTION_DOUBLE_CLICK: Event.DOUBLE_CLICKED,
+  }
+
+  def __init__(self, lutron: AsyncLutron, keypad: Keypad, name: str, num: int, button_type: str, direction: Optional[str], uuid: str,
+               preset: Optional[Tuple[Tuple[int, float, float], ...]] = None) -> None:
     """Initializes the Button class."""
     super(Button, self).__init__(lutron, keypad, name, num, num, uuid)
     self._button_type = button_type
     self._direction = direction
+    self._preset = preset
 
   def __str__(self) -> str:
     """Pretty printed string value of the Button object."""
@@ -1013,6 +3908,12 @@ class Button(KeypadComponent):
     """Returns the button type (Toggle, MasterRaiseLower, etc.)."""
     return self._button_type
 
+  @property
+  def preset(self) -> Optional[Tuple[Tuple[int, float, float], ...]]:
+    """The (output id, level, fade seconds) every press of this button sets,
+    or None if pressing it does anything else. See AsyncLutron.apply()."""
+    return self._preset
+
   def press(self) -> None:
     """Triggers a simulated button press to the Keypad."""
     self._lutron.send(Lutron.OP_EXECUTE, Keypad._CMD_TYPE, self._keypad.id,
@@ -1037,22 +3938,28 @@ class Button(KeypadComponent):
     """Handle the specified action on this component."""
     _LOGGER.debug('Keypad: "%s" %s Action: %s Params: %s"' % (
                   self._keypad.name, self, action, params))
-    ev_map = {
-        Button._ACTION_PRESS: Button.Event.PRESSED,
-        Button._ACTION_RELEASE: Button.Event.RELEASED,
-        Button._ACTION_DOUBLE_CLICK: Button.Event.DOUBLE_CLICKED
-    }
-    if action not in ev_map:
+    event = Button._ACTION_EVENTS.get(action)
+    if event is None:
       _LOGGER.debug("Unknown action %d for button %d in keypad %s" % (
           action, self.number, self._keypad.name))
       return False
-    self._dispatch_event(cast(LutronEvent, ev_map[action]), {})
+    self._dispatch_event(cast(LutronEvent, event), {})
+    return True
+
+  def _dispatch_handlers(self) -> Iterable[Tuple[Tuple[str, ...], _LineHandler]]:
+    return [((str(action),), functools.partial(self._handle_event_line, cast(LutronEvent, event)))
+            for action, event in Button._ACTION_EVENTS.items()]
+
+  def _handle_event_line(self, event: LutronEvent, parts: Sequence[Union[str, bytes]]) -> bool:
+    """Fast path for ~DEVICE,<keypad>,<button>,<action>."""
+    self._dispatch_event(event, {})
     return True
 
 
 class Led(KeypadComponent):
   """This object represents a keypad LED that we can turn on/off and
   handle events for (led toggled by scenes)."""
+  __slots__ = ('_state',)
   _ACTION_LED_STATE = 9
 
   # LED indicators states
@@ -1071,11 +3978,10 @@ class Led(KeypadComponent):
     """
     STATE_CHANGED = 1
 
-  def __init__(self, lutron: Lutron, keypad: Keypad, name: str, led_num: int, component_num: int, uuid: str) -> None:
+  def __init__(self, lutron: AsyncLutron, keypad: Keypad, name: str, led_num: int, component_num: int, uuid: str) -> None:
     """Initializes the Keypad LED class."""
     super(Led, self).__init__(lutron, keypad, name, led_num, component_num, uuid)
     self._state = Led.LED_OFF
-    self._query_waiters = _RequestHelper()
 
   def __str__(self) -> str:
     """Pretty printed string value of the Led object."""
@@ -1087,10 +3993,11 @@ class Led(KeypadComponent):
     return str({'keypad': self._keypad, 'name': self.name,
                 'num': self.number, 'component_num': self.component_number})
 
-  def _do_query_state(self) -> None:
-    """Helper to perform the actual query for the current LED state."""
-    self._lutron.send(Lutron.OP_QUERY, Keypad._CMD_TYPE, self._keypad.id,
-            self.component_number, Led._ACTION_LED_STATE)
+  def _state_query(self) -> Tuple[str, int, Tuple[Any, ...]]:
+    return Keypad._CMD_TYPE, self._keypad.id, (self.component_number, Led._ACTION_LED_STATE)
+
+  def _state_snapshot(self) -> Any:
+    return self._state
 
   @property
   def last_state(self) -> int:
@@ -1100,8 +4007,7 @@ class Led(KeypadComponent):
   @property
   def state(self) -> int:
     """Returns the current LED state by querying the remote controller."""
-    ev = self._query_waiters.request(self._do_query_state)
-    ev.wait(1.0)
+    self._query_state()
     return self._state
 
   @state.setter
@@ -1115,7 +4021,13 @@ class Led(KeypadComponent):
     self._lutron.send(Lutron.OP_EXECUTE, Keypad._CMD_TYPE, self._keypad.id,
                       self.component_number, Led._ACTION_LED_STATE,
                       new_state)
-    self._state = new_state
+    self._cache_state(new_state)
+
+  async def async_state(self, timeout: Optional[float] = None, retries: Optional[int] = None) -> int:
+    """Returns the current LED state by querying the remote controller,
+    without blocking the event loop. On timeout the cached state is returned."""
+    await self._async_refresh(timeout, retries)
+    return self._state
 
   def handle_update(self, action: int, params: List[int]) -> bool: # type: ignore[override]
     """Handle the specified action on this component."""
@@ -1129,11 +4041,30 @@ class Led(KeypadComponent):
       _LOGGER.debug("Unknown params %s (action %d on led %d in keypad %s)" % (
           params, action, self.number, self._keypad.name))
       return False
-    self._state = params[0]
-    self._query_waiters.notify()
-    self._dispatch_event(Led.Event.STATE_CHANGED, {'state': self._state})
+    self._update_state(params[0])
+    return True
+
+  def _dispatch_handlers(self) -> Iterable[Tuple[Tuple[str, ...], _LineHandler]]:
+    return (((str(Led._ACTION_LED_STATE),), self._handle_state_line),)
+
+  def _handle_state_line(self, parts: Sequence[Union[str, bytes]]) -> bool:
+    """Fast path for ~DEVICE,<keypad>,<led>,9,<state>."""
+    if len(parts) < 5:
+      return False
+    self._update_state(int(parts[4]))
     return True
 
+  def _cache_state(self, state: int) -> None:
+    self._state = state
+    store = self._lutron._state_store
+    if store is not None:
+      store._record_led(self, state)
+
+  def _update_state(self, state: int) -> None:
+    """Records an LED state reported by the controller and notifies everyone."""
+    self._cache_state(state)
+    self._dispatch_event(Led.Event.STATE_CHANGED, {'state': state})
+
 
 class Keypad(LutronEntity):
   """Object representing a Lutron keypad.
@@ -1141,9 +4072,10 @@ class Keypad(LutronEntity):
   Currently we don't really do much with it except handle the events
   (and drop them on the floor).
   """
+  __slots__ = ('_buttons', '_leds', '_components', '_location', '_integration_id', '_type')
   _CMD_TYPE = 'DEVICE'
 
-  def __init__(self, lutron: Lutron, name: str, keypad_type: str, location: str, integration_id: int, uuid: str) -> None:
+  def __init__(self, lutron: AsyncLutron, name: str, keypad_type: str, location: str, integration_id: int, uuid: str) -> None:
     """Initializes the Keypad object."""
     super(Keypad, self).__init__(lutron, name, uuid)
     self._buttons: List[Button] = []
@@ -1160,11 +4092,13 @@ class Keypad(LutronEntity):
     dispatch button events."""
     self._buttons.append(button)
     self._components[button.component_number] = button
+    self._lutron._invalidate_indexes()
 
   def add_led(self, led: Led) -> None:
     """Add an LED that's part of this keypad."""
     self._leds.append(led)
     self._components[led.component_number] = led
+    self._lutron._invalidate_indexes()
 
   @property
   def id(self) -> int:
@@ -1188,12 +4122,12 @@ class Keypad(LutronEntity):
   @property
   def buttons(self) -> Tuple[Button, ...]:
     """Return a tuple of buttons for this keypad."""
-    return tuple(button for button in self._buttons)
+    return tuple(self._buttons)
 
   @property
   def leds(self) -> Tuple[Led, ...]:
     """Return a tuple of leds for this keypad."""
-    return tuple(led for led in self._leds)
+    return tuple(self._leds)
 
   def handle_update(self, args: List[str]) -> bool:
     """The callback invoked by the main event loop if there's an event from this keypad."""
@@ -1206,6 +4140,12 @@ class Keypad(LutronEntity):
       return self._components[component].handle_update(action, params)
     return False
 
+  def _dispatch_handlers(self) -> Iterable[Tuple[Tuple[str, ...], _LineHandler]]:
+    for component_num, component in self._components.items():
+      key = str(component_num)
+      for tail, handler in component._dispatch_handlers():
+        yield (key,) + tail, handler
+
 
 class PowerSource(Enum):
   """Enum values representing power source, reported by queries to
@@ -1237,6 +4177,7 @@ class MotionSensor(LutronEntity):
   happens at the OccupancyGroup level. To read the state of an area,
   use area.occupancy_group.
   """
+  __slots__ = ('_integration_id', '_battery', '_power', '_last_update')
 
   _CMD_TYPE = 'DEVICE'
 
@@ -1253,14 +4194,13 @@ class MotionSensor(LutronEntity):
     """
     STATUS_CHANGED = 1
 
-  def __init__(self, lutron: Lutron, name: str, integration_id: int, uuid: str) -> None:
+  def __init__(self, lutron: AsyncLutron, name: str, integration_id: int, uuid: str) -> None:
     """Initializes the motion sensor object."""
     super(MotionSensor, self).__init__(lutron, name, uuid)
     self._integration_id = integration_id
     self._battery = BatteryStatus.UNINITIALIZED
     self._power = PowerSource.UNINITIALIZED
     self._lutron.register_id(MotionSensor._CMD_TYPE, self)
-    self._query_waiters = _RequestHelper()
     self._last_update: Optional[float] = None
 
   @property
@@ -1297,8 +4237,14 @@ class MotionSensor(LutronEntity):
     # Battery status won't change frequently but can't be retrieved for MONITORING.
     # So rate limit queries to once an hour.
     if self._update_age > 3600.0:
-      ev = self._query_waiters.request(self._do_query_battery)
-      ev.wait(1.0)
+      self._query_state()
+    return self._battery
+
+  async def async_battery_status(self, timeout: Optional[float] = None,
+                                 retries: Optional[int] = None) -> BatteryStatus:
+    """Returns the current BatteryStatus without blocking the event loop."""
+    if self._update_age > 3600.0:
+      await self._async_refresh(timeout, retries)
     return self._battery
 
   @property
@@ -1307,11 +4253,13 @@ class MotionSensor(LutronEntity):
     self.battery_status  # retrieved by the same query
     return self._power
 
-  def _do_query_battery(self) -> None:
-    """Helper to perform the query for the current BatteryStatus."""
+  def _state_query(self) -> Tuple[str, int, Tuple[Any, ...]]:
     component_num = 1  # doesn't seem to matter
-    self._lutron.send(Lutron.OP_QUERY, MotionSensor._CMD_TYPE, self._integration_id,
-                             component_num, MotionSensor._ACTION_BATTERY_STATUS)
+    return (MotionSensor._CMD_TYPE, self._integration_id,
+            (component_num, MotionSensor._ACTION_BATTERY_STATUS))
+
+  def _state_snapshot(self) -> Any:
+    return self._power, self._battery
 
   def handle_update(self, args: List[str]) -> bool:
     """Handle the specified action on this component."""
@@ -1326,7 +4274,6 @@ class MotionSensor(LutronEntity):
     self._power = PowerSource(int(power_str))
     self._battery = BatteryStatus(int(battery_str))
     self._last_update = time.time()
-    self._query_waiters.notify()
     self._dispatch_event(
       cast(LutronEvent, MotionSensor.Event.STATUS_CHANGED), {'power' : self._power, 'battery': self._battery})
     return True
@@ -1334,6 +4281,7 @@ class MotionSensor(LutronEntity):
 
 class OccupancyGroup(LutronEntity):
   """Represents one or more occupancy/vacancy sensors grouped into an Area."""
+  __slots__ = ('_area', '_group_number', '_integration_id', '_state')
   _CMD_TYPE = 'GROUP'
   _ACTION_STATE = 3
 
@@ -1352,13 +4300,12 @@ class OccupancyGroup(LutronEntity):
     """
     OCCUPANCY = 1
 
-  def __init__(self, lutron: Lutron, group_number: str, uuid: str) -> None:
+  def __init__(self, lutron: AsyncLutron, group_number: str, uuid: str) -> None:
     super(OccupancyGroup, self).__init__(lutron, "", uuid)
     self._area: Optional[Area] = None
     self._group_number = group_number
     self._integration_id: Optional[int] = None
     self._state = OccupancyGroup.State.UNINITIALIZED
-    self._query_waiters = _RequestHelper()
 
   def _bind_area(self, area: Area) -> None:
     self._area = area
@@ -1392,8 +4339,14 @@ class OccupancyGroup(LutronEntity):
     """Returns the current occupancy state."""
     # Poll for the first request.
     if self._state == OccupancyGroup.State.UNINITIALIZED:
-      ev = self._query_waiters.request(self._do_query_state)
-      ev.wait(1.0)
+      self._query_state()
+    return self._state
+
+  async def async_state(self, timeout: Optional[float] = None,
+                        retries: Optional[int] = None) -> OccupancyGroup.State:
+    """Returns the current occupancy state without blocking the event loop."""
+    if self._state == OccupancyGroup.State.UNINITIALIZED:
+      await self._async_refresh(timeout, retries)
     return self._state
 
   def __str__(self) -> str:
@@ -1409,29 +4362,46 @@ class OccupancyGroup(LutronEntity):
                 'id' : self.id,
                 'state' : self.state})
 
-  def _do_query_state(self) -> None:
-    """Helper to perform the actual query for the current OccupancyGroup state."""
-    self._lutron.send(Lutron.OP_QUERY, OccupancyGroup._CMD_TYPE, self._integration_id or 0,
-                             OccupancyGroup._ACTION_STATE)
+  def _state_query(self) -> Tuple[str, int, Tuple[Any, ...]]:
+    return OccupancyGroup._CMD_TYPE, self._integration_id or 0, (OccupancyGroup._ACTION_STATE,)
 
+  def _state_snapshot(self) -> Any:
+    return self._state
 
   def handle_update(self, args: List[str]) -> bool:
     """Handles an event update for this object, e.g. occupancy state change."""
     action = int(args[0])
     if action != OccupancyGroup._ACTION_STATE or len(args) != 2:
       return False
+    self._update_state(args[1])
+    return True
+
+  def _dispatch_handlers(self) -> Iterable[Tuple[Tuple[str, ...], _LineHandler]]:
+    return (((str(OccupancyGroup._ACTION_STATE),), self._handle_state_line),)
+
+  def _handle_state_line(self, parts: Sequence[Union[str, bytes]]) -> bool:
+    """Fast path for ~GROUP,<area>,3,<state>."""
+    if len(parts) != 4:
+      return False
+    self._update_state(parts[3])
+    return True
+
+  def _update_state(self, state: Union[str, bytes]) -> None:
+    """Records an occupancy state reported by the controller and notifies
+    everyone."""
     try:
-      self._state = OccupancyGroup.State(int(args[1]))
+      self._state = OccupancyGroup.State(int(state))
     except ValueError:
       self._state = OccupancyGroup.State.UNKNOWN
-    self._query_waiters.notify()
+    store = self._lutron._state_store
+    if store is not None:
+      store._record_occupancy(self, self._state.value)
     self._dispatch_event(cast(LutronEvent, OccupancyGroup.Event.OCCUPANCY), {'state': self._state})
-    return True
 
 
 class Area(object):
   """An area (i.e. a room) that contains devices/outputs/etc."""
-  def __init__(self, lutron: Lutron, name: str, integration_id: int, occupancy_group: Optional[OccupancyGroup]) -> None:
+  def __init__(self, lutron: AsyncLutron, name: str, integration_id: int, occupancy_group: Optional[OccupancyGroup]) -> None:
     self._lutron = lutron
     self._name = name
     self._integration_id = integration_id
@@ -1442,21 +4412,36 @@ class Area(object):
     self._keypads: List[Keypad] = []
     self._sensors: List[MotionSensor] = []
     self._occupancy_group._bind_area(self)
+    self._summary = AreaSummary(lutron, name, integration_id)
+    self._parent: Optional[Area] = None
+    self._children: List[Area] = []
+
+  def add_child(self, area: Area) -> None:
+    """Adds an area nested in this one, only used during initial parsing."""
+    area._parent = self
+    self._children.append(area)
+    self._lutron._invalidate_indexes()
 
   def add_output(self, output: Output) -> None:
     """Adds an output object that's part of this area, only used during
     initial parsing."""
     self._outputs.append(output)
+    self._lutron._invalidate_indexes()
+    for summary in (self._summary, self._lutron._summary):
+      summary._add_output(output)
+      output._summaries += (summary,)
 
   def add_keypad(self, keypad: Keypad) -> None:
     """Adds a keypad object that's part of this area, only used during
     initial parsing."""
     self._keypads.append(keypad)
+    self._lutron._invalidate_indexes()
 
   def add_sensor(self, sensor: MotionSensor) -> None:
     """Adds a motion sensor object that's part of this area, only used during
     initial parsing."""
     self._sensors.append(sensor)
+    self._lutron._invalidate_indexes()
 
   @property
   def name(self) -> str:
@@ -1476,14 +4461,160 @@ class Area(object):
   @property
   def outputs(self) -> Tuple[Output, ...]:
     """Return the tuple of the Outputs from this area."""
-    return tuple(output for output in self._outputs)
+    return tuple(self._outputs)
 
   @property
   def keypads(self) -> Tuple[Keypad, ...]:
     """Return the tuple of the Keypads from this area."""
-    return tuple(keypad for keypad in self._keypads)
+    return tuple(self._keypads)
 
   @property
   def sensors(self) -> Tuple[MotionSensor, ...]:
     """Return the tuple of the MotionSensors from this area."""
-    return tuple(sensor for sensor in self._sensors)
+    return tuple(self._sensors)
+
+  @property
+  def summary(self) -> AreaSummary:
+    """Aggregate state of the outputs in this area, kept up to date as their
+    levels change."""
+    return self._summary
+
+  @property
+  def parent(self) -> Optional[Area]:
+    """The area this one is nested in, None for a top-level area."""
+    return self._parent
+
+  @property
+  def children(self) -> Tuple[Area, ...]:
+    """The areas nested directly in this one."""
+    return tuple(self._children)
+
+  def subscribe(self, handler: LutronEventHandler, context: Any) -> Callable[[], None]:
+    """Subscribes to the events of every entity in this area and the areas
+    below it, including their summaries. handler is called like one passed
+    to LutronEntity.subscribe(), on the thread that received the update.
+    Returns a callable that unsubscribes. See also
+    AsyncLutron.subscribe_events()."""
+    return self._lutron.subscribe_events(handler, context, area=self)
+
+
+class AreaSummary(LutronEntity):
+  """Aggregate state of a set of outputs (an area's, or the whole house's),
+  maintained incrementally as output levels change.
+
+  Outputs that are shades or motors count as shades, everything else as
+  lights. Subscribers get a CHANGED event whenever one of the values in
+  as_dict() changes; updates that leave them all as they were are silent.
+  """
+  __slots__ = ('_id', 'lights', 'lights_on', 'watts', 'max_level', '_level_sum', '_level_counts',
+               '_level_heap', 'shades', 'shades_open', '_shade_sum', '_last')
+
+  class Event(LutronEvent):
+    """AreaSummary events that can be generated.
+
+    CHANGED: One of the aggregate values changed.
+        Params: the values of as_dict().
+    """
+    CHANGED = 1
+
+  def __init__(self, lutron: AsyncLutron, name: str, integration_id: int) -> None:
+    super(AreaSummary, self).__init__(lutron, name, "")
+    self._id = integration_id
+    self._reset()
+
+  def _reset(self) -> None:
+    """Forgets every output, without notifying subscribers."""
+    self.lights = 0
+    self.lights_on = 0
+    # Sum of watts * level / 100 over the lights.
+    self.watts = 0.0
+    self.max_level = 0.0
+    self._level_sum = 0.0
+    # Number of lights at each level, and a max-heap (of negated levels) of
+    # its keys to find the next max_level. Levels no light is at anymore are
+    # only dropped from the heap once they reach its top.
+    self._level_counts: Dict[float, int] = {}
+    self._level_heap: List[float] = []
+    self.shades = 0
+    self.shades_open = 0
+    self._shade_sum = 0.0
+    self._last = self._values()
+
+  def __repr__(self) -> str:
+    return str(dict(self.as_dict(), name=self._name))
+
+  @property
+  def id(self) -> int:
+    """The integration id of the area, 0 for the house."""
+    return self._id
+
+  @property
+  def average_level(self) -> float:
+    """Average level of the lights, 0 if there are none."""
+    return self._level_sum / self.lights if self.lights else 0.0
+
+  @property
+  def shade_position(self) -> Optional[float]:
+    """Average position of the shades, None if there are none."""
+    return self._shade_sum / self.shades if self.shades else None
+
+  def as_dict(self) -> Dict[str, Any]:
+    return dict(zip(('lights_on', 'watts', 'max_level', 'average_level', 'shades_open', 'shade_position'),
+                    self._values()))
+
+  def _values(self) -> Tuple[Any, ...]:
+    position = self.shade_position
+    return (self.lights_on, round(self.watts, 2), self.max_level, round(self.average_level, 2),
+            self.shades_open, round(position, 2) if position is not None else None)
+
+  def _add_output(self, output: Output) -> None:
+    if isinstance(output, _MotorizedOutput):
+      self.shades += 1
+    else:
+      self.lights += 1
+      self._count_level(output._level, 1)
+    self._level_changed(output, 0.0, output._level, added=True)
+
+  def _count_level(self, level: float, delta: int) -> None:
+    counts = self._level_counts
+    count = counts.get(level, 0) + delta
+    if count <= 0:
+      counts.pop(level, None)
+      return
+    if level not in counts:
+      heap = self._level_heap
+      if len(heap) > 2 * len(counts) + 16:
+        # Too many levels that were left; rebuild without them.
+        heap[:] = [-known for known in counts]
+        heapq.heapify(heap)
+      heapq.heappush(heap, -level)
+    counts[level] = count
+
+  def _level_changed(self, output: Output, old: float, new: float, added: bool = False) -> None:
+    """Applies one output's level change in O(log n) amortized time, n being
+    the number of distinct light levels, and emits CHANGED if that changed
+    any of the aggregate values."""
+    if isinstance(output, _MotorizedOutput):
+      self._shade_sum += new - old
+      self.shades_open += (new > 0) - (old > 0)
+    else:
+      self.lights_on += (new > 0) - (old > 0)
+      self.watts += output._watts * (new - old) / 100
+      self._level_sum += new - old
+      counts = self._level_counts
+      if not added:
+        self._count_level(new, 1)
+        self._count_level(old, -1)
+      if new > self.max_level:
+        self.max_level = new
+      elif old == self.max_level and old not in counts:
+        heap = self._level_heap
+        while heap and -heap[0] not in counts:
+          heapq.heappop(heap)
+        self.max_level = 0.0 - heap[0] if heap else 0.0
+    values = self._values()
+    if values == self._last:
+      return
+    self._last = values
+    if not added:
+      self._dispatch_event(AreaSummary.Event.CHANGED, self.as_dict())
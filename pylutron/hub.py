@@ -0,0 +1,173 @@
+"""
+Runs many controllers from one process on a single asyncio event loop.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from . import AreaSummary, AsyncLutron, KeypadComponent, Lutron, LutronEntity, LutronEventTuple
+
+_LOGGER = logging.getLogger(__name__)
+
+# (controller GUID, command type, integration id, component number), see
+# LutronHub.key().
+HubKey = Tuple[str, str, int, int]
+
+
+class ControllerHealth(object):
+  """Snapshot of the state of one controller managed by a LutronHub."""
+  __slots__ = ('guid', 'host', 'connected', 'error', 'lines_received', 'idle',
+               'queue_depth', 'replies', 'timeouts', 'average_rtt', 'max_rtt')
+
+  def __init__(self, lutron: AsyncLutron, error: Optional[BaseException]) -> None:
+    conn = lutron._conn
+    stats = lutron.query_stats
+    self.guid = lutron.guid
+    self.host = lutron._host
+    self.connected = conn.connected
+    # Why the last connect() failed, if it did.
+    self.error = str(error) if error is not None else None
+    self.lines_received = conn.lines_received
+    # Seconds since the last line was received, None if nothing was.
+    self.idle = (time.monotonic() - conn.last_received
+                 if conn.last_received is not None else None)
+    self.queue_depth = sum(session.queue_depth for session in lutron.sessions)
+    self.replies = stats.replies
+    self.timeouts = stats.timeouts
+    self.average_rtt = stats.average_rtt
+    self.max_rtt = stats.max_rtt
+
+  def __repr__(self) -> str:
+    return str({name: getattr(self, name) for name in self.__slots__})
+
+
+class LutronHub(object):
+  """Manages a fleet of controllers on the caller's event loop.
+
+  Every controller is an AsyncLutron, so no thread is created per controller.
+  Entities are addressed by hub-wide keys (see key()), events of all
+  controllers are available as one stream and health() reports the state of
+  every controller.
+  """
+
+  def __init__(self) -> None:
+    self._controllers: List[AsyncLutron] = []
+    # Outcome of the last connect() of each controller.
+    self._errors: Dict[AsyncLutron, Optional[BaseException]] = {}
+    self._streams: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue[LutronEventTuple]]] = []
+
+  def add(self, host: str, user: str, password: str, **options: Any) -> AsyncLutron:
+    """Creates an AsyncLutron for the given controller and manages it.
+    options are passed on to AsyncLutron."""
+    return self.add_controller(AsyncLutron(host, user, password, **options))
+
+  def add_controller(self, lutron: AsyncLutron) -> AsyncLutron:
+    """Manages an existing AsyncLutron. Threaded Lutron objects run their own
+    loop and cannot be added."""
+    if isinstance(lutron, Lutron):
+      raise ValueError("LutronHub manages AsyncLutron objects, not Lutron")
+    self._controllers.append(lutron)
+    lutron._event_queues.extend(self._streams)
+    return lutron
+
+  @property
+  def controllers(self) -> Tuple[AsyncLutron, ...]:
+    return tuple(self._controllers)
+
+  def controller(self, guid: str) -> Optional[AsyncLutron]:
+    """Returns the controller with the given GUID (known once its database
+    is loaded)."""
+    for lutron in self._controllers:
+      if lutron.guid == guid:
+        return lutron
+    return None
+
+  @staticmethod
+  def key(entity: LutronEntity) -> HubKey:
+    """Returns the hub-wide key of an entity: (controller GUID, command type,
+    integration id, component number). The command type is the one the
+    controller uses for the entity ('OUTPUT', 'DEVICE' or 'GROUP'), or 'AREA'
+    for area summaries. Buttons and LEDs are keyed by their keypad's id and
+    their component number, which is 0 for everything else."""
+    guid = entity._lutron.guid
+    if isinstance(entity, KeypadComponent):
+      return guid, 'DEVICE', entity._keypad.id, entity.component_number
+    if isinstance(entity, AreaSummary):
+      return guid, 'AREA', entity.id, 0
+    cmd_type = getattr(entity, '_CMD_TYPE', None)
+    if cmd_type is None:
+      raise ValueError("%r has no hub-wide key" % entity)
+    return guid, cmd_type, entity.id, 0
+
+  def entity(self, key: HubKey) -> Optional[LutronEntity]:
+    """Looks up an entity by the key key() returned for it."""
+    guid, cmd_type, integration_id, component = key
+    lutron = self.controller(guid)
+    if lutron is None:
+      return None
+    registry = lutron.registry
+    if component:
+      return registry.component(integration_id, component)
+    if cmd_type == 'AREA':
+      if not integration_id:
+        return lutron.summary
+      for root in registry.roots:
+        for area in registry.subtree(root):
+          if area.id == integration_id:
+            return area.summary
+      return None
+    return registry.by_id(cmd_type, integration_id)
+
+  async def load_xml_db(self, **kwargs: Any) -> None:
+    """Loads the database of every controller concurrently. kwargs are
+    passed on to async_load_xml_db()."""
+    await asyncio.gather(*(lutron.async_load_xml_db(**kwargs) for lutron in self._controllers))
+
+  async def connect(self) -> List[AsyncLutron]:
+    """Connects every controller concurrently. A controller failing to
+    connect does not affect the others. Returns those that failed; see
+    health() for why."""
+    results = await asyncio.gather(*(lutron.async_connect() for lutron in self._controllers),
+                                   return_exceptions=True)
+    failed: List[AsyncLutron] = []
+    for lutron, result in zip(self._controllers, results):
+      if isinstance(result, BaseException):
+        if not isinstance(result, Exception):
+          raise result
+        _LOGGER.warning("Failed to connect to %s: %s" % (lutron._host, result))
+        failed.append(lutron)
+        self._errors[lutron] = result
+      else:
+        self._errors[lutron] = None
+    return failed
+
+  async def close(self) -> None:
+    """Closes the connections to every controller."""
+    await asyncio.gather(*(lutron.async_close() for lutron in self._controllers))
+
+  async def events(self) -> AsyncGenerator[LutronEventTuple, None]:
+    """Asynchronously iterates over the events of every controller, see
+    AsyncLutron.events(). Use key() to tell which controller an entity
+    belongs to."""
+    queue: asyncio.Queue[LutronEventTuple] = asyncio.Queue()
+    entry = (asyncio.get_running_loop(), queue)
+    self._streams.append(entry)
+    for lutron in self._controllers:
+      lutron._event_queues.append(entry)
+    try:
+      while True:
+        yield await queue.get()
+    finally:
+      self._streams.remove(entry)
+      for lutron in self._controllers:
+        lutron._event_queues.remove(entry)
+
+  def health(self) -> List[ControllerHealth]:
+    """Returns the current health of every controller, in the order they
+    were added."""
+    return [ControllerHealth(lutron, self._errors.get(lutron)) for lutron in self._controllers]
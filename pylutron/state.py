@@ -0,0 +1,246 @@
+"""
+Columnar store of the cached state of every output, LED and occupancy group.
+
+"""
+
+from __future__ import annotations
+
+import array
+import importlib
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import AsyncLutron, Led, LutronEntity, OccupancyGroup, Output
+
+try:
+  _numpy: Any = importlib.import_module('numpy')
+except ImportError:
+  _numpy = None
+
+# Column name -> array typecode, and the value of rows the column does not
+# apply to (e.g. the level of an LED).
+_COLUMNS: Tuple[Tuple[str, str, float], ...] = (
+    ('level', 'd', -1.0),
+    ('updated', 'd', 0.0),
+    ('led', 'b', -1),
+    ('occupancy', 'h', -1),
+)
+
+
+class StateSnapshot(object):
+  """The state columns of a StateStore, one row per entity.
+
+  level: output level, -1 for rows that aren't outputs.
+  updated: time.time() of the last change of the row, 0 if never changed.
+  led: Led state (Led.LED_OFF etc.), -1 for rows that aren't LEDs.
+  occupancy: OccupancyGroup.State value, -1 for rows that aren't groups.
+
+  The columns are NumPy arrays when the store uses NumPy, memoryviews
+  otherwise; either way they share the memory of the underlying arrays.
+  Live views returned by StateStore.view() look the columns up in the store
+  on every access, so they see later updates and rows, also after the store
+  grew; a column fetched from a view is pinned to the buffer it was taken
+  from, so fetch it again rather than keeping it. Snapshots returned by
+  StateStore.snapshot() hold copies.
+  """
+  __slots__ = ('taken_at', '_store', '_frozen', '_entities', '_numpy')
+
+  def __init__(self, store: StateStore, frozen: Optional[Tuple[List[array.array[Any]], int]]) -> None:
+    self.taken_at = time.time()
+    # The store for a live view, the copied columns and row count otherwise.
+    self._store = store if frozen is None else None
+    self._frozen = frozen
+    # Shared with the store; rows are only ever appended.
+    self._entities = store._entities
+    self._numpy = store._numpy
+
+  def _frame(self) -> Tuple[List[array.array[Any]], int]:
+    """Returns the raw columns and the number of rows, consistent with
+    each other."""
+    if self._store is not None:
+      return self._store._frame()
+    assert self._frozen is not None
+    return self._frozen
+
+  def _expose(self, column: array.array[Any], rows: int) -> Any:
+    if self._numpy:
+      return _numpy.frombuffer(column, dtype=column.typecode, count=rows)
+    return memoryview(column)[:rows].toreadonly()
+
+  def _column(self, index: int) -> Any:
+    columns, rows = self._frame()
+    return self._expose(columns[index], rows)
+
+  @property
+  def level(self) -> Any:
+    return self._column(0)
+
+  @property
+  def updated(self) -> Any:
+    return self._column(1)
+
+  @property
+  def led(self) -> Any:
+    return self._column(2)
+
+  @property
+  def occupancy(self) -> Any:
+    return self._column(3)
+
+  @property
+  def rows(self) -> int:
+    return self._frame()[1]
+
+  @property
+  def live(self) -> bool:
+    """Whether this is a view of the store rather than a copy."""
+    return self._store is not None
+
+  def __len__(self) -> int:
+    return self.rows
+
+  def entity(self, row: int) -> LutronEntity:
+    """Returns the entity of a row."""
+    if not 0 <= row < self.rows:
+      raise IndexError(row)
+    return self._entities[row]
+
+  def _select(self, rows: Any) -> List[LutronEntity]:
+    entities = self._entities
+    return [entities[row] for row in rows]
+
+  def _above(self, index: int, threshold: float) -> List[LutronEntity]:
+    columns, rows = self._frame()
+    column = self._expose(columns[index], rows)
+    if self._numpy:
+      return self._select(_numpy.flatnonzero(column > threshold))
+    return self._select(row for row, value in enumerate(column) if value > threshold)
+
+  def level_above(self, threshold: float = 0.0) -> List[LutronEntity]:
+    """Returns the outputs whose level is above threshold, e.g. those that
+    are on."""
+    return self._above(0, threshold)
+
+  def updated_since(self, timestamp: float) -> List[LutronEntity]:
+    """Returns the entities whose state changed after timestamp."""
+    return self._above(1, timestamp)
+
+  def changed(self, other: StateSnapshot) -> List[LutronEntity]:
+    """Returns the entities whose level, LED or occupancy state differs
+    between other and this snapshot. Rows only one of them has count as
+    changed."""
+    mine, my_rows = self._frame()
+    theirs, their_rows = other._frame()
+    common = min(my_rows, their_rows)
+    compared = [(self._expose(mine[index], common), other._expose(theirs[index], common))
+                for index in (0, 2, 3)]
+    if self._numpy and other._numpy:
+      differs = _numpy.zeros(common, dtype=bool)
+      for a, b in compared:
+        differs |= a != b
+      rows: List[int] = _numpy.flatnonzero(differs).tolist()
+    else:
+      rows = [row for row in range(common) if any(a[row] != b[row] for a, b in compared)]
+    rows.extend(range(common, max(my_rows, their_rows)))
+    return self._select(rows)
+
+
+class StateStore(object):
+  """Mirrors the cached state of a controller's entities in contiguous
+  columns, indexed by a dense row per entity, see StateSnapshot.
+
+  Create it with AsyncLutron.enable_state_store(). Outputs, LEDs and
+  occupancy groups write every state change into it; entities added later
+  get a row on their first change. view() exposes the columns without
+  copying them and snapshot() copies them in one go per column, which is
+  cheap enough to run every second for thousands of entities.
+
+  Columns are array.array buffers. When NumPy is installed (and use_numpy
+  isn't False) they are exposed as NumPy arrays over the same memory and
+  the queries of StateSnapshot are vectorized.
+  """
+
+  def __init__(self, lutron: AsyncLutron, use_numpy: Optional[bool] = None,
+               capacity: int = 256) -> None:
+    if use_numpy and _numpy is None:
+      raise ImportError("NumPy is not installed")
+    self._numpy = _numpy is not None if use_numpy is None else use_numpy
+    self._lock = threading.Lock()
+    self._rows: Dict[LutronEntity, int] = {}
+    self._entities: List[LutronEntity] = []
+    self._capacity = max(1, capacity)
+    self._columns = [array.array(typecode, [fill]) * self._capacity
+                     for _, typecode, fill in _COLUMNS]
+    registry = lutron.registry
+    for output in registry.by_type(Output):
+      self._set(output, 0, output._level, 0.0)
+    for led in registry.by_type(Led):
+      self._set(led, 2, led._state, 0.0)
+    for group in registry.by_type(OccupancyGroup):
+      self._set(group, 3, group._state.value, 0.0)
+
+  @property
+  def numpy(self) -> bool:
+    """Whether the columns are exposed as NumPy arrays."""
+    return self._numpy
+
+  def __len__(self) -> int:
+    return len(self._entities)
+
+  def row(self, entity: LutronEntity) -> Optional[int]:
+    """Returns the row of entity, None if it has none (yet)."""
+    return self._rows.get(entity)
+
+  def view(self) -> StateSnapshot:
+    """Returns a live view of the columns, which never copies them. Every
+    access to it sees the current state, including rows added since."""
+    return StateSnapshot(self, None)
+
+  def snapshot(self) -> StateSnapshot:
+    """Returns a copy of the columns as they are now."""
+    with self._lock:
+      rows = len(self._entities)
+      return StateSnapshot(self, ([column[:rows] for column in self._columns], rows))
+
+  def _frame(self) -> Tuple[List[array.array[Any]], int]:
+    """Returns the current columns and number of rows. The columns are
+    replaced, not resized, when the store grows, so they stay valid."""
+    with self._lock:
+      return self._columns, len(self._entities)
+
+  def _set(self, entity: LutronEntity, column: int, value: float, when: float) -> None:
+    """Stores value, stamping the row with when unless it is unchanged."""
+    with self._lock:
+      row = self._rows.get(entity)
+      if row is None:
+        row = self._add(entity)
+      columns = self._columns
+      if columns[column][row] != value:
+        columns[column][row] = value
+        columns[1][row] = when
+
+  def _add(self, entity: LutronEntity) -> int:
+    """Allocates a row. Full columns are replaced by copies twice their
+    size rather than resized, as views may still reference them."""
+    row = len(self._entities)
+    if row == self._capacity:
+      grown = []
+      for (_, typecode, fill), column in zip(_COLUMNS, self._columns):
+        new = array.array(typecode, column)
+        new.extend(array.array(typecode, [fill]) * self._capacity)
+        grown.append(new)
+      self._columns = grown
+      self._capacity *= 2
+    self._rows[entity] = row
+    self._entities.append(entity)
+    return row
+
+  def _record_level(self, output: Output, level: float) -> None:
+    self._set(output, 0, level, time.time())
+
+  def _record_led(self, led: Led, state: int) -> None:
+    self._set(led, 2, state, time.time())
+
+  def _record_occupancy(self, group: OccupancyGroup, state: int) -> None:
+    self._set(group, 3, state, time.time())
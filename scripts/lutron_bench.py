@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for pylutron hot paths.
+
+Usage: lutron_bench.py <benchmark> [--xml motors.xml]
+
+Most benchmarks print the old and new code path side by side so the effect
+of a change can be measured on the same database. entity-memory has no old
+code path left to run; it reports the current figure, to be compared across
+commits.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+# Add the parent directory to sys.path so we can import pylutron
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pylutron import Lutron, LutronXmlDbParser, OccupancyGroup
+
+DEFAULT_XML = os.path.join(os.path.dirname(__file__), '..', 'motors.xml')
+
+
+def load(xml_file: str) -> Lutron:
+    """Returns a Lutron object populated from xml_file, without connecting."""
+    lutron = Lutron('localhost', 'user', 'password')
+    lutron.load_xml_db(cache_path=xml_file)
+    return lutron
+
+
+def monitoring_lines(lutron: Lutron) -> List[str]:
+    """Synthesizes the monitoring lines a repeater sends for every entity."""
+    lines = []
+    for area in lutron.areas:
+        for output in area.outputs:
+            lines.append('~OUTPUT,%d,1,42.00' % output.id)
+        for keypad in area.keypads:
+            for button in keypad.buttons:
+                lines.append('~DEVICE,%d,%d,3' % (keypad.id, button.component_number))
+                lines.append('~DEVICE,%d,%d,4' % (keypad.id, button.component_number))
+            for led in keypad.leds:
+                lines.append('~DEVICE,%d,%d,9,1' % (keypad.id, led.component_number))
+        if area.id:
+            lines.append('~GROUP,%d,%d,3' % (area.id, OccupancyGroup._ACTION_STATE))
+    return lines
+
+
+def _rate(fn: Callable[[bytes], None], lines: List[bytes], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            fn(line)
+    return len(lines) * repeat / (time.perf_counter() - start)
+
+
+def bench_recv(args: argparse.Namespace) -> None:
+    """Lines/sec from raw socket line to entity update: generic
+    handle_update() path versus the precomputed dispatch index, on str
+    (decode + rstrip, as LutronConnection does by default) and on bytes."""
+    lutron = load(args.xml)
+    lines = monitoring_lines(lutron)
+    raw = [(line + '\r\n').encode('ascii') for line in lines]
+    generic = lutron._recv_generic
+    dispatch = lutron._recv
+    results: Dict[str, float] = {
+        'str, generic': _rate(lambda b: generic(b.decode('ascii').rstrip()), raw, args.repeat),
+        'str, dispatch index': _rate(lambda b: dispatch(b.decode('ascii').rstrip()), raw, args.repeat),
+        'bytes, dispatch index': _rate(lutron._recv_bytes, raw, args.repeat),
+    }
+    print(f"{len(lines)} distinct lines x {args.repeat}")
+    for name, rate in results.items():
+        print(f"  {name:28s} {rate:12,.0f} lines/sec")
+
+
+def bench_startup(args: argparse.Namespace) -> None:
+    """Seconds from a cached XML file to a populated Lutron object: parsing
+    the XML every time versus recreating the graph from the parsed cache."""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        parsed = os.path.join(tmpdir, 'parsed.json')
+        Lutron('localhost', 'user', 'password').load_xml_db(cache_path=args.xml, parsed_cache_path=parsed)
+
+        def xml() -> None:
+            Lutron('localhost', 'user', 'password').load_xml_db(cache_path=args.xml)
+
+        def cached() -> None:
+            Lutron('localhost', 'user', 'password').load_xml_db(cache_path=args.xml, parsed_cache_path=parsed)
+
+        repeat = max(1, args.repeat // 10)
+        print(f"{os.path.getsize(args.xml):,} bytes of XML, {os.path.getsize(parsed):,} bytes parsed cache, x {repeat}")
+        for name, fn in (('parse XML', xml), ('parsed cache', cached)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            elapsed = (time.perf_counter() - start) / repeat
+            print(f"  {name:28s} {elapsed * 1000:12.2f} ms")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def synthetic_xml(path: str, outputs: int, per_area: int = 100) -> None:
+    """Writes a database with the given number of outputs, per_area to a room."""
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" ?>\n<Project><GUID>0</GUID><Areas>'
+                '<Area Name="House" IntegrationID="0"><Areas>')
+        for area in range(0, outputs, per_area):
+            f.write(f'<Area Name="Room {area}" UUID="{area}" IntegrationID="{area + 1}" '
+                    f'OccupancyGroupAssignedToID="{area}"><Outputs>')
+            for i in range(area, min(area + per_area, outputs)):
+                f.write(f'<Output Name="Load {i}" UUID="{i}" IntegrationID="{i + 1}" '
+                        f'OutputType="INC" Wattage="60" SortOrder="0" />')
+            f.write('</Outputs></Area>')
+        f.write('</Areas></Area></Areas><OccupancyGroups>')
+        for area in range(0, outputs, per_area):
+            f.write(f'<OccupancyGroup UUID="{area}" OccupancyGroupNumber="{area}" />')
+        f.write('</OccupancyGroups></Project>')
+
+
+def _peak(fn: Callable[[], None]) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_parse_memory(args: argparse.Namespace) -> None:
+    """Peak Python memory while parsing: the DOM parser (file read into
+    memory, then ET.fromstring) versus the streaming parser fed from the
+    file. Both include the entity objects that are created."""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        synthetic = os.path.join(tmpdir, 'synthetic.xml')
+        synthetic_xml(synthetic, 50000)
+        for path in (args.xml, synthetic):
+            def dom() -> None:
+                with open(path, 'rb') as f:
+                    LutronXmlDbParser(Lutron('localhost', 'user', 'password'), f.read()).parse()
+
+            def streamed() -> None:
+                with open(path, 'rb') as f:
+                    LutronXmlDbParser(Lutron('localhost', 'user', 'password')).parse_stream(f)
+
+            print(f"{os.path.basename(path)}: {os.path.getsize(path):,} bytes")
+            for name, fn in (('DOM', dom), ('streaming', streamed)):
+                start = time.perf_counter()
+                peak = _peak(fn)
+                elapsed = time.perf_counter() - start
+                print(f"  {name:28s} {peak / 1e6:9.1f} MB peak {elapsed:8.2f} s")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_entity_memory(args: argparse.Namespace) -> None:
+    """Memory retained by the entity graph once the database is loaded
+    (the XML and DOM are freed by then), per entity. Only the current code
+    is measured; run it on two commits to compare."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        lutron = load(args.xml)
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    entities = len(lutron.registry)
+    print(f"{entities} entities in {len(lutron.areas)} areas")
+    print(f"  {'retained':28s} {retained:12,d} bytes")
+    print(f"  {'per entity':28s} {retained / entities:12,.0f} bytes")
+
+
+def bench_lookup(args: argparse.Namespace) -> None:
+    """Lookups/sec of an output by uuid: walking areas versus the registry."""
+    lutron = load(args.xml)
+    uuids = [o.uuid for a in lutron.areas for o in a.outputs]
+
+    def scan(uuid: str) -> None:
+        next(o for a in lutron.areas for o in a.outputs if o.uuid == uuid)
+
+    registry = lutron.registry
+    print(f"{len(uuids)} outputs x {args.repeat}")
+    for name, fn in (('tree scan', scan), ('registry', registry.by_uuid)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for uuid in uuids:
+                fn(uuid)
+        rate = len(uuids) * args.repeat / (time.perf_counter() - start)
+        print(f"  {name:28s} {rate:12,.0f} lookups/sec")
+
+
+BENCHMARKS = {
+    'entity-memory': bench_entity_memory,
+    'lookup': bench_lookup,
+    'parse-memory': bench_parse_memory,
+    'recv': bench_recv,
+    'startup': bench_startup,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='pylutron microbenchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--xml', default=DEFAULT_XML, help='XML database to load')
+    parser.add_argument('--repeat', type=int, default=200, help='Iterations per measurement')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,7 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     install_requires=['telnetlib3'],
+    extras_require={'numpy': ['numpy']},
     package_data={'pylutron': ['py.typed']},
     zip_safe=False,
 )
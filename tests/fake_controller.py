@@ -0,0 +1,56 @@
+"""In-memory stand-in for the telnet session used by the asyncio tests."""
+import asyncio
+from unittest.mock import MagicMock, AsyncMock
+from typing import Dict, List, Optional, Tuple
+
+
+class FakeController(object):
+    """Reader/writer pair standing in for the telnet session. Lines pushed with
+    feed() are returned by readline(). Every write is recorded in writes and
+    split into commands in written; a command found in replies makes the
+    fake controller answer with the mapped line."""
+
+    def __init__(self) -> None:
+        self.lines: asyncio.Queue[bytes] = asyncio.Queue()
+        self.written: List[bytes] = []
+        self.writes: List[bytes] = []
+        self.replies: Dict[bytes, bytes] = {}
+        self.reader = AsyncMock()
+        self.reader.readuntil.side_effect = self._readuntil
+        self.reader.readuntil_pattern.return_value = b'GNET> '
+        self.reader.readline.side_effect = self.lines.get
+        self.writer = MagicMock()
+        self.writer.drain = AsyncMock()
+        self.writer.write.side_effect = self._write
+
+    async def _readuntil(self, prompt: bytes) -> bytes:
+        return prompt
+
+    def _write(self, data: bytes) -> None:
+        self.writes.append(data)
+        for cmd in data.split(b'\r\n')[:-1]:
+            self.written.append(cmd + b'\r\n')
+            if cmd in self.replies:
+                self.feed(self.replies[cmd] + b'\r\n')
+
+    def feed(self, line: bytes) -> None:
+        self.lines.put_nowait(line)
+
+    async def factory(self, host: str, port: int, connect_timeout: Optional[float] = None,
+                      encoding: Optional[str] = None) -> Tuple[AsyncMock, MagicMock]:
+        return self.reader, self.writer
+
+
+class FakeControllers(object):
+    """Hands out a separate FakeController for every session opened through
+    factory(), in order."""
+
+    def __init__(self, count: int) -> None:
+        self.ctrls = [FakeController() for _ in range(count)]
+        self.opened = 0
+
+    async def factory(self, host: str, port: int, connect_timeout: Optional[float] = None,
+                      encoding: Optional[str] = None) -> Tuple[AsyncMock, MagicMock]:
+        ctrl = self.ctrls[self.opened]
+        self.opened += 1
+        return await ctrl.factory(host, port, connect_timeout, encoding)
@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, call
+from pylutron import AsyncLutron, Lutron, Output, Motor
+from typing import Dict
+
+from fake_controller import FakeController
+from test_db_cache import MOTORS_XML
+
+
+class TestApply(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron.load_xml_db(cache_path=MOTORS_XML)
+        self.lutron._conn = MagicMock()
+        self.send = self.lutron._conn.send
+
+    def output(self, integration_id: int) -> Output:
+        output = self.lutron.registry.by_id('OUTPUT', integration_id)
+        assert isinstance(output, Output)
+        return output
+
+    def levels(self, levels: Dict[int, float]) -> Dict[Output, float]:
+        return {self.output(i): level for i, level in levels.items()}
+
+    def test_unchanged_outputs_are_skipped(self) -> None:
+        handle = self.lutron.apply(self.levels({20: 0.0, 14: 0.0}))
+        self.assertTrue(handle.done)
+        self.assertEqual(handle.commands, 0)
+        self.send.assert_not_called()
+
+    def test_preset_button_is_pressed(self) -> None:
+        # Keypad 93 button 3 sets outputs 20, 14 and 13 to 0 with a 2s fade.
+        for i in (20, 14, 13):
+            self.output(i)._cache_level(100.0)
+        handle = self.lutron.apply(self.levels({20: 0.0, 14: 0.0, 13: 0.0}))
+        self.send.assert_called_once_with('#DEVICE,93,3,3')
+        self.assertEqual((handle.commands, handle.button.number if handle.button else None), (1, 3))
+        self.assertEqual(self.output(20).last_level(), 0.0)
+
+        # Outputs the preset touches but the caller did not mention must
+        # already be at the preset's level.
+        self.send.reset_mock()
+        self.output(20)._cache_level(100.0)
+        self.output(14)._cache_level(50.0)
+        handle = self.lutron.apply(self.levels({20: 0.0}))
+        self.assertIsNone(handle.button)
+        self.send.assert_called_once_with('#OUTPUT,20,1,0.00')
+
+    def test_fade_must_match_preset(self) -> None:
+        for i in (20, 14, 13):
+            self.output(i)._cache_level(100.0)
+        handle = self.lutron.apply(self.levels({20: 0.0, 14: 0.0, 13: 0.0}), fade=1.0)
+        self.assertIsNone(handle.button)
+        self.assertEqual(self.send.call_args_list, [call('#OUTPUT,%d,1,0.00,0:00:01' % i) for i in (20, 14, 13)])
+        for i in (20, 14, 13):
+            self.output(i)._cache_level(100.0)
+        self.send.reset_mock()
+        self.lutron.apply(self.levels({20: 0.0, 14: 0.0, 13: 0.0}), fade=2.0)
+        self.send.assert_called_once_with('#DEVICE,93,3,3')
+
+    def test_resolves_on_confirmations(self) -> None:
+        handle = self.lutron.apply(self.levels({33: 100.0, 20: 40.0}))
+        self.assertEqual(handle.commands, 2)
+        self.assertCountEqual(handle.pending, [self.output(33), self.output(20)])
+        self.lutron._recv('~OUTPUT,33,1,100.00')
+        self.lutron._recv('~OUTPUT,20,1,10.00')
+        self.assertFalse(handle.wait(0))
+        self.assertEqual(handle.pending, [self.output(20)])
+        self.lutron._recv('~OUTPUT,20,1,40.00')
+        self.assertTrue(handle.wait(0))
+        self.assertEqual(self.lutron._apply_handles, {})
+
+    def test_newer_level_supersedes(self) -> None:
+        output = self.output(33)
+        first = self.lutron.apply({output: 50.0})
+        second = self.lutron.apply({output: 70.0})
+        self.assertTrue(first.done)
+        self.assertFalse(first.wait(0))
+        self.assertEqual(first.superseded, [output])
+        self.lutron._recv('~OUTPUT,33,1,70.00')
+        self.assertTrue(second.wait(0))
+        self.assertEqual(self.lutron._apply_handles, {})
+
+        third = self.lutron.apply({output: 10.0})
+        output.set_level(20.0)
+        self.assertFalse(third.wait(0))
+        self.assertEqual(self.lutron._apply_handles, {})
+
+    def test_cancel(self) -> None:
+        # A relay reports 100 for a requested 50.
+        handle = self.lutron.apply(self.levels({33: 50.0, 20: 40.0}))
+        self.lutron._recv('~OUTPUT,33,1,100.00')
+        self.lutron._recv('~OUTPUT,20,1,40.00')
+        handle.cancel()
+        self.assertTrue(handle.done)
+        self.assertFalse(handle.wait(0))
+        self.assertEqual(handle.pending, [self.output(33)])
+        self.assertEqual(self.lutron._apply_handles, {})
+
+    def test_motor_rejected(self) -> None:
+        motor = next(o for o in self.lutron.registry.by_type(Motor))
+        with self.assertRaises(AttributeError):
+            self.lutron.apply({motor: 50.0})
+
+
+class TestAsyncApply(unittest.IsolatedAsyncioTestCase):
+    async def test_one_write_and_awaitable(self) -> None:
+        ctrl = FakeController()
+        lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=ctrl.factory)
+        outputs = [Output(lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(1, 5)]
+        await lutron.async_connect()
+        self.addAsyncCleanup(lutron.async_close)
+        ctrl.writes.clear()
+
+        handle = lutron.apply({output: 50.0 for output in outputs})
+        await asyncio.sleep(0)
+        self.assertEqual(ctrl.writes, [b''.join(b'#OUTPUT,%d,1,50.00\r\n' % o.id for o in outputs)])
+        self.assertFalse(await handle.async_wait(0.01))
+        for output in outputs:
+            ctrl.feed(b'~OUTPUT,%d,1,50.00\r\n' % output.id)
+        self.assertTrue(await asyncio.wait_for(handle, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import MagicMock
+from pylutron import Lutron, LutronXmlDbParser, Area, Output
+from typing import Any, List
+
+from test_db_cache import MOTORS_XML
+from test_stream_parser import NESTED_XML
+
+
+class TestAreaTree(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        parser = LutronXmlDbParser(self.lutron, NESTED_XML)
+        self.assertTrue(parser.parse())
+        self.lutron._areas = parser.areas
+        self.lutron._conn = MagicMock()
+        self.floor, self.room = self.lutron.areas
+
+    def test_parent_and_children(self) -> None:
+        self.assertIsNone(self.floor.parent)
+        self.assertEqual(self.floor.children, (self.room,))
+        self.assertIs(self.room.parent, self.floor)
+        self.assertEqual(self.room.children, ())
+
+    def test_subtree_queries(self) -> None:
+        registry = self.lutron.registry
+        self.assertEqual(registry.roots, (self.floor,))
+        self.assertEqual(registry.subtree(self.floor), [self.floor, self.room])
+        self.assertEqual([o.id for o in registry.subtree_outputs(self.floor)], [20, 30])
+        self.assertEqual([o.id for o in registry.subtree_outputs(self.room)], [30])
+        self.assertEqual([k.id for k in registry.subtree_keypads(self.floor)], [10])
+        self.assertEqual(registry.subtree_keypads(self.room), [])
+        button = self.floor.keypads[0].buttons[0]
+        self.assertIs(registry.area_of(button), self.floor)
+        self.assertTrue(registry.in_subtree(self.floor, self.room.outputs[0]))
+        self.assertFalse(registry.in_subtree(self.room, button))
+
+    def test_index_follows_new_areas(self) -> None:
+        self.assertEqual(len(self.lutron.registry.subtree(self.room)), 1)
+        closet = Area(self.lutron, "Closet", 3, None)
+        self.room.add_child(closet)
+        closet.add_output(Output(self.lutron, "Bulb", 40, "INC", 40, "41"))
+        self.assertEqual(self.lutron.registry.subtree(self.floor), [self.floor, self.room, closet])
+        self.assertEqual([o.id for o in self.lutron.registry.subtree_outputs(self.room)], [30, 40])
+
+    def test_subtree_subscription(self) -> None:
+        events: List[Any] = []
+        unsubscribe = self.floor.subscribe(lambda obj, ctx, ev, params: events.append((obj, ctx)), 'ctx')
+        self.lutron._recv('~OUTPUT,30,1,50.00')
+        self.assertIn((self.room.outputs[0], 'ctx'), events)
+        self.assertIn((self.room.summary, 'ctx'), events)
+        events.clear()
+        self.room.subscribe(lambda obj, ctx, ev, params: events.append((obj, ctx)), 'room')
+        self.lutron._recv('~OUTPUT,20,1,50.00')
+        self.assertEqual({ctx for _, ctx in events}, {'ctx'})
+        unsubscribe()
+        events.clear()
+        self.lutron._recv('~OUTPUT,20,1,0.00')
+        self.assertEqual(events, [])
+
+
+class TestRealDatabase(unittest.TestCase):
+    def test_roots_cover_every_entity(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass')
+        lutron.load_xml_db(cache_path=MOTORS_XML)
+        registry = lutron.registry
+        self.assertEqual(list(registry.roots), [area for area in lutron.areas if area.parent is None])
+        self.assertCountEqual([area for root in registry.roots for area in registry.subtree(root)],
+                              lutron.areas)
+        self.assertCountEqual([o for root in registry.roots for o in registry.subtree_outputs(root)],
+                              registry.by_type(Output))
+        for area in lutron.areas:
+            for child in area.children:
+                self.assertTrue(set(registry.subtree(child)) < set(registry.subtree(area)))
+
+
+if __name__ == '__main__':
+    unittest.main()
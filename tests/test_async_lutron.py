@@ -0,0 +1,160 @@
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+import asyncio
+import threading
+from pylutron import (AsyncLutron, AsyncLutronConnection, Lutron, LutronConnection,
+                      LutronLoginError, Output, Led, Keypad)
+from typing import List
+
+from fake_controller import FakeController
+
+
+class TestAsyncLutronConnection(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+        self.received: List[str] = []
+        self.conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', self.received.append,
+                                          connection_factory=self.ctrl.factory)
+
+    async def asyncTearDown(self) -> None:
+        await self.conn.close()
+
+    async def test_connect_runs_on_caller_loop(self) -> None:
+        threads = threading.active_count()
+        await self.conn.connect()
+        self.assertTrue(self.conn.connected)
+        self.assertEqual(threading.active_count(), threads)
+
+        self.ctrl.feed(b'~OUTPUT,1,1,100.00\r\n')
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        self.assertEqual(self.received, ['~OUTPUT,1,1,100.00'])
+
+    async def test_recv_bytes_callback(self) -> None:
+        raw: List[bytes] = []
+        conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', self.received.append,
+                                     connection_factory=self.ctrl.factory,
+                                     recv_bytes_callback=raw.append)
+        await conn.connect()
+        self.addAsyncCleanup(conn.close)
+        self.ctrl.feed(b'~OUTPUT,1,1,100.00\r\n')
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        self.assertEqual(raw, [b'~OUTPUT,1,1,100.00\r\n'])
+        self.assertEqual(self.received, [])
+
+    async def test_send_and_write(self) -> None:
+        await self.conn.connect()
+        await self.conn.send('#OUTPUT,1,1,50.00')
+        self.assertEqual(self.ctrl.written[-1], b'#OUTPUT,1,1,50.00\r\n')
+        self.conn.write('#OUTPUT,2,1,0.00')
+        self.assertEqual(self.ctrl.written[-1], b'#OUTPUT,1,1,50.00\r\n')
+        await asyncio.sleep(0)
+        self.assertEqual(self.ctrl.written[-1], b'#OUTPUT,2,1,0.00\r\n')
+
+    async def test_connect_login_failure(self) -> None:
+        self.ctrl.reader.readuntil_pattern.return_value = AsyncLutronConnection.USER_PROMPT
+        with self.assertRaisesRegex(LutronLoginError, "Incorrect username or password"):
+            await self.conn.connect()
+        self.assertFalse(self.conn.connected)
+
+    async def test_close(self) -> None:
+        await self.conn.connect()
+        await self.conn.close()
+        self.assertFalse(self.conn.connected)
+        self.conn.write('#OUTPUT,1,1,50.00')
+        self.assertNotIn(b'#OUTPUT,1,1,50.00\r\n', self.ctrl.written)
+
+
+class TestAsyncLutron(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+        self.lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrl.factory)
+        self.output = Output(self.lutron, "Ceiling Light", 100, "DIMMER", 1, "601")
+        await self.lutron.async_connect()
+
+    async def asyncTearDown(self) -> None:
+        await self.lutron.async_close()
+
+    async def test_send(self) -> None:
+        self.output.level = 50.0
+        await self.lutron.async_send(Lutron.OP_EXECUTE, 'OUTPUT', 2, 1, 10)
+        self.assertIn(b'#OUTPUT,1,1,50.00\r\n', self.ctrl.written)
+        self.assertEqual(self.ctrl.written[-1], b'#OUTPUT,2,1,10\r\n')
+
+    async def test_async_level(self) -> None:
+        self.ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,42.00'
+        self.assertEqual(await self.output.async_level(), 42.0)
+
+    async def test_async_level_timeout_returns_cached(self) -> None:
+        self.output.handle_update(['1', '12.00'])
+        self.assertEqual(await self.output.async_level(timeout=0.01), 12.0)
+
+    async def test_async_led_state(self) -> None:
+        keypad = Keypad(self.lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 5, "700")
+        led = Led(self.lutron, keypad, "LED 1", 1, 81, "701")
+        keypad.add_led(led)
+        self.ctrl.replies[b'?DEVICE,5,81,9'] = b'~DEVICE,5,81,9,1'
+        self.assertEqual(await led.async_state(), Led.LED_ON)
+
+    async def test_event_stream(self) -> None:
+        stream = self.lutron.events()
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        self.ctrl.feed(b'~OUTPUT,1,1,75.00\r\n')
+        entity, event, params = await asyncio.wait_for(pending, 1.0)
+        self.assertIs(entity, self.output)
+        self.assertEqual(event, Output.Event.LEVEL_CHANGED)
+        self.assertEqual(params, {'level': 75.0})
+        await stream.aclose()
+        self.assertEqual(self.lutron._event_queues, [])
+
+
+class TestSyncWrapper(unittest.TestCase):
+    def test_lutron_uses_thread_connection(self) -> None:
+        lutron = Lutron('127.0.0.1', 'user', 'pass')
+        self.assertIsInstance(lutron, AsyncLutron)
+        self.assertIsInstance(lutron._conn, LutronConnection)
+
+    def test_close_stops_thread(self) -> None:
+        reader = AsyncMock()
+        async def readuntil(prompt: bytes) -> bytes:
+            return prompt
+        async def readline() -> bytes:
+            await asyncio.sleep(10)
+            return b''
+        reader.readuntil.side_effect = readuntil
+        reader.readuntil_pattern.return_value = b'GNET> '
+        reader.readline.side_effect = readline
+        writer = MagicMock()
+        writer.drain = AsyncMock()
+        factory = AsyncMock(return_value=(reader, writer))
+
+        lutron = Lutron('127.0.0.1', 'user', 'pass', connection_factory=factory)
+        lutron.connect()
+        self.assertTrue(lutron._conn.connected)
+        lutron.close()
+        self.assertFalse(lutron._conn.is_alive())
+        self.assertFalse(lutron._conn.connected)
+
+
+class TestThreadedAsAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_awaitable_api(self) -> None:
+        """A Lutron can be used wherever an AsyncLutron is expected."""
+        ctrl = FakeController()
+        lutron: AsyncLutron = Lutron('127.0.0.1', 'user', 'pass', connection_factory=ctrl.factory)
+        output = Output(lutron, "Light", 100, "DIMMER", 1, "101")
+        await lutron.async_connect()
+        self.assertTrue(lutron._conn.connected)
+        ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,42.00'
+        result = await lutron.async_refresh_all(kinds=[Output], timeout=1.0)
+        self.assertEqual(result.completed, [output])
+        self.assertEqual(output.last_level(), 42.0)
+        await lutron.async_send(Lutron.OP_EXECUTE, 'OUTPUT', 1, 1, '10.00')
+        self.assertEqual(ctrl.written[-1], b'#OUTPUT,1,1,10.00\r\n')
+        await lutron.async_close()
+        self.assertFalse(lutron._conn.connected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock
+from pylutron import (Lutron, Output, Keypad, Button, Led, CoalescingDispatcher,
+                      ThreadPoolDispatcher)
+from typing import Any, List
+
+
+class TestCoalescingDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.dispatcher = CoalescingDispatcher(window=0.05)
+        self.lutron = Lutron('localhost', 'user', 'pass', dispatcher=self.dispatcher)
+        self.lutron._conn = MagicMock()
+        self.addCleanup(self.dispatcher.close)
+        self.events: List[Any] = []
+
+    def record(self, obj: Any, context: Any, event: Any, params: Any) -> None:
+        self.events.append((obj, event, params))
+
+    async def test_fade_is_collapsed(self) -> None:
+        first = Output(self.lutron, "First", 100, "DIMMER", 1, "1")
+        second = Output(self.lutron, "Second", 100, "DIMMER", 2, "2")
+        first.subscribe(self.record, None)
+        second.subscribe(self.record, None)
+
+        for level in range(1, 11):
+            self.lutron._recv('~OUTPUT,1,1,%d.00' % (level * 10))
+        self.lutron._recv('~OUTPUT,2,1,5.00')
+        self.assertEqual(self.events, [])
+        # The cached level is always current; only the events are held back.
+        self.assertEqual(first.last_level(), 100.0)
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.events, [
+            (first, Output.Event.LEVEL_CHANGED, {'level': 100.0}),
+            (second, Output.Event.LEVEL_CHANGED, {'level': 5.0})])
+        self.assertEqual(self.dispatcher.dropped, {Output.Event.LEVEL_CHANGED: 9})
+        self.assertEqual(self.dispatcher.stats.coalesced, 9)
+
+        # A new window opens after the previous one was delivered.
+        self.lutron._recv('~OUTPUT,1,1,50.00')
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.events[-1], (first, Output.Event.LEVEL_CHANGED, {'level': 50.0}))
+
+    async def test_led_coalesced_buttons_pass_through(self) -> None:
+        keypad = Keypad(self.lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 5, "50")
+        button = Button(self.lutron, keypad, "On", 1, "Toggle", None, "51")
+        led = Led(self.lutron, keypad, "LED 1", 1, 81, "52")
+        keypad.add_button(button)
+        keypad.add_led(led)
+        button.subscribe(self.record, None)
+        led.subscribe(self.record, None)
+
+        self.lutron._recv('~DEVICE,5,81,9,1')
+        self.lutron._recv('~DEVICE,5,1,3')
+        self.lutron._recv('~DEVICE,5,81,9,0')
+        self.lutron._recv('~DEVICE,5,1,4')
+        self.assertEqual([e[1] for e in self.events], [Button.Event.PRESSED, Button.Event.RELEASED])
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.events[-1], (led, Led.Event.STATE_CHANGED, {'state': Led.LED_OFF}))
+        self.assertEqual(self.dispatcher.dropped, {Led.Event.STATE_CHANGED: 1})
+
+    async def test_close_discards_held_events(self) -> None:
+        output = Output(self.lutron, "Light", 100, "DIMMER", 1, "1")
+        output.subscribe(self.record, None)
+        self.lutron._recv('~OUTPUT,1,1,10.00')
+        self.dispatcher.close()
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.events, [])
+
+
+class TestCoalescingWithoutLoop(unittest.TestCase):
+    def test_timer_thread_and_inner_dispatcher(self) -> None:
+        pool = ThreadPoolDispatcher(workers=1)
+        dispatcher = CoalescingDispatcher(window=0.02, inner=pool)
+        self.addCleanup(dispatcher.close)
+        self.assertIs(dispatcher.inner, pool)
+        lutron = Lutron('localhost', 'user', 'pass', dispatcher=dispatcher)
+        lutron._conn = MagicMock()
+        output = Output(lutron, "Light", 100, "DIMMER", 1, "1")
+        levels: List[float] = []
+        output.subscribe(lambda obj, ctx, ev, params: levels.append(params['level']), None)
+
+        for level in (10, 20, 30):
+            lutron._recv('~OUTPUT,1,1,%d.00' % level)
+        deadline = time.time() + 5
+        while not levels and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(pool.wait_idle(5))
+        self.assertEqual(levels, [30.0])
+        self.assertEqual(dispatcher.stats.coalesced, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import MagicMock
+from pylutron import AsyncLutron, Lutron, Output, QueryTimeoutError
+from typing import cast
+
+from fake_controller import FakeController
+
+
+class TestCorrelation(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron._conn = MagicMock()
+        self.output = Output(self.lutron, "Light", 100, "DIMMER", 1, "101")
+
+    def test_update_before_write_is_not_the_reply(self) -> None:
+        ev = threading.Event()
+        pending = self.lutron._attach_query('OUTPUT', 1, (1,), ev)
+        on_written = cast(MagicMock, self.lutron._conn.send).call_args[0][1]
+
+        # Still queued on the connection, so this is a monitoring update.
+        self.lutron._recv('~OUTPUT,1,1,10.00')
+        self.assertFalse(ev.is_set())
+        self.assertEqual(self.output.last_level(), 10.0)
+        self.assertEqual(self.lutron.query_stats.unsolicited, 1)
+
+        on_written()
+        self.lutron._recv('~OUTPUT,1,1,20.00')
+        self.assertTrue(ev.is_set())
+        assert pending.reply is not None
+        self.assertEqual(pending.reply.fields, ['1', '20.00'])
+        self.assertGreaterEqual(pending.reply.rtt, 0.0)
+        self.assertEqual(self.lutron._queries, {})
+
+    def test_other_components_do_not_complete(self) -> None:
+        ev = threading.Event()
+        self.lutron._attach_query('DEVICE', 5, (81, 9), ev)
+        cast(MagicMock, self.lutron._conn.send).call_args[0][1]()
+        self.lutron._recv('~DEVICE,5,82,9,1')
+        self.lutron._recv('~DEVICE,5,81,3')
+        self.lutron._recv('~OUTPUT,5,81,9')
+        self.assertFalse(ev.is_set())
+        self.lutron._recv('~DEVICE,5,81,9,1')
+        self.assertTrue(ev.is_set())
+
+    def test_bytes_pipeline(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass', bytes_pipeline=True)
+        lutron._conn = MagicMock()
+        Output(lutron, "Light", 100, "DIMMER", 1, "101")
+        ev = threading.Event()
+        lutron._attach_query('OUTPUT', 1, (1,), ev)
+        cast(MagicMock, lutron._conn.send).call_args[0][1]()
+        lutron._recv_bytes(b'~OUTPUT,1,1,20.00\r\n')
+        self.assertTrue(ev.is_set())
+
+    def test_blocking_timeout(self) -> None:
+        with self.assertRaises(QueryTimeoutError):
+            self.lutron.query('OUTPUT', 1, 1, timeout=0.01, retries=1)
+        self.assertEqual(cast(MagicMock, self.lutron._conn.send).call_count, 2)
+        self.assertEqual(self.lutron.query_stats.timeouts, 1)
+        self.assertEqual(self.lutron._queries, {})
+
+
+class TestAsyncCorrelation(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+        self.lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrl.factory)
+        self.output = Output(self.lutron, "Light", 100, "DIMMER", 1, "101")
+        await self.lutron.async_connect()
+        self.addAsyncCleanup(self.lutron.async_close)
+
+    def queries(self) -> int:
+        return self.ctrl.written.count(b'?OUTPUT,1,1\r\n')
+
+    async def test_reply(self) -> None:
+        self.ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,42.00'
+        reply = await self.lutron.async_query('OUTPUT', 1, 1)
+        self.assertEqual(reply.fields, ['1', '42.00'])
+        self.assertEqual(reply.attempts, 1)
+        self.assertEqual(self.output.last_level(), 42.0)
+        stats = self.lutron.query_stats
+        self.assertEqual((stats.queries, stats.sent, stats.replies), (1, 1, 1))
+        self.assertEqual(stats.max_rtt, reply.rtt)
+
+    async def test_concurrent_queries_are_shared(self) -> None:
+        self.ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,42.00'
+        replies = await asyncio.gather(*(self.lutron.async_query('OUTPUT', 1, 1) for _ in range(3)))
+        self.assertEqual(self.queries(), 1)
+        self.assertTrue(all(reply is replies[0] for reply in replies))
+        self.assertEqual(self.lutron.query_stats.shared, 2)
+
+    async def test_retries_then_timeout(self) -> None:
+        with self.assertRaises(QueryTimeoutError):
+            await self.lutron.async_query('OUTPUT', 1, 1, timeout=0.02, retries=2)
+        self.assertEqual(self.queries(), 3)
+        stats = self.lutron.query_stats
+        self.assertEqual((stats.retries, stats.timeouts, stats.replies), (2, 1, 0))
+        self.assertEqual(self.lutron._queries, {})
+
+    async def test_cancelled_query_is_not_a_timeout(self) -> None:
+        query = asyncio.ensure_future(self.lutron.async_query('OUTPUT', 1, 1, timeout=5.0))
+        await asyncio.sleep(0.01)
+        query.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await query
+        stats = self.lutron.query_stats
+        self.assertEqual((stats.cancelled, stats.timeouts), (1, 0))
+        self.assertEqual(self.lutron._queries, {})
+
+    async def test_retry_is_answered(self) -> None:
+        query = asyncio.ensure_future(self.lutron.async_query('OUTPUT', 1, 1, timeout=0.05, retries=1))
+        await asyncio.sleep(0.01)
+        self.ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,7.00'
+        reply = await query
+        self.assertEqual(reply.attempts, 2)
+        self.assertEqual(self.queries(), 2)
+
+    async def test_default_timeout_and_retries(self) -> None:
+        self.lutron.query_timeout = 0.01
+        self.lutron.query_retries = 1
+        self.output._level = 12.0
+        self.assertEqual(await self.output.async_level(), 12.0)
+        self.assertEqual(self.queries(), 2)
+
+
+class TestThreadedCorrelation(unittest.TestCase):
+    def test_blocking_query_and_getter(self) -> None:
+        ctrl = FakeController()
+        lutron = Lutron('127.0.0.1', 'user', 'pass', connection_factory=ctrl.factory)
+        output = Output(lutron, "Light", 100, "DIMMER", 1, "101")
+        lutron.connect()
+        self.addCleanup(lutron.close)
+        ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,42.00'
+        self.assertEqual(lutron.query('OUTPUT', 1, 1).fields, ['1', '42.00'])
+        ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,43.00'
+        self.assertEqual(output.level, 43.0)
+        self.assertEqual(lutron.query_stats.timeouts, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from pylutron import Lutron, Motor
+from typing import Any, List
+
+MOTORS_XML = os.path.join(os.path.dirname(__file__), '..', 'motors.xml')
+
+
+def describe(lutron: Lutron) -> List[Any]:
+    """Flattens the entity graph into plain values so two graphs compare."""
+    graph: List[Any] = [lutron.guid, lutron.name,
+                        sorted((cmd, sorted(ids)) for cmd, ids in lutron._ids.items())]
+    for area in lutron.areas:
+        group = area.occupancy_group
+        graph.append((area.name, area.id, group.group_number, group.uuid, group.id))
+        graph.append((area.parent.id if area.parent else None, [child.id for child in area.children]))
+        for output in area.outputs:
+            graph.append((type(output), output.name, output.watts, output.type, output.id,
+                          output.uuid, output.legacy_uuid))
+        for keypad in area.keypads:
+            graph.append((keypad.name, keypad.type, keypad.location, keypad.id, keypad.uuid))
+            for button in keypad.buttons:
+                graph.append((button.name, button.number, button.button_type,
+                              button._direction, button.uuid, button.legacy_uuid, button.preset))
+            for led in keypad.leds:
+                graph.append((led.name, led.number, led.component_number, led.uuid))
+        for sensor in area.sensors:
+            graph.append((sensor.name, sensor.id, sensor.uuid))
+    return graph
+
+
+class TestParsedDbCache(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.parsed = os.path.join(tmp.name, 'parsed.json')
+
+    def load(self) -> Lutron:
+        lutron = Lutron('localhost', 'user', 'pass')
+        self.assertTrue(lutron.load_xml_db(cache_path=MOTORS_XML, parsed_cache_path=self.parsed))
+        return lutron
+
+    def test_round_trip_is_identical(self) -> None:
+        reference = Lutron('localhost', 'user', 'pass')
+        reference.load_xml_db(cache_path=MOTORS_XML)
+
+        first = self.load()
+        self.assertTrue(os.path.exists(self.parsed))
+        with patch('pylutron.LutronXmlDbParser.parse') as parse:
+            second = self.load()
+        parse.assert_not_called()
+
+        self.assertEqual(describe(first), describe(reference))
+        self.assertEqual(describe(second), describe(reference))
+        self.assertTrue(any(isinstance(o, Motor) for a in second.areas for o in a.outputs))
+
+    def test_cached_entities_receive_updates(self) -> None:
+        self.load()
+        lutron = self.load()
+        output = next(o for a in lutron.areas for o in a.outputs)
+        lutron._recv('~OUTPUT,%d,1,42.00' % output.id)
+        self.assertEqual(output.last_level(), 42.0)
+
+    def test_stale_hash_reparses(self) -> None:
+        self.load()
+        with open(self.parsed) as f:
+            data = json.load(f)
+        data['xml_sha256'] = '0' * 64
+        data['project_name'] = 'Stale'
+        with open(self.parsed, 'w') as f:
+            json.dump(data, f)
+
+        lutron = self.load()
+        self.assertNotEqual(lutron.name, 'Stale')
+        with open(self.parsed) as f:
+            self.assertNotEqual(json.load(f)['xml_sha256'], '0' * 64)
+
+    def test_corrupt_cache_falls_back(self) -> None:
+        reference = self.load()
+        with open(self.parsed) as f:
+            data = json.load(f)
+        data['areas'][1][3] = [['truncated']]
+        with open(self.parsed, 'w') as f:
+            json.dump(data, f)
+
+        lutron = self.load()
+        self.assertEqual(describe(lutron), describe(reference))
+
+        with open(self.parsed, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(describe(self.load()), describe(reference))
+
+    def test_corrupt_cache_keeps_house_summary(self) -> None:
+        reference = self.load()
+        with open(self.parsed) as f:
+            data = json.load(f)
+        # Break the last area, after the others added their outputs.
+        data['areas'][-1][3].append(['truncated'])
+        with open(self.parsed, 'w') as f:
+            json.dump(data, f)
+
+        summary, expected = self.load().summary, reference.summary
+        self.assertGreater(expected.lights, 0)
+        self.assertEqual((summary.lights, summary.shades), (expected.lights, expected.shades))
+
+
+if __name__ == '__main__':
+    unittest.main()
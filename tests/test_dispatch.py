@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from pylutron import (Lutron, Output, Keypad, Button, Led, MotionSensor, Area,
+                      OccupancyGroup, BatteryStatus)
+from typing import Any, List
+
+
+class TestDispatchIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron._conn = MagicMock()
+        self.events: List[Any] = []
+
+    def _record(self, obj: Any, context: Any, event: Any, params: Any) -> None:
+        self.events.append((obj, event, params))
+
+    def test_output_level(self) -> None:
+        output = Output(self.lutron, "Light", 100, "DIMMER", 12, "601")
+        output.subscribe(self._record, None)
+        with patch.object(self.lutron, '_recv_generic') as generic:
+            self.lutron._recv('~OUTPUT,12,1,45.00')
+        generic.assert_not_called()
+        self.assertEqual(output.last_level(), 45.0)
+        self.assertEqual(self.events, [(output, Output.Event.LEVEL_CHANGED, {'level': 45.0})])
+
+    def test_keypad_components(self) -> None:
+        keypad = Keypad(self.lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 34, "700")
+        button = Button(self.lutron, keypad, "On", 1, "Toggle", None, "701")
+        led = Led(self.lutron, keypad, "LED 1", 1, 81, "702")
+        keypad.add_button(button)
+        # Build the index before the LED is added to check it gets rebuilt.
+        self.lutron._recv('~DEVICE,34,1,3')
+        keypad.add_led(led)
+        button.subscribe(self._record, None)
+        led.subscribe(self._record, None)
+
+        with patch.object(self.lutron, '_recv_generic') as generic:
+            self.lutron._recv('~DEVICE,34,1,3')
+            self.lutron._recv('~DEVICE,34,1,4')
+            self.lutron._recv('~DEVICE,34,1,6')
+            self.lutron._recv('~DEVICE,34,81,9,2')
+        generic.assert_not_called()
+        self.assertEqual([e[1] for e in self.events], [
+            Button.Event.PRESSED, Button.Event.RELEASED, Button.Event.DOUBLE_CLICKED,
+            Led.Event.STATE_CHANGED])
+        self.assertEqual(led.last_state, Led.LED_SLOW_FLASH)
+
+    def test_occupancy_group(self) -> None:
+        group = OccupancyGroup(self.lutron, "409", "409")
+        area = Area(self.lutron, "Kitchen", 11, group)
+        self.lutron._recv('~GROUP,11,3,4')
+        self.assertEqual(area.occupancy_group._state, OccupancyGroup.State.VACANT)
+        self.lutron._recv('~GROUP,11,3,17')
+        self.assertEqual(area.occupancy_group._state, OccupancyGroup.State.UNKNOWN)
+
+    def test_fallback_to_handle_update(self) -> None:
+        sensor = MotionSensor(self.lutron, "Sensor", 500, "900")
+        self.lutron._recv('~DEVICE,500,1,22,1,1,2,0')
+        self.assertEqual(sensor._battery, BatteryStatus.LOW)
+
+        # An LED line without the state is rejected by the fast path and then
+        # by handle_update(), same as before.
+        keypad = Keypad(self.lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 34, "700")
+        led = Led(self.lutron, keypad, "LED 1", 1, 81, "702")
+        keypad.add_led(led)
+        self.lutron._recv('~DEVICE,34,81,9')
+        self.assertEqual(led.last_state, Led.LED_OFF)
+
+    def test_unknown_lines(self) -> None:
+        Output(self.lutron, "Light", 100, "DIMMER", 12, "601")
+        for line in ('', 'GNET> ', '~OUTPUT,99,1,10.00', '~OUTPUT,12,2', '~ERROR,6', '~TIMECLOCK,1,2,3'):
+            self.lutron._recv(line)
+
+
+class TestBytesPipeline(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass', bytes_pipeline=True)
+        self.lutron._conn = MagicMock()
+
+    def test_connection_gets_bytes_callback(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass', bytes_pipeline=True)
+        self.assertEqual(lutron._conn._recv_bytes_cb, lutron._recv_bytes)
+        self.assertIsNone(Lutron('localhost', 'user', 'pass')._conn._recv_bytes_cb)
+
+    def test_dispatch_without_decoding(self) -> None:
+        output = Output(self.lutron, "Light", 100, "DIMMER", 12, "601")
+        keypad = Keypad(self.lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 34, "700")
+        button = Button(self.lutron, keypad, "On", 1, "Toggle", None, "701")
+        led = Led(self.lutron, keypad, "LED 1", 1, 81, "702")
+        keypad.add_button(button)
+        keypad.add_led(led)
+        group = OccupancyGroup(self.lutron, "409", "409")
+        Area(self.lutron, "Kitchen", 11, group)
+        pressed = MagicMock()
+        button.subscribe(pressed, None)
+
+        with patch.object(self.lutron, '_recv_generic') as generic:
+            self.lutron._recv_bytes(b'~OUTPUT,12,1,45.00\r\n')
+            self.lutron._recv_bytes(b'~DEVICE,34,1,3\r\n')
+            self.lutron._recv_bytes(b'~DEVICE,34,81,9,3\r\n')
+            self.lutron._recv_bytes(b'~GROUP,11,3,3\r\n')
+        generic.assert_not_called()
+        self.assertEqual(output.last_level(), 45.0)
+        pressed.assert_called_once_with(button, None, Button.Event.PRESSED, {})
+        self.assertEqual(led.last_state, Led.LED_FAST_FLASH)
+        self.assertEqual(group._state, OccupancyGroup.State.OCCUPIED)
+
+    def test_fallback_decodes(self) -> None:
+        sensor = MotionSensor(self.lutron, "Sensor", 500, "900")
+        with patch.object(self.lutron, '_recv_generic', wraps=self.lutron._recv_generic) as generic:
+            self.lutron._recv_bytes(b'~DEVICE,500,1,22,1,1,2,0\r\n')
+            self.lutron._recv_bytes(b'GNET> \r\n')
+        generic.assert_any_call('~DEVICE,500,1,22,1,1,2,0')
+        generic.assert_any_call('GNET>')
+        self.assertEqual(sensor._battery, BatteryStatus.LOW)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from pylutron import (Lutron, Output, InlineDispatcher, ThreadPoolDispatcher, LoopDispatcher,
+                      OverflowPolicy)
+from typing import Any, List
+
+
+class DispatcherTestBase(unittest.TestCase):
+    def make(self, dispatcher: Any) -> None:
+        self.dispatcher = dispatcher
+        self.lutron = Lutron('localhost', 'user', 'pass', dispatcher=dispatcher)
+        self.lutron._conn = MagicMock()
+        self.addCleanup(self.lutron.dispatcher.close)
+        self.outputs = [Output(self.lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(1, 5)]
+        self.levels: List[Any] = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def handler(self, obj: Any, context: Any, event: Any, params: Any) -> None:
+        self.release.wait(5)
+        self.levels.append((obj.id, params['level']))
+
+
+class TestInlineDispatcher(DispatcherTestBase):
+    def test_default_is_inline(self) -> None:
+        self.assertIsInstance(Lutron('localhost', 'user', 'pass').dispatcher, InlineDispatcher)
+
+    def test_stats_and_errors(self) -> None:
+        self.make(None)
+        output = self.outputs[0]
+        output.subscribe(self.handler, None)
+        self.lutron._recv('~OUTPUT,1,1,10.00')
+        self.assertEqual(self.levels, [(1, 10.0)])
+
+        stats = self.lutron.dispatcher.stats
+        self.assertEqual((stats.dispatched, stats.delivered), (1, 1))
+        self.assertEqual(stats.handlers[self.handler].calls, 1)
+
+        failing = MagicMock(side_effect=ValueError)
+        output.subscribe(failing, None)
+        with self.assertRaises(ValueError):
+            self.lutron._recv('~OUTPUT,1,1,20.00')
+        self.assertEqual(stats.handlers[failing].errors, 1)
+
+
+class TestThreadPoolDispatcher(DispatcherTestBase):
+    def test_slow_handler_does_not_stall_reader(self) -> None:
+        self.make(ThreadPoolDispatcher(workers=2))
+        for output in self.outputs:
+            output.subscribe(self.handler, None)
+        self.release.clear()
+        start = time.perf_counter()
+        for level in range(1, 4):
+            for output in self.outputs:
+                self.lutron._recv('~OUTPUT,%d,1,%d.00' % (output.id, level))
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.release.set()
+        self.assertTrue(self.dispatcher.wait_idle(5))
+
+        for output in self.outputs:
+            self.assertEqual([l for i, l in self.levels if i == output.id], [1.0, 2.0, 3.0])
+        stats = self.lutron.dispatcher.stats
+        self.assertEqual(stats.delivered, 12)
+        self.assertEqual(stats.handlers[self.handler].calls, 12)
+        self.assertGreater(stats.max_wait, 0)
+
+    def test_drop_oldest(self) -> None:
+        self.make(ThreadPoolDispatcher(workers=1, maxsize=2))
+        self.outputs[0].subscribe(self.handler, None)
+        self.release.clear()
+        self.lutron._recv('~OUTPUT,1,1,1.00')
+        # Wait for the worker to pick up (and block in) the first event.
+        deadline = time.time() + 5
+        while self.lutron.dispatcher.stats.delivered == 0 and time.time() < deadline:
+            time.sleep(0.001)
+        for level in range(2, 6):
+            self.lutron._recv('~OUTPUT,1,1,%d.00' % level)
+        self.release.set()
+        self.assertTrue(self.dispatcher.wait_idle(5))
+        self.assertEqual(self.levels, [(1, 1.0), (1, 4.0), (1, 5.0)])
+        self.assertEqual(self.lutron.dispatcher.stats.dropped, 2)
+        self.assertEqual(self.lutron.dispatcher.stats.max_depth, 2)
+
+    def test_coalesce(self) -> None:
+        self.make(ThreadPoolDispatcher(workers=1, maxsize=10, overflow=OverflowPolicy.COALESCE))
+        self.outputs[0].subscribe(self.handler, None)
+        self.outputs[1].subscribe(self.handler, None)
+        self.release.clear()
+        self.lutron._recv('~OUTPUT,1,1,1.00')
+        deadline = time.time() + 5
+        while self.lutron.dispatcher.stats.delivered == 0 and time.time() < deadline:
+            time.sleep(0.001)
+        for level in range(2, 6):
+            self.lutron._recv('~OUTPUT,1,1,%d.00' % level)
+            self.lutron._recv('~OUTPUT,2,1,%d.00' % level)
+        self.release.set()
+        self.assertTrue(self.dispatcher.wait_idle(5))
+        self.assertEqual(self.levels, [(1, 1.0), (1, 5.0), (2, 5.0)])
+        self.assertEqual(self.lutron.dispatcher.stats.coalesced, 6)
+        self.assertEqual(self.lutron.dispatcher.stats.dropped, 0)
+
+    def test_block(self) -> None:
+        self.make(ThreadPoolDispatcher(workers=1, maxsize=1, overflow=OverflowPolicy.BLOCK))
+        self.outputs[0].subscribe(self.handler, None)
+        self.release.clear()
+        def read() -> None:
+            for level in range(1, 5):
+                self.lutron._recv('~OUTPUT,1,1,%d.00' % level)
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(0.1)
+        self.assertTrue(reader.is_alive())
+        self.release.set()
+        reader.join(5)
+        self.assertTrue(self.dispatcher.wait_idle(5))
+        self.assertEqual(self.levels, [(1, 1.0), (1, 2.0), (1, 3.0), (1, 4.0)])
+        self.assertGreater(self.lutron.dispatcher.stats.blocked, 0)
+        self.assertEqual(self.lutron.dispatcher.stats.dropped, 0)
+
+    def test_handler_errors_are_logged(self) -> None:
+        self.make(ThreadPoolDispatcher(workers=1))
+        failing = MagicMock(side_effect=ValueError)
+        self.outputs[0].subscribe(failing, None)
+        self.outputs[0].subscribe(self.handler, None)
+        with self.assertLogs('pylutron', 'ERROR'):
+            self.lutron._recv('~OUTPUT,1,1,1.00')
+            self.assertTrue(self.dispatcher.wait_idle(5))
+        self.assertEqual(self.levels, [(1, 1.0)])
+        self.assertEqual(self.lutron.dispatcher.stats.handlers[failing].errors, 1)
+
+    def test_close_stops_workers_and_restarts(self) -> None:
+        self.make(ThreadPoolDispatcher(workers=2))
+        self.outputs[0].subscribe(self.handler, None)
+        self.lutron._recv('~OUTPUT,1,1,1.00')
+        threads = list(self.dispatcher._threads)
+        self.lutron.dispatcher.close()
+        for thread in threads:
+            self.assertFalse(thread.is_alive())
+        self.lutron._recv('~OUTPUT,1,1,2.00')
+        self.assertTrue(self.dispatcher.wait_idle(5))
+        self.assertEqual(self.levels[-1], (1, 2.0))
+
+
+class TestLoopDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def test_handlers_run_on_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        lutron = Lutron('localhost', 'user', 'pass', dispatcher=LoopDispatcher(loop))
+        lutron._conn = MagicMock()
+        output = Output(lutron, "Light", 100, "DIMMER", 1, "1")
+        calls: List[Any] = []
+        output.subscribe(lambda obj, ctx, ev, params: calls.append(
+            (params['level'], threading.current_thread())), None)
+
+        lutron._recv('~OUTPUT,1,1,10.00')
+        self.assertEqual(calls, [])
+        await asyncio.sleep(0)
+        self.assertEqual(calls, [(10.0, threading.current_thread())])
+
+        reader = threading.Thread(target=lutron._recv, args=('~OUTPUT,1,1,20.00',))
+        reader.start()
+        reader.join()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertEqual(calls[-1], (20.0, threading.current_thread()))
+        self.assertEqual(lutron.dispatcher.stats.delivered, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
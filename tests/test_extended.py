@@ -94,23 +94,27 @@ class TestExtendedCoverage(unittest.TestCase):
         btn = pico.buttons[0]
         self.assertEqual(btn.name, "Dimmer Raise")
 
-    def test_request_helper_logic(self) -> None:
-        """Coverage for _RequestHelper concurrency logic"""
-        from pylutron import _RequestHelper
-        helper = _RequestHelper()
-        action = MagicMock()
-        
-        # Request 1
-        ev1 = helper.request(action)
-        # Request 2 (should not trigger action again)
-        ev2 = helper.request(action)
-        
-        self.assertEqual(action.call_count, 1)
-        self.assertFalse(ev1.is_set())
-        
-        helper.notify()
+    def test_identical_queries_share_one_request(self) -> None:
+        """Coverage for the query correlator's sharing of outstanding queries"""
+        import threading
+        ev1 = threading.Event()
+        ev2 = threading.Event()
+        send = cast(MagicMock, self.lutron._conn.send)
+
+        pending = self.lutron._attach_query('OUTPUT', 10, (1,), ev1)
+        # Query 2 (should not send the query again)
+        self.lutron._attach_query('OUTPUT', 10, (1,), ev2)
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(send.call_args[0][0], '?OUTPUT,10,1')
+
+        # The connection reports the query as written, then the reply arrives.
+        send.call_args[0][1]()
+        self.lutron._recv('~OUTPUT,10,1,25.00')
         self.assertTrue(ev1.is_set())
         self.assertTrue(ev2.is_set())
+        assert pending.reply is not None
+        self.assertEqual(pending.reply.fields, ['1', '25.00'])
+        self.assertEqual(self.lutron.query_stats.shared, 1)
 
     def test_shade_commands(self) -> None:
         from pylutron import Shade
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import unittest
+from pylutron import Area, Button, Keypad, Led, Lutron, OccupancyGroup, Output
+from pylutron.hub import LutronHub
+from typing import Any, List
+
+from fake_controller import FakeController
+
+
+class TestLutronHub(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.hub = LutronHub()
+        self.ctrls = [FakeController() for _ in range(3)]
+        self.outputs: List[Output] = []
+        for i, ctrl in enumerate(self.ctrls):
+            lutron = self.hub.add('10.0.0.%d' % i, 'user', 'pass', connection_factory=ctrl.factory)
+            lutron.set_guid('guid-%d' % i)
+            # Every controller uses the same integration ids.
+            self.outputs.append(Output(lutron, "Light", 100, "DIMMER", 1, "101"))
+        self.addAsyncCleanup(self.hub.close)
+
+    async def test_connects_on_one_loop(self) -> None:
+        threads = threading.active_count()
+        self.assertEqual(await self.hub.connect(), [])
+        self.assertEqual(threading.active_count(), threads)
+        self.assertTrue(all(h.connected and h.error is None for h in self.hub.health()))
+
+    async def test_failed_controller_does_not_stop_the_others(self) -> None:
+        self.ctrls[1].reader.readuntil_pattern.return_value = b'login: '
+        with self.assertLogs('pylutron.hub', 'WARNING'):
+            failed = await self.hub.connect()
+        self.assertEqual(failed, [self.hub.controllers[1]])
+        health = self.hub.health()
+        self.assertEqual([h.connected for h in health], [True, False, True])
+        self.assertIn("Incorrect username or password", health[1].error or '')
+
+    async def test_namespace(self) -> None:
+        for i, output in enumerate(self.outputs):
+            self.assertEqual(self.hub.key(output), ('guid-%d' % i, 'OUTPUT', 1, 0))
+            self.assertIs(self.hub.entity(('guid-%d' % i, 'OUTPUT', 1, 0)), output)
+        self.assertIsNone(self.hub.entity(('guid-9', 'OUTPUT', 1, 0)))
+        self.assertIsNone(self.hub.entity(('guid-0', 'OUTPUT', 2, 0)))
+
+        # Entities sharing an integration id get distinct keys.
+        lutron = self.hub.controllers[0]
+        group = OccupancyGroup(lutron, "1", "102")
+        area = Area(lutron, "Room", 1, group)
+        lutron._areas = [area]
+        keypad = Keypad(lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 1, "50")
+        button = Button(lutron, keypad, "On", 1, "Toggle", None, "51")
+        led = Led(lutron, keypad, "LED 1", 1, 81, "52")
+        keypad.add_button(button)
+        keypad.add_led(led)
+        entities = [self.outputs[0], group, keypad, button, led, area.summary, lutron.summary]
+        keys = [self.hub.key(entity) for entity in entities]
+        self.assertEqual(keys, [('guid-0', 'OUTPUT', 1, 0), ('guid-0', 'GROUP', 1, 0),
+                                ('guid-0', 'DEVICE', 1, 0), ('guid-0', 'DEVICE', 1, 1),
+                                ('guid-0', 'DEVICE', 1, 81), ('guid-0', 'AREA', 1, 0),
+                                ('guid-0', 'AREA', 0, 0)])
+        for key, entity in zip(keys, entities):
+            self.assertIs(self.hub.entity(key), entity)
+
+    async def test_aggregated_events_and_health(self) -> None:
+        await self.hub.connect()
+        stream = self.hub.events()
+        received: List[Any] = []
+
+        async def consume() -> None:
+            async for entity, event, params in stream:
+                received.append((self.hub.key(entity), params['level']))
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        self.ctrls[2].feed(b'~OUTPUT,1,1,20.00\r\n')
+        self.ctrls[0].feed(b'~OUTPUT,1,1,10.00\r\n')
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertCountEqual(received, [(('guid-0', 'OUTPUT', 1, 0), 10.0), (('guid-2', 'OUTPUT', 1, 0), 20.0)])
+
+        # Controllers added while streaming feed the stream too.
+        ctrl = FakeController()
+        lutron = self.hub.add('10.0.0.9', 'user', 'pass', connection_factory=ctrl.factory)
+        lutron.set_guid('guid-9')
+        Output(lutron, "Lamp", 60, "INC", 1, "901")
+        await lutron.async_connect()
+        ctrl.feed(b'~OUTPUT,1,1,90.00\r\n')
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertIn((('guid-9', 'OUTPUT', 1, 0), 90.0), received)
+
+        consumer.cancel()
+        await asyncio.gather(consumer, return_exceptions=True)
+        await stream.aclose()
+        self.assertTrue(all(lutron._event_queues == [] for lutron in self.hub.controllers))
+
+        health = self.hub.health()
+        self.assertEqual([h.lines_received for h in health], [1, 0, 1, 1])
+        self.assertIsNone(health[1].idle)
+        self.assertGreaterEqual(health[0].idle or 0, 0)
+        self.assertEqual(health[0].guid, 'guid-0')
+        self.assertEqual(health[0].host, '10.0.0.0')
+
+    async def test_query_latency(self) -> None:
+        await self.hub.connect()
+        self.ctrls[0].replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,42.00'
+        self.assertEqual(await self.outputs[0].async_level(), 42.0)
+        self.assertEqual(await self.outputs[1].async_level(timeout=0.01), 0.0)
+        health = self.hub.health()
+        self.assertEqual((health[0].replies, health[0].timeouts), (1, 0))
+        self.assertEqual((health[1].replies, health[1].timeouts), (0, 1))
+        self.assertGreaterEqual(health[0].max_rtt, health[0].average_rtt)
+
+    def test_rejects_threaded_lutron(self) -> None:
+        with self.assertRaises(ValueError):
+            self.hub.add_controller(Lutron('localhost', 'user', 'pass'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 from unittest.mock import MagicMock
 from pylutron import Lutron, Keypad, Led
 
-from typing import cast
+from typing import Callable, cast
 
 class TestLed(unittest.TestCase):
     def setUp(self) -> None:
@@ -20,9 +20,17 @@ class TestLed(unittest.TestCase):
         self.assertEqual(self.led.last_state, Led.LED_OFF)
 
     def test_query_state(self) -> None:
-        # Verify that the LED state query sends the correct command to the controller
-        self.led._do_query_state()
-        cast(MagicMock, self.lutron._conn.send).assert_called_with('?DEVICE,100,81,9')
+        # Reading the state queries it through the correlator, which hands
+        # the command to the connection and completes on the reply.
+        Lutron.register_id(self.lutron, 'DEVICE', self.keypad)
+        def send(cmd: str, on_written: Callable[[], None]) -> None:
+            on_written()
+            self.lutron._recv('~DEVICE,100,81,9,1')
+        send_mock = cast(MagicMock, self.lutron._conn.send)
+        send_mock.side_effect = send
+        self.assertEqual(self.led.state, Led.LED_ON)
+        self.assertEqual(send_mock.call_args[0][0], '?DEVICE,100,81,9')
+        self.assertEqual(self.lutron.query_stats.replies, 1)
 
     def test_set_state(self) -> None:
         # Verify turning LED On
@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+from pylutron import AsyncLutron, Lutron, Output, Keypad, Button
+from typing import List
+
+from fake_controller import FakeControllers
+from test_db_cache import MOTORS_XML
+
+
+class TestRequiredMonitoring(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron.load_xml_db(cache_path=MOTORS_XML)
+
+    def test_from_registered_entities(self) -> None:
+        self.assertEqual(self.lutron.required_monitoring(), (3, 4, 5, 6))
+        lutron = Lutron('localhost', 'user', 'pass')
+        self.assertEqual(lutron.required_monitoring(), ())
+        Output(lutron, "Lamp", 60, "INC", 5, "50")
+        self.assertEqual(lutron.required_monitoring(), (5,))
+
+    def test_subscribed_only(self) -> None:
+        self.assertEqual(self.lutron.required_monitoring(subscribed_only=True), ())
+        output = self.lutron.registry.by_type(Output)[0]
+        output.subscribe(lambda *args: None, None)
+        self.assertEqual(self.lutron.required_monitoring(subscribed_only=True), (5,))
+
+
+class TestSetMonitoring(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrls = FakeControllers(4)
+        self.lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrls.factory,
+                                  sessions=2)
+        await self.lutron.async_connect()
+        self.addAsyncCleanup(self.lutron.async_close)
+
+    def monitoring(self, index: int) -> List[bytes]:
+        return [c for c in self.ctrls.ctrls[index].written if c.startswith(b'#MONITORING')]
+
+    async def test_default_set_at_login(self) -> None:
+        self.assertEqual(self.monitoring(0)[2:], [b'#MONITORING,%d,1\r\n' % t for t in (3, 4, 5, 6, 8)])
+
+    async def test_switches_live_session_and_later_logins(self) -> None:
+        Output(self.lutron, "Lamp", 60, "INC", 5, "50")
+        ctrl = self.ctrls.ctrls[0]
+        ctrl.written.clear()
+        self.assertEqual(self.lutron.update_monitoring(), (5,))
+        await asyncio.sleep(0)
+        self.assertEqual(self.monitoring(0), [b'#MONITORING,3,2\r\n', b'#MONITORING,4,2\r\n',
+                                              b'#MONITORING,6,2\r\n', b'#MONITORING,8,2\r\n'])
+        self.assertEqual(self.monitoring(1)[2:], [])
+
+        self.lutron.set_monitoring((5, 6))
+        await asyncio.sleep(0)
+        self.assertEqual(self.monitoring(0)[-1], b'#MONITORING,6,1\r\n')
+
+        # The next login (on a fresh fake session) uses the new set.
+        ctrl.feed(b'')
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if self.lutron._conn.reconnects:
+                break
+        self.assertEqual(self.monitoring(2)[2:], [b'#MONITORING,5,1\r\n', b'#MONITORING,6,1\r\n'])
+
+
+class TestRecvStats(unittest.TestCase):
+    def test_counts_per_command_type(self) -> None:
+        for bytes_pipeline in (False, True):
+            with self.subTest(bytes_pipeline=bytes_pipeline):
+                lutron = Lutron('localhost', 'user', 'pass', bytes_pipeline=bytes_pipeline)
+                lutron._conn = MagicMock()
+                Output(lutron, "Lamp", 60, "INC", 5, "50")
+                keypad = Keypad(lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 6, "60")
+                keypad.add_button(Button(lutron, keypad, "On", 1, "Toggle", None, "61"))
+                lines = ['~OUTPUT,5,1,10.00', '~OUTPUT,5,1,20.00', '~OUTPUT,7,1,10.00',
+                         '~DEVICE,6,1,3', '~SYSTEM,1,12:00:00', 'GNET>']
+                for line in lines:
+                    if bytes_pipeline:
+                        lutron._recv_bytes(line.encode('ascii') + b'\r\n')
+                    else:
+                        lutron._recv(line)
+                stats = lutron.recv_stats
+                self.assertEqual(stats.received, {'~OUTPUT': 3, '~DEVICE': 1, '~SYSTEM': 1, 'GNET>': 1})
+                self.assertEqual(stats.dispatched, {'~OUTPUT': 2, '~DEVICE': 1})
+                self.assertEqual(stats.ignored, {'~OUTPUT': 1, '~SYSTEM': 1, 'GNET>': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,13 +29,15 @@ class TestOccupancy(unittest.TestCase):
     def test_motion_sensor_battery(self) -> None:
         sensor = MotionSensor(self.lutron, "Sensor 1", 500, "701")
         
-        # MotionSensor battery query
-        sensor._do_query_battery()
-        
+        # The battery status is queried through the correlator
+        self.lutron.query_timeout = 0.0
+        sensor.battery_status
+
         # Verify that the query command is sent correctly
         self.assertEqual(cast(MagicMock, self.lutron._conn.send).call_count, 1)
         args = cast(MagicMock, self.lutron._conn.send).call_args[0][0]
         self.assertTrue(args.startswith('?DEVICE,500'))
+        self.assertEqual(self.lutron.query_stats.timeouts, 1)
 
     def test_occupancy_event(self) -> None:
         occ_group = OccupancyGroup(self.lutron, "100", "700")
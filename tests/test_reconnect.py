@@ -0,0 +1,315 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from pylutron import AsyncLutron, AsyncLutronConnection, Lutron, LutronConnection, Output, RttHistogram
+from typing import Any, List
+
+from fake_controller import FakeController
+
+
+class TestBackoff(unittest.TestCase):
+    def make(self) -> AsyncLutronConnection:
+        return AsyncLutronConnection('127.0.0.1', 'user', 'pass', MagicMock(),
+                                     reconnect_delay=1.0, max_reconnect_delay=8.0)
+
+    def test_first_failure_reconnects_at_once(self) -> None:
+        conn = self.make()
+        self.assertEqual(conn._reconnect_backoff(0), 0.0)
+        # A second drop soon after backs off instead of hammering the controller.
+        self.assertGreater(conn._reconnect_backoff(0), 0.0)
+
+    def test_exponential_with_jitter(self) -> None:
+        conn = self.make()
+        conn._reconnect_backoff(0)
+        for failures, cap in ((1, 2.0), (2, 4.0), (3, 8.0), (4, 8.0), (10, 8.0)):
+            delays = [conn._reconnect_backoff(failures) for _ in range(50)]
+            self.assertTrue(all(cap / 2 <= d <= cap for d in delays), (failures, delays))
+            self.assertGreater(len(set(delays)), 1)
+
+
+class TestReconnect(unittest.IsolatedAsyncioTestCase):
+    async def test_refused_reconnects_are_retried(self) -> None:
+        ctrl = FakeController()
+        refused = 3
+        calls = 0
+
+        async def factory(*args: Any, **kwargs: Any) -> Any:
+            nonlocal calls
+            calls += 1
+            if 1 < calls <= 1 + refused:
+                raise ConnectionRefusedError()
+            return await ctrl.factory(*args, **kwargs)
+
+        conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', MagicMock(), connection_factory=factory,
+                                     reconnect_delay=0.01, max_reconnect_delay=0.04)
+        await conn.connect()
+        self.addAsyncCleanup(conn.close)
+        with self.assertLogs('pylutron', 'ERROR'):
+            ctrl.feed(b'')
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if conn.connected:
+                    break
+        self.assertTrue(conn.connected)
+        self.assertEqual(calls, 2 + refused)
+        self.assertEqual(conn.reconnects, 1)
+
+
+class TestHeartbeat(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+        self.received: List[str] = []
+        self.conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', self.received.append,
+                                          connection_factory=self.ctrl.factory,
+                                          heartbeat_interval=0.02, heartbeat_timeout=0.05)
+        await self.conn.connect()
+        self.addAsyncCleanup(self.conn.close)
+
+    async def test_idle_session_is_probed(self) -> None:
+        self.ctrl.replies[b'?SYSTEM,1'] = b'~SYSTEM,1,12:00:00'
+        await asyncio.sleep(0.1)
+        stats = self.conn.heartbeat_stats
+        self.assertGreater(stats.probes, 1)
+        self.assertEqual(stats.replies, stats.probes)
+        self.assertEqual(len(stats.rtt), stats.replies)
+        self.assertEqual(stats.failures, 0)
+        self.assertEqual(self.conn.reconnects, 0)
+        # Heartbeat replies are handed on, as they may answer a query too.
+        self.assertEqual(self.received, ['~SYSTEM,1,12:00:00'] * stats.replies)
+
+    async def test_reply_matched_to_its_probe(self) -> None:
+        ctrl = FakeController()
+        conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', self.received.append,
+                                     connection_factory=ctrl.factory,
+                                     heartbeat_interval=10.0, heartbeat_timeout=10.0)
+        await conn.connect()
+        self.addAsyncCleanup(conn.close)
+        conn._send_heartbeat()
+        await asyncio.sleep(0.05)
+        # The first probe is answered after a second one went out.
+        conn._send_heartbeat()
+        ctrl.feed(b'~SYSTEM,1,12:00:00\r\n')
+        ctrl.feed(b'~SYSTEM,1,12:00:01\r\n')
+        await asyncio.sleep(0.01)
+        rtt = conn.heartbeat_stats.rtt
+        self.assertEqual(len(rtt), 2)
+        self.assertGreaterEqual(rtt.percentile(100) or 0, 0.05)
+        self.assertLess(rtt.percentile(0) or 1, 0.05)
+
+    async def test_reply_reaches_lutron_while_probing(self) -> None:
+        ctrl = FakeController()
+        lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=ctrl.factory,
+                             heartbeat_interval=10.0, heartbeat_timeout=10.0)
+        await lutron.async_connect()
+        self.addAsyncCleanup(lutron.async_close)
+        # The caller's own ?SYSTEM,1 is answered while a probe is outstanding.
+        lutron._conn._send_heartbeat()
+        lutron.send(Lutron.OP_QUERY, 'SYSTEM', 1)
+        ctrl.feed(b'~SYSTEM,1,12:00:00\r\n')
+        await asyncio.sleep(0.01)
+        self.assertEqual(lutron.recv_stats.received.get('~SYSTEM'), 1)
+        self.assertEqual(lutron._conn.heartbeat_stats.replies, 1)
+
+    async def test_unanswered_probe_reconnects(self) -> None:
+        await asyncio.sleep(0.15)
+        self.assertGreater(self.conn.heartbeat_stats.failures, 0)
+        self.assertGreater(self.conn.reconnects, 0)
+        self.assertEqual(self.conn.heartbeat_stats.replies, 0)
+
+    async def test_probe_skips_command_backlog(self) -> None:
+        ctrl = FakeController()
+        conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', self.received.append,
+                                     connection_factory=ctrl.factory, rate_limit=1.0,
+                                     rate_burst=1, heartbeat_interval=0.02, heartbeat_timeout=0.05)
+        await conn.connect()
+        self.addAsyncCleanup(conn.close)
+        ctrl.replies[b'?SYSTEM,1'] = b'~SYSTEM,1,12:00:00'
+        for i in range(20):
+            conn.write('#DEVICE,5,%d,3' % i)
+        await asyncio.sleep(0.15)
+        # The commands are still waiting for the rate limiter, the probes are not.
+        self.assertGreater(conn.queue_depth, 10)
+        self.assertGreater(conn.heartbeat_stats.replies, 0)
+        self.assertEqual(conn.heartbeat_stats.failures, 0)
+        self.assertEqual(conn.reconnects, 0)
+
+    async def test_traffic_counts_as_alive(self) -> None:
+        for _ in range(10):
+            self.ctrl.feed(b'~OUTPUT,1,1,10.00\r\n')
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.conn.heartbeat_stats.probes, 0)
+        self.assertEqual(self.conn.reconnects, 0)
+
+
+class TestOfflineBuffer(unittest.IsolatedAsyncioTestCase):
+    def make(self, **options: Any) -> AsyncLutronConnection:
+        self.ctrl = FakeController()
+        conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', MagicMock(),
+                                     connection_factory=self.ctrl.factory, **options)
+        self.addAsyncCleanup(conn.close)
+        return conn
+
+    def replayed(self) -> List[bytes]:
+        return [c for c in self.ctrl.written if c.startswith((b'#', b'?')) and not c.startswith(b'#MONITORING')]
+
+    async def test_replayed_in_order_after_login(self) -> None:
+        conn = self.make(offline_buffer=8)
+        conn.write('#OUTPUT,1,1,10.00')
+        conn.write('#DEVICE,5,3,3')
+        conn.write('?OUTPUT,1,1')
+        conn.write('#OUTPUT,1,1,20.00')
+        await conn.connect()
+        await asyncio.sleep(0)
+        # Monitoring is set up first; the newer level replaced the older one.
+        self.assertTrue(self.ctrl.written[-3].startswith(b'#MONITORING'))
+        self.assertEqual(self.replayed(), [b'#DEVICE,5,3,3\r\n', b'#OUTPUT,1,1,20.00\r\n'])
+        stats = conn.writer_stats
+        self.assertEqual((stats.buffered, stats.collapsed, stats.replayed, stats.expired), (3, 1, 2, 0))
+
+    async def test_kept_across_dropped_session(self) -> None:
+        conn = self.make(offline_buffer=8, reconnect_delay=0.05)
+        await conn.connect()
+        self.ctrl.written.clear()
+        conn._last_fast_reconnect = time.monotonic()
+        self.ctrl.feed(b'')
+        await asyncio.sleep(0.005)
+        self.assertFalse(conn.connected)
+        conn.write('#OUTPUT,2,1,30.00')
+        await asyncio.sleep(0.1)
+        self.assertTrue(conn.connected)
+        self.assertEqual(self.replayed(), [b'#OUTPUT,2,1,30.00\r\n'])
+
+    async def test_expired_and_overflowed(self) -> None:
+        conn = self.make(offline_buffer=2, offline_ttl=0.02)
+        for i in range(3):
+            conn.write('#DEVICE,5,%d,3' % i)
+        self.assertEqual(conn.writer_stats.overflowed, 1)
+        await asyncio.sleep(0.03)
+        conn.write('#DEVICE,6,1,3')
+        await conn.connect()
+        await asyncio.sleep(0)
+        self.assertEqual(self.replayed(), [b'#DEVICE,6,1,3\r\n'])
+        self.assertEqual(conn.writer_stats.expired, 2)
+        self.assertEqual(conn.writer_stats.replayed, 1)
+
+    async def test_disabled_by_default(self) -> None:
+        conn = self.make()
+        conn.write('#OUTPUT,1,1,10.00')
+        await conn.connect()
+        await asyncio.sleep(0)
+        self.assertEqual(self.replayed(), [])
+        self.assertEqual(conn.writer_stats.buffered, 0)
+
+
+class TestThreadedOfflineBuffer(unittest.TestCase):
+    def test_kept_when_dropped_during_handoff(self) -> None:
+        ctrl = FakeController()
+        conn = LutronConnection('127.0.0.1', 'user', 'pass', MagicMock(), connection_factory=ctrl.factory,
+                                offline_buffer=8)
+        conn.connect()
+        self.addCleanup(conn.close)
+        ctrl.written.clear()
+        # The session drops after send() handed the command to the loop, but
+        # before the loop queued it.
+        handed_over = threading.Event()
+
+        def drop() -> None:
+            handed_over.wait(1)
+            conn._disconnect()
+
+        conn._loop.call_soon_threadsafe(drop)
+        conn.send('#OUTPUT,2,1,30.00')
+        handed_over.set()
+        for _ in range(100):
+            if conn._offline:
+                break
+            time.sleep(0.005)
+        self.assertEqual(conn.writer_stats.buffered, 1)
+        conn._loop.call_soon_threadsafe(ctrl.feed, b'')
+        for _ in range(100):
+            if b'#OUTPUT,2,1,30.00\r\n' in ctrl.written:
+                break
+            time.sleep(0.005)
+        self.assertIn(b'#OUTPUT,2,1,30.00\r\n', ctrl.written)
+
+
+class TestRttHistogram(unittest.TestCase):
+    def test_rolling_buckets(self) -> None:
+        histogram = RttHistogram(size=4)
+        for rtt in (0.001, 0.02, 0.02, 0.3, 5.0):
+            histogram.add(rtt)
+        self.assertEqual(len(histogram), 4)
+        self.assertEqual(histogram.last, 5.0)
+        counts = dict(histogram.buckets)
+        self.assertEqual(counts[0.005], 0)
+        self.assertEqual(counts[0.025], 2)
+        self.assertEqual(counts[0.5], 1)
+        self.assertEqual(counts[None], 1)
+        self.assertEqual(sum(counts.values()), 4)
+        self.assertEqual(histogram.percentile(50), 0.3)
+        self.assertEqual(histogram.percentile(100), 5.0)
+        self.assertIsNone(RttHistogram().percentile(50))
+
+
+class TestResync(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+        self.lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrl.factory)
+        self.outputs = [Output(self.lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(1, 5)]
+        await self.lutron.async_connect()
+        self.addAsyncCleanup(self.lutron.async_close)
+        for output in self.outputs:
+            self.ctrl.feed(b'~OUTPUT,%d,1,10.00\r\n' % output.id)
+        await asyncio.sleep(0.01)
+
+    async def drop(self) -> None:
+        self.ctrl.written.clear()
+        self.ctrl.feed(b'')
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if self.lutron.last_resync is not None:
+                return
+        self.fail("no resync")
+
+    async def test_resyncs_subscribed_and_recently_read(self) -> None:
+        self.outputs[0].subscribe(lambda *args: None, None)
+        self.ctrl.replies[b'?OUTPUT,2,1'] = b'~OUTPUT,2,1,10.00'
+        await self.outputs[1].async_level()
+        for output in self.outputs:
+            self.ctrl.replies[b'?OUTPUT,%d,1' % output.id] = b'~OUTPUT,%d,1,10.00' % output.id
+
+        await self.drop()
+        self.assertEqual(self.lutron._conn.reconnects, 1)
+        queries = [c for c in self.ctrl.written if c.startswith(b'?')]
+        self.assertCountEqual(queries, [b'?OUTPUT,1,1\r\n', b'?OUTPUT,2,1\r\n'])
+        result = self.lutron.last_resync
+        assert result is not None
+        self.assertCountEqual(result.completed, self.outputs[:2])
+
+    async def test_events_only_for_changed_state(self) -> None:
+        events: List[Any] = []
+        for output in self.outputs:
+            output.subscribe(lambda obj, ctx, ev, params: events.append((obj.id, params['level'])), None)
+            self.ctrl.replies[b'?OUTPUT,%d,1' % output.id] = b'~OUTPUT,%d,1,10.00' % output.id
+        self.ctrl.replies[b'?OUTPUT,3,1'] = b'~OUTPUT,3,1,70.00'
+
+        await self.drop()
+        self.assertEqual(events, [(3, 70.0)])
+        self.assertEqual(self.lutron._resyncing, {})
+        # Once resynced, unchanged updates are dispatched as usual.
+        self.ctrl.feed(b'~OUTPUT,1,1,10.00\r\n')
+        await asyncio.sleep(0.01)
+        self.assertEqual(events[-1], (1, 10.0))
+
+    async def test_stale_reads_are_not_resynced(self) -> None:
+        self.ctrl.replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,10.00'
+        await self.outputs[0].async_level()
+        with patch('pylutron.time.monotonic', return_value=1e12):
+            self.assertEqual(self.lutron._resync_entities(), [])
+        self.assertEqual(self.lutron._recently_read, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
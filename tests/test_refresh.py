@@ -0,0 +1,69 @@
+import unittest
+import asyncio
+from pylutron import AsyncLutron, Lutron, LutronConnectionError, Area, Keypad, Led, MotionSensor, OccupancyGroup, Output
+
+from fake_controller import FakeController
+
+
+class TestRefreshAll(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+        self.lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrl.factory)
+        self.outputs = [Output(self.lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(1, 6)]
+        self.keypad = Keypad(self.lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 20, "700")
+        self.led = Led(self.lutron, self.keypad, "LED 1", 1, 81, "701")
+        self.keypad.add_led(self.led)
+        self.area = Area(self.lutron, "Kitchen", 30, OccupancyGroup(self.lutron, "1", "702"))
+        self.sensor = MotionSensor(self.lutron, "Sensor", 40, "703")
+        await self.lutron.async_connect()
+        self.addAsyncCleanup(self.lutron.async_close)
+
+    async def test_refresh_defaults(self) -> None:
+        for output in self.outputs:
+            self.ctrl.replies[b'?OUTPUT,%d,1' % output.id] = b'~OUTPUT,%d,1,%d.00' % (output.id, output.id * 10)
+        self.ctrl.replies[b'?DEVICE,20,81,9'] = b'~DEVICE,20,81,9,1'
+        self.ctrl.replies[b'?GROUP,30,3'] = b'~GROUP,30,3,3'
+
+        result = await self.lutron.async_refresh_all(timeout=1.0)
+
+        self.assertTrue(result.ok)
+        self.assertEqual(len(result.completed), 7)
+        self.assertNotIn(self.sensor, result.completed)
+        self.assertEqual([o.last_level() for o in self.outputs], [10.0, 20.0, 30.0, 40.0, 50.0])
+        self.assertEqual(self.led.last_state, Led.LED_ON)
+        self.assertEqual(self.area.occupancy_group._state, OccupancyGroup.State.OCCUPIED)
+
+    async def test_refresh_reports_timeouts(self) -> None:
+        for output in self.outputs[:4]:
+            self.ctrl.replies[b'?OUTPUT,%d,1' % output.id] = b'~OUTPUT,%d,1,0.00' % output.id
+
+        result = await self.lutron.async_refresh_all(kinds=[Output], timeout=0.05)
+
+        self.assertFalse(result.ok)
+        self.assertEqual(result.timed_out, [self.outputs[4]])
+        self.assertCountEqual(result.completed, self.outputs[:4])
+
+    async def test_window_limits_in_flight_queries(self) -> None:
+        refresh = asyncio.ensure_future(self.lutron.async_refresh_all(kinds=[Output], window=2, timeout=1.0))
+        await asyncio.sleep(0.01)
+        queries = [w for w in self.ctrl.written if w.startswith(b'?OUTPUT')]
+        self.assertEqual(len(queries), 2)
+
+        for output in self.outputs:
+            self.ctrl.feed(b'~OUTPUT,%d,1,0.00\r\n' % output.id)
+            await asyncio.sleep(0.01)
+        result = await refresh
+        self.assertEqual(len(result.completed), 5)
+        queries = [w for w in self.ctrl.written if w.startswith(b'?OUTPUT')]
+        self.assertEqual(len(queries), 5)
+
+
+class TestSyncRefreshAll(unittest.TestCase):
+    def test_requires_connection(self) -> None:
+        lutron = Lutron('127.0.0.1', 'user', 'pass')
+        with self.assertRaises(LutronConnectionError):
+            lutron.refresh_all()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from pylutron import (Lutron, LutronEntity, Output, Motor, Keypad, Button, Led, MotionSensor, Area,
+                      OccupancyGroup)
+from typing import List
+
+from test_db_cache import MOTORS_XML
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron.load_xml_db(cache_path=MOTORS_XML)
+
+    def walk(self) -> List[LutronEntity]:
+        entities: List[LutronEntity] = []
+        for area in self.lutron.areas:
+            if area.occupancy_group.id:
+                entities.append(area.occupancy_group)
+            entities.extend(area.outputs)
+            for keypad in area.keypads:
+                entities.append(keypad)
+                entities.extend(keypad.buttons)
+                entities.extend(keypad.leds)
+            entities.extend(area.sensors)
+        return entities
+
+    def test_covers_all_entities(self) -> None:
+        registry = self.lutron.registry
+        entities = self.walk()
+        self.assertEqual(list(registry), entities)
+        self.assertEqual(len(registry), len(entities))
+        self.assertIs(self.lutron.registry, registry)
+
+    def test_lookups_match_tree_scan(self) -> None:
+        registry = self.lutron.registry
+        for entity in self.walk():
+            self.assertIs(registry.by_uuid(entity.uuid), entity)
+            if entity.legacy_uuid:
+                self.assertIs(registry.by_legacy_uuid(entity.legacy_uuid), entity)
+            self.assertIn(entity, registry.by_name(entity.name))
+            if isinstance(entity, (Output, Keypad, OccupancyGroup)):
+                self.assertIs(registry.by_id(entity._CMD_TYPE, entity.id), entity)
+            if isinstance(entity, (Button, Led)):
+                self.assertIs(registry.component(entity._keypad.id, entity.component_number), entity)
+
+    def test_by_type(self) -> None:
+        registry = self.lutron.registry
+        outputs = [o for a in self.lutron.areas for o in a.outputs]
+        self.assertEqual(list(registry.by_type(Output)), outputs)
+        self.assertEqual(list(registry.by_type(Motor)), [o for o in outputs if isinstance(o, Motor)])
+        self.assertEqual(len(registry.by_type(Button)), 105)
+        self.assertEqual(list(registry.by_type(MotionSensor)), [s for a in self.lutron.areas for s in a.sensors])
+        self.assertEqual(len(registry.by_type(MotionSensor)), 2)
+
+    def test_by_name_prefix(self) -> None:
+        registry = self.lutron.registry
+        for prefix in ('', 'C', 'Button', 'LED 1', 'zzz'):
+            expected = sorted((e for e in self.walk() if e.name.startswith(prefix)), key=lambda e: e.name)
+            self.assertCountEqual(registry.by_name_prefix(prefix), expected)
+            names = [e.name for e in registry.by_name_prefix(prefix)]
+            self.assertEqual(names, sorted(names))
+
+    def test_misses(self) -> None:
+        registry = self.lutron.registry
+        self.assertIsNone(registry.by_id('OUTPUT', 9999))
+        self.assertIsNone(registry.by_uuid('nope'))
+        self.assertIsNone(registry.by_legacy_uuid('nope'))
+        self.assertIsNone(registry.component(9999, 1))
+        self.assertEqual(registry.by_name('nope'), ())
+
+    def test_rebuilt_after_new_entities(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass')
+        output = Output(lutron, "Lamp", 60, "INC", 5, "50")
+        self.assertIs(lutron.registry.by_id('OUTPUT', 5), output)
+        keypad = Keypad(lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 6, "60")
+        button = Button(lutron, keypad, "On", 1, "Toggle", None, "61")
+        keypad.add_button(button)
+        self.assertIs(lutron.registry.component(6, 1), button)
+        self.assertIs(lutron.registry.by_uuid('61'), button)
+        group = OccupancyGroup(lutron, "7", "70")
+        Area(lutron, "Room", 8, group)
+        self.assertIs(lutron.registry.by_id('GROUP', 8), group)
+
+
+if __name__ == '__main__':
+    unittest.main()
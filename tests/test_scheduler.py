@@ -0,0 +1,105 @@
+import unittest
+import asyncio
+import time
+from pylutron import AsyncLutron, AsyncLutronConnection, Output, SendPriority
+from typing import Any
+
+from fake_controller import FakeController
+
+
+class TestSendScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+
+    async def connect(self, **options: Any) -> AsyncLutronConnection:
+        conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', lambda line: None,
+                                     connection_factory=self.ctrl.factory, **options)
+        await conn.connect()
+        self.addAsyncCleanup(conn.close)
+        self.ctrl.writes.clear()
+        self.ctrl.written.clear()
+        return conn
+
+    async def test_executes_ahead_of_queries(self) -> None:
+        conn = await self.connect()
+        conn.write('?OUTPUT,1,1')
+        conn.write('?OUTPUT,2,1')
+        conn.write('#OUTPUT,3,1,100.00')
+        conn.write('?OUTPUT,4,1', priority=SendPriority.USER)
+        self.assertEqual(conn.queue_depth, 4)
+        await conn.send('#DEVICE,5,1,3')
+
+        self.assertEqual(self.ctrl.written, [
+            b'#OUTPUT,3,1,100.00\r\n', b'?OUTPUT,4,1\r\n', b'#DEVICE,5,1,3\r\n',
+            b'?OUTPUT,1,1\r\n', b'?OUTPUT,2,1\r\n'])
+        self.assertEqual(conn.queue_depth, 0)
+        stats = conn.writer_stats
+        self.assertEqual(stats.written, {SendPriority.USER: 3, SendPriority.BACKGROUND: 2})
+        self.assertEqual(stats.max_depth, 5)
+
+    async def test_newer_level_supersedes_queued_one(self) -> None:
+        conn = await self.connect()
+        conn.write('#OUTPUT,1,1,10.00')
+        conn.write('#OUTPUT,2,1,20.00')
+        conn.write('#OUTPUT,1,1,30.00,2')
+        conn.write('#DEVICE,9,81,9,1')
+        conn.write('#DEVICE,9,81,9,0')
+        conn.write('#DEVICE,9,1,3')
+        conn.write('#DEVICE,9,1,3')
+        conn.write('#OUTPUT,1,2')
+        await conn.send('#OUTPUT,1,2')
+
+        self.assertEqual(self.ctrl.written, [
+            b'#OUTPUT,2,1,20.00\r\n', b'#OUTPUT,1,1,30.00,2\r\n', b'#DEVICE,9,81,9,0\r\n',
+            b'#DEVICE,9,1,3\r\n', b'#DEVICE,9,1,3\r\n', b'#OUTPUT,1,2\r\n', b'#OUTPUT,1,2\r\n'])
+        self.assertEqual(conn.writer_stats.superseded, 2)
+
+        # Once written, a level no longer supersedes anything.
+        await conn.send('#OUTPUT,1,1,40.00')
+        self.assertEqual(self.ctrl.written[-1], b'#OUTPUT,1,1,40.00\r\n')
+        self.assertEqual(conn.writer_stats.superseded, 2)
+
+    async def test_superseded_command_keeps_callbacks(self) -> None:
+        conn = await self.connect()
+        written = []
+        conn.write('#OUTPUT,1,1,10.00', on_written=lambda: written.append(1))
+        conn.write('#OUTPUT,1,1,20.00', on_written=lambda: written.append(2))
+        await conn.send('?OUTPUT,1,1')
+        self.assertEqual(written, [1, 2])
+        self.assertEqual(self.ctrl.written[0], b'#OUTPUT,1,1,20.00\r\n')
+
+    async def test_rate_limit(self) -> None:
+        conn = await self.connect(rate_limit=200, rate_burst=5)
+        start = time.monotonic()
+        for i in range(14):
+            conn.write('#OUTPUT,%d,1,0' % i)
+        await conn.send('#OUTPUT,99,1,0')
+        elapsed = time.monotonic() - start
+
+        # The burst goes out at once, the other 10 at 200 per second.
+        self.assertGreaterEqual(elapsed, 0.04)
+        self.assertEqual(len(self.ctrl.written), 15)
+        self.assertEqual(len(self.ctrl.writes[0].split(b'\r\n')) - 1, 5)
+        self.assertTrue(all(len(w.split(b'\r\n')) - 1 <= 5 for w in self.ctrl.writes))
+        stats = conn.writer_stats
+        self.assertGreater(stats.throttled, 0)
+        self.assertGreater(stats.max_wait[SendPriority.USER], 0.03)
+        self.assertGreater(stats.average_wait(SendPriority.USER), 0)
+        self.assertEqual(stats.average_wait(SendPriority.BACKGROUND), 0)
+
+    async def test_lutron_options(self) -> None:
+        lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrl.factory,
+                             rate_limit=50, rate_burst=2)
+        outputs = [Output(lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(1, 4)]
+        await lutron.async_connect()
+        self.addAsyncCleanup(lutron.async_close)
+        for output in outputs:
+            output.set_level(50.0)
+        outputs[0].set_level(75.0)
+        await asyncio.sleep(0.1)
+        self.assertEqual(lutron.writer_stats.superseded, 1)
+        self.assertEqual(lutron.writer_stats.commands, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
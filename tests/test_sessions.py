@@ -0,0 +1,163 @@
+import asyncio
+import time
+import unittest
+from pylutron import AsyncLutron, AsyncLutronConnection, Lutron, LutronConnection, Output
+from typing import Any, Callable, List, Tuple, cast
+
+from fake_controller import FakeControllers
+
+
+class TestSessions(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrls = FakeControllers(3)
+        self.lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrls.factory,
+                                  sessions=3)
+        self.outputs = [Output(self.lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(1, 9)]
+        await self.lutron.async_connect()
+        self.addAsyncCleanup(self.lutron.async_close)
+        for ctrl in self.ctrls.ctrls:
+            ctrl.written.clear()
+
+    def commands(self, index: int) -> List[bytes]:
+        return self.ctrls.ctrls[index].written
+
+    async def test_only_first_session_monitors(self) -> None:
+        lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=FakeControllers(2).factory,
+                             sessions=2)
+        self.assertEqual([s.monitoring for s in lutron.sessions], [True, False])
+        self.assertEqual(self.ctrls.opened, 3)
+
+    async def test_commands_spread_over_command_sessions(self) -> None:
+        for level in (10.0, 20.0, 30.0):
+            for output in self.outputs:
+                output.set_level(level)
+                output.flash()
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(self.commands(0), [])
+        self.assertTrue(self.commands(1))
+        self.assertTrue(self.commands(2))
+        for output in self.outputs:
+            prefix = b'#OUTPUT,%d,' % output.id
+            sent = [[c for c in self.commands(i) if c.startswith(prefix)] for i in (1, 2)]
+            # Everything for one output went to one session, in order.
+            self.assertEqual(sorted(len(s) for s in sent), [0, 6])
+            self.assertEqual(max(sent), [prefix + b'1,10.00\r\n', prefix + b'5\r\n',
+                                         prefix + b'1,20.00\r\n', prefix + b'5\r\n',
+                                         prefix + b'1,30.00\r\n', prefix + b'5\r\n'])
+
+    async def test_reply_on_command_session(self) -> None:
+        for ctrl in self.ctrls.ctrls[1:]:
+            ctrl.replies[b'?OUTPUT,3,1'] = b'~OUTPUT,3,1,33.00'
+        self.assertEqual(await self.outputs[2].async_level(), 33.0)
+        self.assertEqual(self.commands(0), [])
+
+    async def test_closed_session_falls_back_to_monitoring_session(self) -> None:
+        for conn in self.lutron.sessions[1:]:
+            await cast(AsyncLutronConnection, conn).close()
+        self.outputs[0].set_level(50.0)
+        await asyncio.sleep(0)
+        self.assertEqual(self.commands(0), [b'#OUTPUT,1,1,50.00\r\n'])
+
+
+class TestDroppedSession(unittest.IsolatedAsyncioTestCase):
+    async def connect(self, **options: Any) -> None:
+        self.ctrls = FakeControllers(3)
+        self.lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrls.factory,
+                                  sessions=2, reconnect_delay=0.05, **options)
+        self.output = Output(self.lutron, "Light", 100, "DIMMER", 1, "101")
+        await self.lutron.async_connect()
+        self.addAsyncCleanup(self.lutron.async_close)
+        for ctrl in self.ctrls.ctrls:
+            ctrl.written.clear()
+
+    def drop(self) -> None:
+        conn = cast(AsyncLutronConnection, self.lutron.sessions[1])
+        conn._last_fast_reconnect = time.monotonic()
+        self.ctrls.ctrls[1].feed(b'')
+
+    def commands(self, index: int) -> List[bytes]:
+        return [c for c in self.ctrls.ctrls[index].written if c.startswith(b'#OUTPUT')]
+
+    async def test_held_until_session_is_back(self) -> None:
+        await self.connect(offline_buffer=8)
+        self.drop()
+        await asyncio.sleep(0.005)
+        self.assertFalse(self.lutron.sessions[1].connected)
+        self.output.set_level(20.0)
+        self.output.flash()
+        await asyncio.sleep(0.1)
+        self.assertTrue(self.lutron.sessions[1].connected)
+        self.assertEqual(self.commands(0), [])
+        self.assertEqual(self.commands(2), [b'#OUTPUT,1,1,20.00\r\n', b'#OUTPUT,1,5\r\n'])
+
+    async def test_stays_on_monitoring_session_until_it_drained(self) -> None:
+        await self.connect(rate_limit=20.0, rate_burst=1)
+        others = [Output(self.lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(2, 5)]
+        self.drop()
+        await asyncio.sleep(0.005)
+        for output in [self.output] + others:
+            output.set_level(10.0)
+        await asyncio.sleep(0.1)
+        # The session is back but older commands are still queued on the
+        # monitoring session, so newer ones must not overtake them.
+        self.assertTrue(self.lutron.sessions[1].connected)
+        self.assertTrue(self.lutron.sessions[0].queue_depth)
+        self.output.flash()
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.commands(0), [b'#OUTPUT,%d,1,10.00\r\n' % i for i in range(1, 5)] +
+                         [b'#OUTPUT,1,5\r\n'])
+        self.assertEqual(self.commands(2), [])
+        self.output.set_level(20.0)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.commands(2), [b'#OUTPUT,1,1,20.00\r\n'])
+
+class TestThreadedSessions(unittest.TestCase):
+    def wait_for(self, condition: Callable[[], bool]) -> None:
+        for _ in range(200):
+            if condition():
+                return
+            time.sleep(0.005)
+        self.fail("timed out")
+
+    def test_diverted_until_handed_over_commands_are_written(self) -> None:
+        ctrls = FakeControllers(3)
+        lutron = Lutron('127.0.0.1', 'user', 'pass', connection_factory=ctrls.factory, sessions=2,
+                        reconnect_delay=0.05)
+        output = Output(lutron, "Light", 100, "DIMMER", 1, "101")
+        lutron.connect()
+        self.addCleanup(lutron.close)
+        monitoring, session = cast(Tuple[LutronConnection, LutronConnection], lutron.sessions)
+        session._last_fast_reconnect = time.monotonic()
+        session._loop.call_soon_threadsafe(ctrls.ctrls[1].feed, b'')
+        self.wait_for(lambda: not session.connected)
+
+        # Keep the monitoring session's loop busy, so the command is handed
+        # over but not queued yet when the other session is back.
+        monitoring._loop.call_soon_threadsafe(time.sleep, 0.3)
+        output.set_level(10.0)
+        self.assertEqual(monitoring.queue_depth, 1)
+        self.wait_for(lambda: session.connected)
+        output.flash()
+
+        def commands(index: int) -> List[bytes]:
+            return [c for c in ctrls.ctrls[index].written if c.startswith(b'#OUTPUT')]
+
+        self.wait_for(lambda: len(commands(0)) == 2)
+        self.assertEqual(commands(0), [b'#OUTPUT,1,1,10.00\r\n', b'#OUTPUT,1,5\r\n'])
+        self.assertEqual(commands(2), [])
+
+    def test_failed_command_session_is_not_fatal(self) -> None:
+        ctrls = FakeControllers(2)
+        ctrls.ctrls[1].reader.readuntil_pattern.return_value = b'login: '
+        lutron = Lutron('127.0.0.1', 'user', 'pass', connection_factory=ctrls.factory, sessions=2)
+        output = Output(lutron, "Light", 100, "DIMMER", 1, "101")
+        with self.assertLogs('pylutron', 'WARNING'):
+            lutron.connect()
+        self.addCleanup(lutron.close)
+        ctrls.ctrls[0].replies[b'?OUTPUT,1,1'] = b'~OUTPUT,1,1,42.00'
+        self.assertEqual(output.level, 42.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
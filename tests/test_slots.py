@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import MagicMock
+from pylutron import (Lutron, Output, Shade, Motor, Keypad, Button, Led, MotionSensor,
+                      OccupancyGroup, AreaSummary)
+
+
+class TestCompactEntities(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron._conn = MagicMock()
+
+    def test_no_instance_dict(self) -> None:
+        keypad = Keypad(self.lutron, "Keypad", "SEETOUCH_KEYPAD", "Hall", 10, "100")
+        entities = [
+            Output(self.lutron, "Light", 100, "DIMMER", 1, "101"),
+            Shade(self.lutron, "Shade", 0, "SYSTEM_SHADE", 2, "102"),
+            Motor(self.lutron, "Motor", 0, "MOTOR", 3, "103"),
+            keypad,
+            Button(self.lutron, keypad, "On", 1, "Toggle", None, "104"),
+            Led(self.lutron, keypad, "LED 1", 1, 81, "105"),
+            MotionSensor(self.lutron, "Sensor", 20, "106"),
+            OccupancyGroup(self.lutron, "1", "107"),
+            AreaSummary(self.lutron, "Room", 5),
+        ]
+        for entity in entities:
+            with self.subTest(entity=type(entity).__name__):
+                self.assertFalse(hasattr(entity, '__dict__'))
+                with self.assertRaises(AttributeError):
+                    entity.extra = 1  # type: ignore[attr-defined]
+
+    def test_lazy_subscribers(self) -> None:
+        output = Output(self.lutron, "Light", 100, "DIMMER", 1, "101")
+        self.assertIsNone(output._subscribers)
+
+        # Updates without subscribers or pending queries allocate nothing.
+        self.lutron._recv('~OUTPUT,1,1,50.00')
+        self.assertEqual(output.last_level(), 50.0)
+        self.assertIsNone(output._subscribers)
+        self.assertEqual(self.lutron._queries, {})
+
+        handler = MagicMock()
+        unsubscribe = output.subscribe(handler, None)
+        self.lutron._recv('~OUTPUT,1,1,60.00')
+        handler.assert_called_once_with(output, None, Output.Event.LEVEL_CHANGED, {'level': 60.0})
+        unsubscribe()
+        self.lutron._recv('~OUTPUT,1,1,70.00')
+        self.assertEqual(handler.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import importlib.util
+import unittest
+from unittest.mock import MagicMock, patch
+from pylutron import Lutron, Output, Led, OccupancyGroup
+from pylutron.state import StateStore
+
+from test_db_cache import MOTORS_XML
+
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+
+class TestArrayStateStore(unittest.TestCase):
+    """Runs without NumPy; TestNumpyStateStore repeats it with NumPy."""
+    use_numpy = False
+
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron.load_xml_db(cache_path=MOTORS_XML)
+        self.lutron._conn = MagicMock()
+        self.store = self.lutron.enable_state_store(use_numpy=self.use_numpy)
+        registry = self.lutron.registry
+        self.outputs = registry.by_type(Output)
+        self.led = registry.by_type(Led)[0]
+        self.group = next(g for g in registry.by_type(OccupancyGroup) if g.id)
+
+    def test_rows_for_every_stateful_entity(self) -> None:
+        registry = self.lutron.registry
+        self.assertIs(self.lutron.enable_state_store(), self.store)
+        self.assertEqual(len(self.store), len(self.outputs) + len(registry.by_type(Led)) +
+                         len(registry.by_type(OccupancyGroup)))
+        view = self.store.view()
+        row = self.store.row(self.led)
+        assert row is not None
+        self.assertIs(view.entity(row), self.led)
+        self.assertEqual((view.level[row], view.led[row], view.occupancy[row]), (-1.0, 0, -1))
+        self.assertEqual(view.level_above(), [])
+
+    def test_updates_written_through(self) -> None:
+        output = self.outputs[0]
+        view = self.store.view()
+        with patch('pylutron.state.time.time', return_value=1000.0):
+            self.lutron._recv('~OUTPUT,%d,1,40.00' % output.id)
+            self.lutron._recv('~DEVICE,%d,%d,9,1' % (self.led._keypad.id, self.led.component_number))
+            self.lutron._recv('~GROUP,%d,3,3' % self.group.id)
+        self.assertEqual(view.level_above(), [output])
+        self.assertEqual(view.level_above(50.0), [])
+        self.assertEqual(view.led[self.store.row(self.led)], Led.LED_ON)
+        self.assertEqual(view.occupancy[self.store.row(self.group)], OccupancyGroup.State.OCCUPIED.value)
+        self.assertCountEqual(view.updated_since(999.0), [output, self.led, self.group])
+
+    def test_repeated_reports_keep_updated(self) -> None:
+        output = self.outputs[0]
+        with patch('pylutron.state.time.time', return_value=1000.0):
+            self.lutron._recv('~OUTPUT,%d,1,50.00' % output.id)
+        with patch('pylutron.state.time.time', return_value=2000.0):
+            self.lutron._recv('~OUTPUT,%d,1,50.00' % output.id)
+            self.lutron._recv('~GROUP,%d,3,%d' % (self.group.id, self.group.state.value))
+        view = self.store.view()
+        self.assertEqual(view.updated[self.store.row(output)], 1000.0)
+        self.assertEqual(view.updated_since(1500.0), [])
+
+    def test_snapshot_diff(self) -> None:
+        before = self.store.snapshot()
+        self.lutron._recv('~OUTPUT,%d,1,40.00' % self.outputs[0].id)
+        self.lutron._recv('~OUTPUT,%d,1,0.00' % self.outputs[1].id)
+        self.led.state = Led.LED_SLOW_FLASH
+        after = self.store.snapshot()
+        self.assertEqual(before.level_above(), [])
+        self.assertCountEqual(after.changed(before), [self.outputs[0], self.led])
+        self.assertEqual(after.changed(after), [])
+
+    def test_new_entities_grow_the_store(self) -> None:
+        before = self.store.snapshot()
+        view = self.store.view()
+        lamps = [Output(self.lutron, "Lamp", 60, "INC", 1000 + i, str(i)) for i in range(300)]
+        for lamp in lamps:
+            lamp._cache_level(10.0)
+        self.assertEqual(len(self.store), len(before) + 300)
+        self.assertEqual(self.store.view().level_above(5.0), lamps)
+        self.assertEqual(self.store.snapshot().changed(before), lamps)
+        # Views taken before the store grew see the new rows.
+        self.assertEqual(len(view), len(before) + 300)
+        self.assertFalse(before.live)
+
+    def test_view_follows_growth(self) -> None:
+        output = self.outputs[0]
+        view = self.store.view()
+        old_level = view.level
+        capacity = self.store._capacity
+        for i in range(capacity):
+            Output(self.lutron, "Lamp", 60, "INC", 1000 + i, str(i))._cache_level(0.0)
+        self.assertGreater(self.store._capacity, capacity)
+        # The store's columns were replaced; updates of rows that existed
+        # before are still seen through the view.
+        self.lutron._recv('~OUTPUT,%d,1,40.00' % output.id)
+        row = self.store.row(output)
+        self.assertEqual(view.level[row], 40.0)
+        self.assertEqual(view.level_above(), [output])
+        # A column fetched before the growth is a fixed array over the old buffer.
+        self.assertEqual(old_level[row], 0.0)
+
+
+@unittest.skipUnless(HAS_NUMPY, "NumPy is not installed")
+class TestNumpyStateStore(TestArrayStateStore):
+    use_numpy = True
+
+    def test_columns_are_arrays(self) -> None:
+        self.assertTrue(self.store.numpy)
+        view = self.store.view()
+        self.assertEqual(view.level.shape, (len(self.store),))
+        self.lutron._recv('~OUTPUT,%d,1,40.00' % self.outputs[0].id)
+        self.assertEqual(view.level[self.store.row(self.outputs[0])], 40.0)
+
+
+class TestWithoutNumpy(unittest.TestCase):
+    @unittest.skipIf(HAS_NUMPY, "NumPy is installed")
+    def test_numpy_required_when_asked_for(self) -> None:
+        with self.assertRaises(ImportError):
+            StateStore(Lutron('localhost', 'user', 'pass'), use_numpy=True)
+
+    def test_disabled_by_default(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass')
+        lutron._conn = MagicMock()
+        output = Output(lutron, "Lamp", 60, "INC", 5, "50")
+        output.set_level(20.0)
+        self.assertIsNone(lutron.state_store)
+
+
+if __name__ == '__main__':
+    unittest.main()
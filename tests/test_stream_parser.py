@@ -0,0 +1,117 @@
+import io
+import unittest
+from pylutron import Lutron, LutronXmlDbParser
+from typing import Any, List, Union
+
+from test_complex_xml import COMPLEX_XML
+from test_db_cache import MOTORS_XML, describe
+from test_extended import LEGACY_AND_COMPLEX_XML
+from test_parser import MINIMAL_XML, MOTORIZED_OUTPUTS_XML
+from test_real_xml import REAL_WORLD_XML
+
+
+NESTED_XML = """
+<Project>
+    <GUID>abc</GUID>
+    <Areas>
+        <Area Name="House" IntegrationID="0">
+            <Outputs>
+                <Output Name="Ignored" IntegrationID="90" OutputType="INC" />
+            </Outputs>
+            <Areas>
+                <Area Name="Floor" IntegrationID="1" OccupancyGroupAssignedToID="7">
+                    <DeviceGroups>
+                        <Device Name="Pico" IntegrationID="10" DeviceType="PICO_KEYPAD" UUID="11">
+                            <Components>
+                                <Component ComponentNumber="2" ComponentType="BUTTON">
+                                    <Button Engraving="On" ButtonType="SingleAction" UUID="12" />
+                                </Component>
+                            </Components>
+                        </Device>
+                        <Bogus />
+                    </DeviceGroups>
+                    <Outputs>
+                        <Output Name="Hall" IntegrationID="20" OutputType="INC" UUID="21" />
+                    </Outputs>
+                    <Areas>
+                        <Area Name="Room" IntegrationID="2" OccupancyGroupAssignedToID="8">
+                            <Outputs>
+                                <Output Name="Lamp" IntegrationID="30" OutputType="SYSTEM_SHADE" UUID="31" />
+                            </Outputs>
+                        </Area>
+                    </Areas>
+                </Area>
+            </Areas>
+        </Area>
+    </Areas>
+    <OccupancyGroups>
+        <OccupancyGroup OccupancyGroupNumber="7" UUID="70" />
+        <OccupancyGroup OccupancyGroupNumber="8" UUID="80" />
+    </OccupancyGroups>
+</Project>
+"""
+
+
+def parse_dom(xml: Union[str, bytes]) -> List[Any]:
+    lutron = Lutron('localhost', 'user', 'pass')
+    parser = LutronXmlDbParser(lutron, xml)
+    parser.parse()
+    lutron._areas = parser.areas
+    lutron._name = parser.project_name or ""
+    return describe(lutron)
+
+
+def parse_streamed(xml: Union[str, bytes], chunk_size: int) -> List[Any]:
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    lutron = Lutron('localhost', 'user', 'pass')
+    parser = LutronXmlDbParser(lutron)
+    parser.parse_stream(io.BytesIO(xml), chunk_size=chunk_size)
+    lutron._areas = parser.areas
+    lutron._name = parser.project_name or ""
+    return describe(lutron)
+
+
+class TestStreamingParser(unittest.TestCase):
+    def test_same_graph_as_dom_parser(self) -> None:
+        with open(MOTORS_XML, 'rb') as f:
+            motors = f.read()
+        for xml in (MINIMAL_XML, MOTORIZED_OUTPUTS_XML, COMPLEX_XML, LEGACY_AND_COMPLEX_XML,
+                    REAL_WORLD_XML, NESTED_XML, motors):
+            expected = parse_dom(xml)
+            for chunk_size in (7, 4096):
+                with self.subTest(xml=xml[:40], chunk_size=chunk_size):
+                    self.assertEqual(parse_streamed(xml, chunk_size), expected)
+
+    def test_groups_after_areas(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass')
+        parser = LutronXmlDbParser(lutron)
+        parser.feed(NESTED_XML.encode('utf-8'))
+        self.assertEqual(parser.areas, [])
+        self.assertTrue(parser.close())
+
+        self.assertEqual(parser.project_name, "House")
+        self.assertEqual(lutron.guid, "abc")
+        self.assertEqual([a.name for a in parser.areas], ["Floor", "Room"])
+        floor, room = parser.areas
+        self.assertEqual(floor.occupancy_group.uuid, "70")
+        self.assertEqual(room.occupancy_group.uuid, "80")
+        self.assertEqual([o.name for o in floor.outputs], ["Hall"])
+        self.assertEqual(floor.keypads[0].location, "Pico")
+        self.assertEqual(len(floor.keypads[0].buttons), 1)
+
+    def test_processed_elements_are_discarded(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass')
+        parser = LutronXmlDbParser(lutron)
+        xml = NESTED_XML.encode('utf-8')
+        cut = xml.index(b'<OccupancyGroups>')
+        parser.feed(xml[:cut])
+        root = parser._stack[0]
+        # Everything before the groups has been handled and dropped.
+        self.assertEqual(list(root), [])
+        parser.feed(xml[cut:])
+        parser.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import MagicMock
+from pylutron import (Lutron, LutronXmlDbParser, Output, Shade, Keypad, Button,
+                      ThreadPoolDispatcher)
+from typing import Any, List, Tuple
+
+from test_stream_parser import NESTED_XML
+
+
+class TestSubscribeEvents(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        parser = LutronXmlDbParser(self.lutron, NESTED_XML)
+        self.assertTrue(parser.parse())
+        self.lutron._areas = parser.areas
+        self.lutron._conn = MagicMock()
+        self.floor, self.room = self.lutron.areas
+        self.events: List[Tuple[Any, Any]] = []
+
+    def handler(self, obj: Any, context: Any, event: Any, params: Any) -> None:
+        self.events.append((obj.id, context))
+
+    def test_by_type_and_event(self) -> None:
+        self.lutron.subscribe_events(self.handler, 'shades', entity_type=Shade)
+        self.lutron.subscribe_events(self.handler, 'levels', event=Output.Event.LEVEL_CHANGED)
+        self.lutron.subscribe_events(self.handler, 'presses', entity_type=Button,
+                                     event=Button.Event.PRESSED)
+        self.lutron._recv('~OUTPUT,20,1,50.00')
+        self.lutron._recv('~OUTPUT,30,1,50.00')
+        self.lutron._recv('~DEVICE,10,2,3')
+        self.assertCountEqual(self.events, [(20, 'levels'), (30, 'levels'), (30, 'shades'),
+                                            (10, 'presses')])
+
+    def test_by_area_subtree(self) -> None:
+        self.lutron.subscribe_events(self.handler, 'room', entity_type=Output, area=self.room)
+        self.lutron.subscribe_events(self.handler, 'floor', entity_type=Output, area=self.floor)
+        self.lutron._recv('~OUTPUT,20,1,50.00')
+        self.lutron._recv('~OUTPUT,30,1,50.00')
+        self.assertCountEqual(self.events, [(20, 'floor'), (30, 'floor'), (30, 'room')])
+
+    def test_predicate(self) -> None:
+        self.lutron.subscribe_events(self.handler, 'bright',
+                                     predicate=lambda obj, ev, params: params.get('level', 0) > 75)
+        self.lutron._recv('~OUTPUT,20,1,50.00')
+        self.lutron._recv('~OUTPUT,20,1,80.00')
+        self.assertEqual(self.events, [(20, 'bright')])
+
+    def test_unsubscribe(self) -> None:
+        unsubscribe = self.lutron.subscribe_events(self.handler, 'all', entity_type=Output)
+        self.lutron.subscribe_events(self.handler, 'other', entity_type=Output)
+        unsubscribe()
+        unsubscribe()
+        self.lutron._recv('~OUTPUT,20,1,50.00')
+        self.assertEqual(self.events, [(20, 'other')])
+        self.assertEqual(len(self.lutron._bus._buckets), 1)
+        self.assertEqual(self.lutron._bus._types, {Output: 1})
+
+    def test_entity_unsubscribe_is_idempotent(self) -> None:
+        output = self.room.outputs[0]
+        unsubscribe = output.subscribe(self.handler, 'direct')
+        output.subscribe(self.handler, 'direct')
+        unsubscribe()
+        unsubscribe()
+        self.lutron._recv('~OUTPUT,30,1,50.00')
+        self.assertEqual(self.events, [(30, 'direct')])
+
+    def test_counts_as_subscribed(self) -> None:
+        self.assertEqual(self.lutron.required_monitoring(subscribed_only=True), ())
+        self.lutron.subscribe_events(self.handler, None, entity_type=Keypad, area=self.floor)
+        self.assertEqual(self.lutron.required_monitoring(subscribed_only=True), ())
+        self.lutron.subscribe_events(self.handler, None, entity_type=Output, area=self.room)
+        self.assertEqual(self.lutron.required_monitoring(subscribed_only=True), (5,))
+        self.assertEqual(self.lutron._resync_entities(), [self.room.outputs[0]])
+
+
+class TestQueuedDelivery(unittest.TestCase):
+    def test_through_dispatcher(self) -> None:
+        dispatcher = ThreadPoolDispatcher(workers=2)
+        lutron = Lutron('localhost', 'user', 'pass', dispatcher=dispatcher)
+        self.addCleanup(dispatcher.close)
+        lutron._conn = MagicMock()
+        output = Output(lutron, "Lamp", 60, "INC", 5, "50")
+        handler = MagicMock()
+        lutron.subscribe_events(handler, 'ctx', entity_type=Output)
+        lutron._recv('~OUTPUT,5,1,50.00')
+        self.assertTrue(dispatcher.wait_idle(1))
+        handler.assert_called_once_with(output, 'ctx', Output.Event.LEVEL_CHANGED, {'level': 50.0})
+        self.assertIn(handler, dispatcher.stats.handlers)
+
+
+if __name__ == '__main__':
+    unittest.main()
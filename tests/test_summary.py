@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import MagicMock
+from pylutron import Lutron, Output, Shade, Area, AreaSummary
+from typing import Any, List
+
+
+class TestAreaSummary(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lutron = Lutron('localhost', 'user', 'pass')
+        self.lutron._conn = MagicMock()
+        self.kitchen = Area(self.lutron, "Kitchen", 1, None)
+        self.hall = Area(self.lutron, "Hall", 2, None)
+        self.lamp = Output(self.lutron, "Lamp", 100, "INC", 10, "10")
+        self.spots = Output(self.lutron, "Spots", 50, "INC", 11, "11")
+        self.shade = Shade(self.lutron, "Shade", 0, "SYSTEM_SHADE", 12, "12")
+        self.hall_light = Output(self.lutron, "Hall", 200, "INC", 13, "13")
+        for output in (self.lamp, self.spots, self.shade):
+            self.kitchen.add_output(output)
+        self.hall.add_output(self.hall_light)
+        self.events: List[Any] = []
+        self.kitchen.summary.subscribe(lambda obj, ctx, ev, params: self.events.append(params), None)
+
+    def test_incremental_aggregates(self) -> None:
+        summary = self.kitchen.summary
+        self.assertEqual((summary.lights, summary.lights_on, summary.shades), (2, 0, 1))
+        self.lutron._recv('~OUTPUT,10,1,50.00')
+        self.lutron._recv('~OUTPUT,11,1,100.00')
+        self.lutron._recv('~OUTPUT,12,1,30.00')
+        self.assertEqual(summary.as_dict(), {'lights_on': 2, 'watts': 100.0, 'max_level': 100.0,
+                                             'average_level': 75.0, 'shades_open': 1,
+                                             'shade_position': 30.0})
+        self.lutron._recv('~OUTPUT,11,1,0.00')
+        self.assertEqual((summary.lights_on, summary.watts, summary.max_level), (1, 50.0, 50.0))
+        self.spots.set_level(20.0)
+        self.assertEqual((summary.lights_on, summary.watts, summary.max_level), (2, 60.0, 50.0))
+
+    def test_events_only_on_change(self) -> None:
+        self.lutron._recv('~OUTPUT,10,1,50.00')
+        self.lutron._recv('~OUTPUT,10,1,50.00')
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0]['lights_on'], 1)
+        self.lutron._recv('~OUTPUT,13,1,50.00')
+        self.assertEqual(len(self.events), 1)
+
+    def test_house_rollup(self) -> None:
+        house = self.lutron.summary
+        self.assertIsInstance(house, AreaSummary)
+        self.assertEqual((house.lights, house.shades), (3, 1))
+        self.lutron._recv('~OUTPUT,10,1,100.00')
+        self.lutron._recv('~OUTPUT,13,1,25.00')
+        self.assertEqual((house.lights_on, house.watts, house.max_level), (2, 150.0, 100.0))
+        self.lutron._recv('~OUTPUT,10,1,0.00')
+        self.assertEqual((house.lights_on, house.max_level), (1, 25.0))
+
+    def test_fading_the_brightest_light(self) -> None:
+        lutron = Lutron('localhost', 'user', 'pass')
+        lutron._conn = MagicMock()
+        area = Area(lutron, "Hall", 3, None)
+        lights = [Output(lutron, "Light %d" % i, 10, "INC", 20 + i, str(20 + i)) for i in range(10)]
+        for light in lights:
+            area.add_output(light)
+        for i, light in enumerate(lights[1:], 1):
+            light._cache_level(i * 5.0)
+        summary = area.summary
+        self.assertEqual(summary.max_level, 45.0)
+        # Fade the brightest light down past all the others, then back up.
+        brightest = lights[-1]
+        for level in [l / 2 for l in range(90, -1, -1)] + [l / 2 for l in range(0, 200)]:
+            brightest._cache_level(level)
+            expected = max(light.last_level() for light in lights)
+            self.assertEqual(summary.max_level, expected, level)
+        # Levels the fade left behind don't pile up.
+        self.assertLess(len(summary._level_heap), 2 * len(summary._level_counts) + 18)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import asyncio
+import time
+from pylutron import AsyncLutron, AsyncLutronConnection, LutronConnection, Output
+from typing import Any, List
+
+from fake_controller import FakeController
+
+
+class TestCoalescingWriter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.ctrl = FakeController()
+
+    async def connect(self, **options: Any) -> AsyncLutronConnection:
+        conn = AsyncLutronConnection('127.0.0.1', 'user', 'pass', lambda line: None,
+                                     connection_factory=self.ctrl.factory, **options)
+        await conn.connect()
+        self.addAsyncCleanup(conn.close)
+        self.ctrl.writes.clear()
+        self.ctrl.written.clear()
+        return conn
+
+    async def test_burst_is_one_write(self) -> None:
+        conn = await self.connect()
+        for i in range(60):
+            conn.write('#OUTPUT,%d,1,100.00' % i)
+        await conn.send('#OUTPUT,60,1,100.00')
+
+        self.assertEqual(len(self.ctrl.writes), 1)
+        self.assertEqual(len(self.ctrl.written), 61)
+        self.assertEqual(self.ctrl.written[0], b'#OUTPUT,0,1,100.00\r\n')
+        self.assertEqual(self.ctrl.written[-1], b'#OUTPUT,60,1,100.00\r\n')
+        self.assertEqual(conn.writer_stats.batches, 1)
+        self.assertEqual(conn.writer_stats.commands, 61)
+        self.assertEqual(conn.writer_stats.batch_sizes, {61: 1})
+
+    async def test_max_batch_commands(self) -> None:
+        conn = await self.connect(max_batch_commands=16)
+        for i in range(60):
+            conn.write('#OUTPUT,%d,1,0' % i)
+        await conn.send('#OUTPUT,99,1,0')
+
+        self.assertEqual(len(self.ctrl.writes), 4)
+        self.assertEqual(conn.writer_stats.batch_sizes, {16: 3, 13: 1})
+        self.assertEqual(conn.writer_stats.max_batch, 16)
+        self.assertAlmostEqual(conn.writer_stats.average_batch, 61 / 4)
+
+    async def test_max_batch_bytes(self) -> None:
+        conn = await self.connect(max_batch_bytes=40)
+        # Each command is 18 bytes including CRLF, so two fit per write.
+        for i in range(5):
+            conn.write('#OUTPUT,1%d,1,100' % i)
+        await conn.send('#OUTPUT,15,1,100')
+
+        self.assertEqual([len(w) for w in self.ctrl.writes], [36, 36, 36])
+        self.assertEqual(conn.writer_stats.bytes, 108)
+
+    async def test_lutron_send_is_batched(self) -> None:
+        lutron = AsyncLutron('127.0.0.1', 'user', 'pass', connection_factory=self.ctrl.factory)
+        outputs = [Output(lutron, "Load %d" % i, 100, "DIMMER", i, str(i)) for i in range(1, 11)]
+        await lutron.async_connect()
+        self.addAsyncCleanup(lutron.async_close)
+        self.ctrl.writes.clear()
+
+        for output in outputs:
+            output.set_level(100.0)
+        await asyncio.sleep(0)
+
+        self.assertEqual(len(self.ctrl.writes), 1)
+        self.assertEqual(lutron.writer_stats.commands, 10)
+
+    async def test_disconnect_drops_queue(self) -> None:
+        conn = await self.connect()
+        conn.write('#OUTPUT,1,1,0')
+        await conn.close()
+        await asyncio.sleep(0)
+        self.assertEqual(self.ctrl.writes, [])
+
+
+class TestThreadedWriter(unittest.TestCase):
+    def test_thread_send_uses_writer(self) -> None:
+        received: List[str] = []
+        ctrl = FakeController()
+        conn = LutronConnection('127.0.0.1', 'user', 'pass', received.append,
+                                connection_factory=ctrl.factory)
+
+        async def readline() -> bytes:
+            await asyncio.sleep(10)
+            return b''
+        ctrl.reader.readline.side_effect = readline
+        conn.connect()
+        try:
+            for i in range(5):
+                conn.send('#OUTPUT,%d,1,0' % i)
+            deadline = time.time() + 1.0
+            while conn.writer_stats.commands < 5 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(conn.writer_stats.commands, 5)
+            self.assertEqual(ctrl.written[-1], b'#OUTPUT,4,1,0\r\n')
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import http.server
+import json
+import os
+import tempfile
+import threading
+import unittest
+from pylutron import Lutron
+from typing import Any, List
+
+from test_db_cache import MOTORS_XML, describe
+
+
+class FakeRepeater(http.server.BaseHTTPRequestHandler):
+    """Serves DbXmlInfo.xml like a repeater does, honouring If-None-Match."""
+    body = b''
+    etag = '"1"'
+    truncate = False
+    requests: List[Any] = []
+
+    def do_GET(self) -> None:
+        FakeRepeater.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Last-Modified', 'Mon, 23 Feb 2026 00:10:28 GMT')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body[:len(self.body) // 2] if self.truncate else self.body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class TestConditionalDownload(unittest.TestCase):
+    def setUp(self) -> None:
+        with open(MOTORS_XML, 'rb') as f:
+            FakeRepeater.body = f.read()
+        FakeRepeater.etag = '"1"'
+        FakeRepeater.truncate = False
+        FakeRepeater.requests = []
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeRepeater)
+        thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.host = '127.0.0.1:%d' % server.server_address[1]
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = os.path.join(tmp.name, 'db.xml')
+        self.parsed = os.path.join(tmp.name, 'parsed.json')
+
+    def load(self, **kwargs: Any) -> Lutron:
+        lutron = Lutron(self.host, 'user', 'pass')
+        self.assertTrue(lutron.load_xml_db(cache_path=self.cache, revalidate=True, **kwargs))
+        return lutron
+
+    def test_download_then_not_modified(self) -> None:
+        reference = Lutron('localhost', 'user', 'pass')
+        reference.load_xml_db(cache_path=MOTORS_XML)
+
+        first = self.load()
+        with open(self.cache, 'rb') as f:
+            self.assertEqual(f.read(), FakeRepeater.body)
+        with open(self.cache + '.meta') as f:
+            meta = json.load(f)
+        self.assertEqual(meta['etag'], '"1"')
+        self.assertEqual(meta['length'], len(FakeRepeater.body))
+
+        second = self.load()
+        self.assertEqual(FakeRepeater.requests, [('/DbXmlInfo.xml', None), ('/DbXmlInfo.xml', '"1"')])
+        self.assertEqual(describe(first), describe(reference))
+        self.assertEqual(describe(second), describe(reference))
+
+    def test_changed_database_is_replaced(self) -> None:
+        self.load()
+        FakeRepeater.etag = '"2"'
+        FakeRepeater.body = FakeRepeater.body.replace(b'Joao Almeida', b'Renamed')
+        self.load()
+        with open(self.cache, 'rb') as f:
+            self.assertIn(b'Renamed', f.read())
+        with open(self.cache + '.meta') as f:
+            self.assertEqual(json.load(f)['etag'], '"2"')
+
+    def test_not_modified_uses_parsed_cache(self) -> None:
+        self.load(parsed_cache_path=self.parsed)
+        os.remove(self.cache)
+        with open(self.cache, 'wb') as f:
+            f.write(b'x' * len(FakeRepeater.body))
+        lutron = self.load(parsed_cache_path=self.parsed)
+        self.assertEqual(FakeRepeater.requests[-1], ('/DbXmlInfo.xml', '"1"'))
+        self.assertEqual(len(lutron.areas), 18)
+
+    def test_truncated_download_keeps_old_cache(self) -> None:
+        self.load()
+        FakeRepeater.etag = '"2"'
+        FakeRepeater.truncate = True
+        with self.assertRaises(Exception):
+            Lutron(self.host, 'user', 'pass').load_xml_db(cache_path=self.cache, revalidate=True)
+        with open(self.cache, 'rb') as f:
+            self.assertEqual(f.read(), FakeRepeater.body)
+        with open(self.cache + '.meta') as f:
+            self.assertEqual(json.load(f)['etag'], '"1"')
+        self.assertFalse(os.path.exists(self.cache + '.tmp'))
+
+    def test_retry_after_truncated_download(self) -> None:
+        self.load()
+        FakeRepeater.etag = '"2"'
+        FakeRepeater.truncate = True
+        lutron = Lutron(self.host, 'user', 'pass')
+        with self.assertRaises(Exception):
+            lutron.load_xml_db(cache_path=self.cache, revalidate=True)
+        self.assertEqual(lutron._ids, {})
+        FakeRepeater.truncate = False
+        self.assertTrue(lutron.load_xml_db(cache_path=self.cache, revalidate=True))
+        self.assertEqual(len(lutron.areas), 18)
+        reference = self.load()
+        self.assertEqual(describe(lutron), describe(reference))
+        summary, expected = lutron.summary, reference.summary
+        self.assertEqual((summary.lights, summary.shades), (expected.lights, expected.shades))
+
+    def test_meta_without_matching_cache_refetches(self) -> None:
+        self.load()
+        with open(self.cache, 'ab') as f:
+            f.write(b'\n')
+        self.load()
+        self.assertEqual(FakeRepeater.requests[-1], ('/DbXmlInfo.xml', None))
+
+
+if __name__ == '__main__':
+    unittest.main()